@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Benchmark de validación de lotes: modelos Pydantic por fila vs. esquemas livianos (lean_schema + TypeAdapter)
+#
+# Uso: python scripts/bench_chunk_validation.py [--rows 1000] [--repeat 30]
+#
+# Cada servicio tiene su propio paquete `app`, así que cada uno se mide en un subproceso.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = {
+    "persistence": os.path.join(ROOT, "services", "persistence_service"),
+    "classification": os.path.join(ROOT, "services", "classification_service"),
+}
+
+RELATO = "ACTA DE PROCEDIMIENTO En la localidad de José C. Paz, siendo las 19:06 horas, el suscripto " * 12
+
+
+def measure(fn, repeat):
+    """(ms por llamada, KiB retenidos por el resultado)"""
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = (time.perf_counter() - start) / repeat * 1000
+    tracemalloc.start()
+    result = fn()
+    retained = tracemalloc.get_traced_memory()[0] / 1024
+    tracemalloc.stop()
+    del result
+    return elapsed, retained
+
+
+def bench_persistence(rows, repeat):
+    from app.models import (
+        ChunkResponse,
+        SaveClassifiedChunkRequest,
+        chunk_adapter,
+        save_classified_adapter,
+    )
+
+    db_rows = [{"id": i + 1, "row_index": i, "col_p": "Robo - Art.164 Consumado: Si", "col_q": RELATO} for i in range(rows)]
+    save_body = json.dumps({
+        "document_id": "bench",
+        "items": [
+            {"raw_incident_id": i + 1, "col_s": "ROBO", "col_t": "ARMA BLANCA", "col_ab": "observación " * 10}
+            for i in range(rows)
+        ],
+    }).encode()
+
+    def chunk_models():
+        # Modelo de respuesta + re-validación de response_model + json.dumps de FastAPI
+        model = ChunkResponse(document_id="bench", items=db_rows)
+        content = ChunkResponse.model_validate(model.model_dump(exclude_unset=True))
+        return json.dumps(content.model_dump(mode="json"), ensure_ascii=False).encode()
+
+    def chunk_lean():
+        return chunk_adapter.dump_json(chunk_adapter.validate_python({"document_id": "bench", "items": db_rows}))
+
+    def save_models():
+        return [item.model_dump() for item in SaveClassifiedChunkRequest.model_validate_json(save_body).items]
+
+    def save_lean():
+        return save_classified_adapter.validate_json(save_body)["items"]
+
+    return [
+        ("GET /data/chunk (JSON)", measure(chunk_models, repeat), measure(chunk_lean, repeat)),
+        ("POST /data/save_classified_chunk (JSON)", measure(save_models, repeat), measure(save_lean, repeat)),
+    ]
+
+
+def bench_classification(rows, repeat):
+    from app.models import ChunkResponse, RawIncidentData
+
+    body = json.dumps({
+        "document_id": "bench",
+        "items": [{"id": i + 1, "row_index": i, "col_p": "Robo - Art.164 Consumado: Si", "col_q": RELATO} for i in range(rows)],
+    }).encode()
+
+    def parse_models():
+        # Un RawIncidentData por fila y model_dump para el clasificador
+        data = json.loads(body)
+        return [RawIncidentData(**item).model_dump(exclude_none=True) for item in data["items"]]
+
+    def parse_lean():
+        return ChunkResponse.model_validate_json(body).items
+
+    return [("Lote recibido en el worker (JSON)", measure(parse_models, repeat), measure(parse_lean, repeat))]
+
+
+def run_service(service, rows, repeat):
+    sys.path.insert(0, SERVICES[service])
+    bench = bench_persistence if service == "persistence" else bench_classification
+    print(json.dumps(bench(rows, repeat)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de validación de lotes")
+    parser.add_argument("--rows", type=int, default=1000, help="Filas por lote")
+    parser.add_argument("--repeat", type=int, default=30, help="Repeticiones por medición")
+    parser.add_argument("--service", choices=sorted(SERVICES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.service:
+        return run_service(args.service, args.rows, args.repeat)
+
+    print(f"Lotes de {args.rows} filas, {args.repeat} repeticiones\n")
+    print(f"{'ruta':42} {'modelos ms':>11} {'lean ms':>9} {'x':>6} {'modelos KiB':>12} {'lean KiB':>9}")
+    for service, path in SERVICES.items():
+        out = subprocess.run(
+            [sys.executable, __file__, "--service", service, "--rows", str(args.rows), "--repeat", str(args.repeat)],
+            cwd=path, capture_output=True, text=True, check=True,
+        )
+        for name, (models_ms, models_kib), (lean_ms, lean_kib) in json.loads(out.stdout.strip().splitlines()[-1]):
+            print(f"{name:42} {models_ms:11.2f} {lean_ms:9.2f} {models_ms / lean_ms:6.1f} {models_kib:12.0f} {lean_kib:9.0f}")
+
+
+if __name__ == "__main__":
+    main()
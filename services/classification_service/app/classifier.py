@@ -1,99 +1,110 @@
 import json
+import os
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 
-BASE = Path(__file__).resolve().parents[2]  # raíz del repo
-CONFIG_DIR = BASE / "config"
+
+def _config_dir() -> Path:
+    """CLASSIFIER_CONFIG_DIR, o el primer config/ con el diccionario subiendo desde este archivo (/app/config en Docker, config/ del repo)."""
+    if os.getenv("CLASSIFIER_CONFIG_DIR"):
+        return Path(os.getenv("CLASSIFIER_CONFIG_DIR"))
+    here = Path(__file__).resolve()
+    for parent in here.parents:
+        if (parent / "config" / "diccionario_policial.json").exists():
+            return parent / "config"
+    return here.parents[1] / "config"
+
+
+CONFIG_DIR = _config_dir()
 
 
 def load_rules():
     dicc = json.loads((CONFIG_DIR / "diccionario_policial.json").read_text(encoding="utf-8"))
-    criterios = (CONFIG_DIR / "criterios.txt").read_text(encoding="utf-8").splitlines()
+    # criterios.txt es opcional (el puntaje usa solo el diccionario)
+    criterios_path = CONFIG_DIR / "criterios.txt"
+    criterios = criterios_path.read_text(encoding="utf-8").splitlines() if criterios_path.exists() else []
     return dicc, criterios
 
 
+class RuleEngine:
+    """
+    Diccionario compilado una vez: palabras clave y criterios ya en minúsculas, en el orden del JSON.
+    Cada fila solo recorre listas de strings, sin leer ni parsear el diccionario.
+    """
+
+    def __init__(self, dicc: Dict[str, Any]):
+        # Una entrada por calificación; una calificación repetida reemplaza a la anterior en su posición
+        delitos: Dict[str, Tuple[List[str], List[Tuple[Optional[str], List[str]]]]] = {}
+        for delito_info in dicc.get("delitos", []):
+            calificacion = delito_info.get("calificacion", "")
+            keywords = [calificacion.lower()] + [word.lower() for word in calificacion.split()]
+            modalidades = [
+                (modalidad.get("nombre"), [criterio.lower() for criterio in modalidad.get("criterios", [])])
+                for modalidad in delito_info.get("modalidades", [])
+            ]
+            delitos[calificacion] = (keywords, modalidades)
+        self.delitos = list(delitos.items())
+
+    def score(self, texto: str) -> Tuple[Optional[str], Optional[str], float, str]:
+        """(categoria, subtipo, puntuación, observaciones) de un texto ya en minúsculas."""
+        mejor = None
+        for calificacion, (keywords, modalidades) in self.delitos:
+            # Puntuación alta por coincidencia exacta del delito principal
+            score = 0
+            for keyword in keywords:
+                if keyword in texto:
+                    score += 2
+            # Bonus por la primera modalidad con criterios presentes (solo una modalidad por delito)
+            subtipo = None
+            for nombre, criterios in modalidades:
+                modalidad_score = sum(1 for criterio in criterios if criterio in texto)
+                if modalidad_score > 0:
+                    score += modalidad_score * 1.5
+                    subtipo = nombre
+                    break
+            # El primero con la mayor puntuación
+            if score > 0 and (mejor is None or score > mejor[2]):
+                mejor = (calificacion, subtipo, score)
+
+        if mejor is None:
+            return None, None, 0, "No se encontraron coincidencias en el diccionario"
+        calificacion, subtipo, score = mejor
+        # Solo clasificar si la puntuación es suficientemente alta
+        if score < 2:  # Umbral mínimo de confianza
+            return None, None, score, f"Puntuación insuficiente para clasificación automática ({score})"
+        return calificacion, subtipo, score, f"Clasificado por reglas (puntuación: {score})"
+
+
+_engine: Optional[Tuple[float, RuleEngine]] = None
+
+
+def rule_engine() -> RuleEngine:
+    """Motor compilado y en memoria; se vuelve a compilar solo si cambia diccionario_policial.json."""
+    global _engine
+    mtime = (CONFIG_DIR / "diccionario_policial.json").stat().st_mtime
+    cached = _engine
+    if cached is None or cached[0] != mtime:
+        dicc, _ = load_rules()
+        cached = _engine = (mtime, RuleEngine(dicc))
+    return cached[1]
+
+
 def classify_rows(rows: List[Dict[str, Any]], strategy: str = "rules") -> List[Dict[str, Any]]:
     """
     Clasifica filas usando algoritmo de puntuación por coincidencias múltiples.
     Evalúa TODOS los delitos del diccionario y elige el que tenga más coincidencias.
     """
-    dicc, criterios = load_rules()
+    engine = rule_engine()
     out = []
     
     for row in rows:
         texto = " ".join([str(v) for v in row.values() if isinstance(v, (str, int, float))]).lower()
-        
-        # Sistema de puntuación para cada delito
-        delito_scores = {}
-        
-        # Evaluar cada delito del diccionario
-        for delito_info in dicc.get("delitos", []):
-            calificacion = delito_info.get("calificacion", "")
-            modalidades = delito_info.get("modalidades", [])
-            
-            # Puntuación base del delito principal
-            score = 0
-            for keyword in [calificacion.lower()] + [word.lower() for word in calificacion.split()]:
-                if keyword in texto:
-                    score += 2  # Puntuación alta por coincidencia exacta
-            
-            # Evaluar modalidades específicas
-            for modalidad in modalidades:
-                modalidad_score = 0
-                criterios_modalidad = modalidad.get("criterios", [])
-                
-                for criterio in criterios_modalidad:
-                    if criterio.lower() in texto:
-                        modalidad_score += 1
-                
-                # Si hay modalidad específica, dar bonus
-                if modalidad_score > 0:
-                    score += modalidad_score * 1.5
-                    break  # Solo una modalidad por delito
-            
-            # Guardar puntuación del delito
-            if score > 0:
-                delito_scores[calificacion] = {
-                    "score": score,
-                    "modalidades": modalidades,
-                    "base_legal": delito_info.get("base_legal", "")
-                }
-        
-        # Elegir el delito con mayor puntuación
-        categoria = None
-        subtipo = None
-        observaciones = None
-        
-        if delito_scores:
-            # Ordenar por puntuación descendente
-            mejor_delito = max(delito_scores.items(), key=lambda x: x[1]["score"])
-            delito_nombre, delito_info = mejor_delito
-            
-            # Solo clasificar si la puntuación es suficientemente alta
-            if delito_info["score"] >= 2:  # Umbral mínimo de confianza
-                categoria = delito_nombre
-                
-                # Buscar modalidad específica si existe
-                for modalidad in delito_info["modalidades"]:
-                    modalidad_score = 0
-                    for criterio in modalidad.get("criterios", []):
-                        if criterio.lower() in texto:
-                            modalidad_score += 1
-                    
-                    if modalidad_score > 0:
-                        subtipo = modalidad.get("nombre")
-                        break
-                
-                observaciones = f"Clasificado por reglas (puntuación: {delito_info['score']})"
-            else:
-                observaciones = f"Puntuación insuficiente para clasificación automática ({delito_info['score']})"
-        else:
-            observaciones = "No se encontraron coincidencias en el diccionario"
-        
+        categoria, subtipo, score, observaciones = engine.score(texto)
         out.append({
             "row_id": row.get("row_id"),
             "categoria": categoria,
             "subtipo": subtipo,
+            "score": score,
             "observaciones": observaciones,
         })
     
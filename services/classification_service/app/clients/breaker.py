@@ -0,0 +1,99 @@
+"""
+Circuit breaker y presupuesto de reintentos hacia el servicio de persistencia.
+
+Con persistencia caída, los reintentos anidados (tenacity dentro del reintento de la tarea)
+multiplican la carga y dejan workers durmiendo. El breaker corta en seco después de
+PERSISTENCE_BREAKER_FAILURES fallas seguidas: mientras está abierto cada request falla al
+instante con CircuitOpenError (que dice cuándo volver a intentar) y pasado
+PERSISTENCE_BREAKER_RESET deja pasar un único request de prueba. El presupuesto limita los
+reintentos a una proporción de los requests del proceso.
+"""
+import threading
+import time
+from typing import Any, Dict
+
+
+class CircuitOpenError(Exception):
+    """Persistencia marcada como caída: no se envía el request."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Circuito hacia persistencia abierto; reintentar en {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_request(self) -> None:
+        """Deja pasar el request o lanza CircuitOpenError; en half-open pasa solo el de prueba."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if self._state == self.OPEN and remaining <= 0:
+                self._state = self.HALF_OPEN
+                return
+            raise CircuitOpenError(max(remaining, 1.0) if self._state == self.OPEN else self.reset_timeout)
+
+    def record(self, failed: bool) -> None:
+        with self._lock:
+            if self._state == self.OPEN:
+                # Requests que salieron antes de abrir: no cambian el estado
+                return
+            if not failed:
+                self._state = self.CLOSED
+                self._failures = 0
+                return
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def cancel(self) -> None:
+        """El request autorizado no llegó a salir: si era el de prueba, el siguiente puede probar."""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic() - self.reset_timeout
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self._state, "consecutive_failures": self._failures}
+
+
+class RetryBudget:
+    """
+    Cada request deposita `ratio` fichas y cada reintento gasta una (hasta `max_tokens` acumuladas):
+    los reintentos nunca superan esa proporción del tráfico, por más que fallen todos los requests.
+    """
+
+    def __init__(self, ratio: float, max_tokens: float):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"tokens": round(self._tokens, 2)}
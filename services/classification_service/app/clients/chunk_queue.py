@@ -0,0 +1,96 @@
+"""
+Consumidor de la cola de lotes que publica el servicio de persistencia al importar (CHUNK_QUEUE_ENABLED).
+
+Cada documento tiene un stream con un descriptor (row_from, row_to, filas) por lote y un consumer
+group común. Un worker reclama primero con XAUTOCLAIM los descriptores que otro tomó y no confirmó en
+CHUNK_QUEUE_CLAIM_IDLE_MS (worker caído) y si no hay, espera uno nuevo con XREADGROUP bloqueante.
+Después de guardar el lote lo confirma con XACK y lo borra del stream, así que el stream vacío
+significa que todos los lotes publicados se guardaron.
+"""
+import os
+import socket
+from typing import NamedTuple, Optional
+
+CHUNK_QUEUE_ENABLED = os.getenv("CHUNK_QUEUE_ENABLED", "false").lower() == "true"
+CHUNK_QUEUE_PREFIX = os.getenv("CHUNK_QUEUE_PREFIX", "sentinel:chunks")
+CHUNK_QUEUE_GROUP = os.getenv("CHUNK_QUEUE_GROUP", "classifiers")
+# Un descriptor tomado y sin confirmar durante este tiempo se le entrega a otro worker
+CHUNK_QUEUE_CLAIM_IDLE_MS = int(os.getenv("CHUNK_QUEUE_CLAIM_IDLE_MS", "120000"))
+# Espera máxima de XREADGROUP por un descriptor nuevo
+CHUNK_QUEUE_BLOCK_MS = int(os.getenv("CHUNK_QUEUE_BLOCK_MS", "2000"))
+
+
+class ChunkDescriptor(NamedTuple):
+    entry_id: str
+    row_from: int
+    row_to: int
+    rows: int
+
+
+class ChunkQueueConsumer:
+    def __init__(self, redis_client, prefix: str, group: str, claim_idle_ms: int, block_ms: int):
+        self._redis = redis_client
+        self._prefix = prefix
+        self._group = group
+        self._claim_idle_ms = claim_idle_ms
+        self._block_ms = block_ms
+
+    def _stream(self, document_id: str) -> str:
+        return f"{self._prefix}:{document_id}"
+
+    def _consumer(self) -> str:
+        # Un consumidor por proceso: lo pendiente de un proceso caído lo reclaman los demás
+        return f"{socket.gethostname()}-{os.getpid()}"
+
+    def has_document(self, document_id: str) -> bool:
+        """True si persistencia publicó lotes del documento (el stream puede estar vacío si ya se guardaron todos)."""
+        return bool(self._redis.exists(self._stream(document_id)))
+
+    def take(self, document_id: str) -> Optional[ChunkDescriptor]:
+        """Siguiente descriptor del documento, o None si no llegó ninguno en CHUNK_QUEUE_BLOCK_MS."""
+        key = self._stream(document_id)
+        consumer = self._consumer()
+        entries = self._redis.xautoclaim(
+            key, self._group, consumer, min_idle_time=self._claim_idle_ms, start_id="0-0", count=1
+        )[1]
+        if not entries:
+            response = self._redis.xreadgroup(self._group, consumer, {key: ">"}, count=1, block=self._block_ms)
+            entries = response[0][1] if response else []
+        for entry_id, fields in entries:
+            # XAUTOCLAIM devuelve sin campos las entradas que ya no existen
+            if fields:
+                return ChunkDescriptor(entry_id, int(fields["row_from"]), int(fields["row_to"]), int(fields["rows"]))
+        return None
+
+    def ack(self, document_id: str, descriptor: ChunkDescriptor) -> None:
+        """Confirma el lote guardado y lo saca del stream."""
+        key = self._stream(document_id)
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.xack(key, self._group, descriptor.entry_id)
+        pipe.xdel(key, descriptor.entry_id)
+        pipe.execute()
+
+    def remaining(self, document_id: str) -> int:
+        """Descriptores sin confirmar (sin entregar o tomados por algún worker)."""
+        return self._redis.xlen(self._stream(document_id))
+
+
+def open_chunk_queue() -> Optional[ChunkQueueConsumer]:
+    """Consumidor configurado por entorno (REDIS_HOST/PORT/DB/PASSWORD), o None si la cola está deshabilitada."""
+    if not CHUNK_QUEUE_ENABLED:
+        return None
+    from redis import Redis
+
+    redis_client = Redis(
+        host=os.getenv("REDIS_HOST", "localhost"),
+        port=int(os.getenv("REDIS_PORT", "6379")),
+        db=int(os.getenv("REDIS_DB", "0")),
+        password=os.getenv("REDIS_PASSWORD"),
+        # Por encima de la espera de XREADGROUP
+        socket_timeout=CHUNK_QUEUE_BLOCK_MS / 1000 + 5,
+        socket_connect_timeout=5,
+        decode_responses=True,
+    )
+    return ChunkQueueConsumer(
+        redis_client, CHUNK_QUEUE_PREFIX, CHUNK_QUEUE_GROUP, CHUNK_QUEUE_CLAIM_IDLE_MS, CHUNK_QUEUE_BLOCK_MS
+    )
@@ -0,0 +1,126 @@
+"""
+Lotes combinados de documentos chicos (SMALL_DOC_BATCHING).
+
+Un documento de pocas filas paga una tarea de Celery, una escritura en el result backend y al menos
+dos requests a persistencia para unas decenas de filas. Con SMALL_DOC_BATCHING, POST /classify
+anota los documentos de hasta SMALL_DOC_MAX_ROWS filas pendientes en la ventana abierta de su
+estrategia, y la primera anotación de cada ventana programa una única classify_documents_task que
+arranca SMALL_DOC_WINDOW segundos después. Cada ventana tiene su propia lista en Redis, de hasta
+SMALL_DOC_MAX_DOCS documentos, que se anota y se toma con scripts Lua: un documento siempre lo
+clasifica la tarea cuyo task_id recibió quien lo anotó. Esa tarea pide sus filas en un solo request
+(/data/chunks), las clasifica juntas y las guarda por documento en otro (/data/save_classified_chunks).
+
+Si el worker cae después de tomar los documentos, sus filas siguen pendientes en persistencia:
+basta volver a pedir /classify para esos documentos.
+"""
+import json
+import os
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+SMALL_DOC_BATCHING = os.getenv("SMALL_DOC_BATCHING", "false").lower() == "true"
+# Filas pendientes hasta las que un documento se suma a un lote combinado
+SMALL_DOC_MAX_ROWS = int(os.getenv("SMALL_DOC_MAX_ROWS", "500"))
+# Segundos que espera la tarea combinada a que se sumen más documentos
+SMALL_DOC_WINDOW = float(os.getenv("SMALL_DOC_WINDOW", "2"))
+# Documentos por tarea combinada; con la ventana llena se abre otra
+SMALL_DOC_MAX_DOCS = int(os.getenv("SMALL_DOC_MAX_DOCS", "50"))
+# Filas por request de /data/chunks (entre todos los documentos del lote)
+SMALL_DOC_BATCH_ROWS = int(os.getenv("SMALL_DOC_BATCH_ROWS", "1000"))
+SMALL_DOC_PREFIX = os.getenv("SMALL_DOC_PREFIX", "sentinel:small_docs")
+
+
+# Segundos que sobrevive la lista de una tarea que nunca llegó a correr (encolado perdido)
+_ENTRIES_TTL = 86400
+
+# Anota el documento en la lista de la ventana abierta, o abre una nueva si no hay o está llena.
+# Anotar y tomar la ventana van juntos: cada documento queda en la lista de la tarea cuyo id se devuelve
+_ADD_LUA = """
+local task = redis.call('GET', KEYS[1])
+local schedule = 0
+if task and redis.call('LLEN', ARGV[5] .. task) >= tonumber(ARGV[4]) then
+    task = false
+end
+if not task then
+    task = ARGV[1]
+    redis.call('SET', KEYS[1], task, 'EX', ARGV[2])
+    schedule = 1
+end
+redis.call('RPUSH', ARGV[5] .. task, ARGV[3])
+redis.call('EXPIRE', ARGV[5] .. task, ARGV[6])
+return {task, schedule}
+"""
+
+# Cierra la ventana si sigue siendo la de esta tarea y toma su lista completa
+_DRAIN_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+local entries = redis.call('LRANGE', KEYS[2], 0, -1)
+redis.call('DEL', KEYS[2])
+return entries
+"""
+
+
+class DocumentBatcher:
+    def __init__(self, redis_client, prefix: str, window: float, max_docs: int):
+        self._redis = redis_client
+        self._prefix = prefix
+        self._window = window
+        self._max_docs = max_docs
+        self._add_script = redis_client.register_script(_ADD_LUA)
+        self._drain_script = redis_client.register_script(_DRAIN_LUA)
+
+    def _entries_prefix(self, strategy: str) -> str:
+        # Lista de documentos de cada tarea combinada: <prefijo><task_id>
+        return f"{self._prefix}:{strategy}:docs:"
+
+    def _window_key(self, strategy: str) -> str:
+        # task_id de la tarea combinada programada para la ventana abierta
+        return f"{self._prefix}:{strategy}:task"
+
+    def add(self, document_id: str, strategy: str, generate_final: bool) -> Tuple[str, bool]:
+        """
+        Anota el documento y devuelve (task_id de la tarea combinada que lo clasifica, programar);
+        quien recibe programar=True encola la tarea con ese task_id.
+        """
+        entry = json.dumps({"document_id": document_id, "generate_final": generate_final})
+        # La ventana vence sola por si la tarea no llega a arrancar (se pierde el encolado)
+        task_id, schedule = self._add_script(
+            keys=[self._window_key(strategy)],
+            args=[str(uuid.uuid4()), int(self._window) + 60, entry, self._max_docs, self._entries_prefix(strategy), _ENTRIES_TTL],
+        )
+        return task_id, bool(schedule)
+
+    def drain(self, strategy: str, task_id: str) -> List[Dict[str, Any]]:
+        """
+        Cierra la ventana de la tarea y toma los documentos anotados para ella (como mucho max_docs).
+        Lo anotado después abre una ventana nueva, con otra tarea.
+        """
+        entries = self._drain_script(
+            keys=[self._window_key(strategy), self._entries_prefix(strategy) + task_id], args=[task_id]
+        )
+        # Un documento anotado dos veces se clasifica una vez (generate_final si alguna lo pidió)
+        documents: Dict[str, Dict[str, Any]] = {}
+        for entry in map(json.loads, entries):
+            current = documents.setdefault(entry["document_id"], entry)
+            current["generate_final"] = current["generate_final"] or entry["generate_final"]
+        return list(documents.values())
+
+
+def open_document_batcher() -> Optional[DocumentBatcher]:
+    """Lotes combinados configurados por entorno (REDIS_HOST/PORT/DB/PASSWORD), o None si están deshabilitados."""
+    if not SMALL_DOC_BATCHING:
+        return None
+    from redis import Redis
+
+    redis_client = Redis(
+        host=os.getenv("REDIS_HOST", "localhost"),
+        port=int(os.getenv("REDIS_PORT", "6379")),
+        db=int(os.getenv("REDIS_DB", "0")),
+        password=os.getenv("REDIS_PASSWORD"),
+        socket_timeout=5,
+        socket_connect_timeout=5,
+        decode_responses=True,
+    )
+    return DocumentBatcher(redis_client, SMALL_DOC_PREFIX, SMALL_DOC_WINDOW, SMALL_DOC_MAX_DOCS)
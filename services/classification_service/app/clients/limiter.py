@@ -0,0 +1,199 @@
+"""
+Límite de concurrencia adaptativo (AIMD) hacia el servicio de persistencia.
+
+Cada request ocupa un lugar mientras está en vuelo. Si termina bien y por debajo de la latencia
+objetivo, el límite crece de a poco (+1 por ventana llena); si tarda de más, expira o persistencia
+responde 429/5xx, el límite se multiplica por PERSISTENCE_LIMIT_BACKOFF (una vez por ventana: solo
+cuentan los requests que empezaron después de la última baja).
+
+LocalLimiter reparte el límite entre los hilos/corrutinas de un proceso. RedisLimiter lo comparte
+entre todos los workers: con prefork cada proceso tiene a lo sumo un request en vuelo, así que
+solo un límite común en Redis frena al cluster completo.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# Segundos que se usa el límite local después de una falla de Redis
+REDIS_RETRY_AFTER = 10.0
+
+
+class LimiterTimeout(Exception):
+    """No se consiguió lugar dentro del límite de concurrencia en el tiempo de espera."""
+
+
+# (inicio del request, id del lugar en Redis o None si es local)
+Token = Tuple[float, Optional[str]]
+
+
+class LocalLimiter:
+    def __init__(self, initial: float, min_limit: float, max_limit: float, latency_target: float, backoff: float):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self._limit = max(min_limit, min(max_limit, initial))
+        self._in_flight = 0
+        self._decreased_at = 0.0
+        self._cond = threading.Condition()
+
+    def _try_acquire(self) -> Optional[Token]:
+        with self._cond:
+            if self._in_flight < int(self._limit):
+                self._in_flight += 1
+                return time.time(), None
+        return None
+
+    def acquire(self, timeout: float) -> Token:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise LimiterTimeout(f"Sin lugar en el límite de concurrencia ({int(self._limit)}) tras {timeout}s")
+                self._cond.wait(remaining)
+            self._in_flight += 1
+        return time.time(), None
+
+    async def acquire_async(self, timeout: float) -> Token:
+        # Sin esperar si hay lugar; si no, la espera bloqueante va a un hilo para no frenar el event loop
+        return self._try_acquire() or await asyncio.to_thread(self.acquire, timeout)
+
+    def release(self, token: Token, overloaded: bool) -> None:
+        started, _ = token
+        latency = time.time() - started
+        with self._cond:
+            utilized = self._in_flight >= self._limit / 2
+            self._in_flight -= 1
+            if overloaded or latency > self.latency_target:
+                if started > self._decreased_at and self._limit > self.min_limit:
+                    old = self._limit
+                    self._limit = max(self.min_limit, self._limit * self.backoff)
+                    self._decreased_at = time.time()
+                    logger.warning(
+                        f"Persistencia saturada (latencia {latency:.2f}s, error={overloaded}): "
+                        f"límite de concurrencia {old:.1f} -> {self._limit:.1f}"
+                    )
+            elif utilized:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {"kind": "local", "limit": round(self._limit, 2), "in_flight": self._in_flight}
+
+
+# Toma un lugar si hay: descarta los vencidos (workers caídos) y compara con el límite común
+_ACQUIRE_LUA = """
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local limit = tonumber(redis.call('GET', KEYS[2])) or tonumber(ARGV[4])
+if redis.call('ZCARD', KEYS[1]) < math.floor(limit) then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[3])
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# Libera el lugar y aplica AIMD sobre el límite común
+_RELEASE_LUA = """
+local now = tonumber(ARGV[1])
+local started = tonumber(ARGV[3])
+local min_limit = tonumber(ARGV[6])
+local max_limit = tonumber(ARGV[7])
+local in_flight = redis.call('ZCARD', KEYS[1])
+redis.call('ZREM', KEYS[1], ARGV[2])
+local limit = tonumber(redis.call('GET', KEYS[2])) or tonumber(ARGV[5])
+if ARGV[4] == '1' then
+    local decreased_at = tonumber(redis.call('GET', KEYS[3])) or 0
+    if started > decreased_at then
+        limit = math.max(min_limit, limit * tonumber(ARGV[8]))
+        redis.call('SET', KEYS[3], now, 'EX', 86400)
+    end
+elseif in_flight >= limit / 2 then
+    limit = math.min(max_limit, limit + 1 / limit)
+end
+redis.call('SET', KEYS[2], tostring(limit), 'EX', 86400)
+return tostring(limit)
+"""
+
+
+class RedisLimiter(LocalLimiter):
+    """
+    Mismo AIMD con el estado en Redis: los lugares en vuelo son un ZSET con vencimiento (un worker
+    caído no deja lugares tomados) y el límite y la última baja son claves comunes. Si Redis no
+    responde se usa el límite local del proceso.
+    """
+
+    def __init__(self, redis_client, prefix: str, lease_ms: int, poll_interval: float, **kwargs):
+        super().__init__(**kwargs)
+        self._redis = redis_client
+        self._keys = [f"{prefix}:in_flight", f"{prefix}:limit", f"{prefix}:decreased_at"]
+        self._lease_ms = lease_ms
+        self._poll_interval = poll_interval
+        self._acquire_script = redis_client.register_script(_ACQUIRE_LUA)
+        self._release_script = redis_client.register_script(_RELEASE_LUA)
+        self._initial = self._limit
+        # Tras una falla de Redis se usa el límite local un rato en lugar de esperar su timeout en cada request
+        self._redis_down_until = 0.0
+
+    def _redis_try_acquire(self) -> Optional[Token]:
+        token = uuid.uuid4().hex
+        now = time.time()
+        acquired = self._acquire_script(keys=self._keys[:2], args=[int(now * 1000), self._lease_ms, token, self._initial])
+        return (now, token) if acquired else None
+
+    def acquire(self, timeout: float) -> Token:
+        deadline = time.monotonic() + timeout
+        if time.monotonic() < self._redis_down_until:
+            return super().acquire(timeout)
+        try:
+            while True:
+                token = self._redis_try_acquire()
+                if token is not None:
+                    return token
+                if time.monotonic() >= deadline:
+                    raise LimiterTimeout(f"Sin lugar en el límite de concurrencia común tras {timeout}s")
+                # Espera con jitter para que los workers no consulten Redis todos a la vez
+                time.sleep(self._poll_interval * (0.5 + random.random()))
+        except LimiterTimeout:
+            raise
+        except Exception as e:
+            logger.warning(f"Límite de concurrencia en Redis no disponible, se usa el local: {e}")
+            self._redis_down_until = time.monotonic() + REDIS_RETRY_AFTER
+            return super().acquire(max(0.0, deadline - time.monotonic()))
+
+    async def acquire_async(self, timeout: float) -> Token:
+        return await asyncio.to_thread(self.acquire, timeout)
+
+    def release(self, token: Token, overloaded: bool) -> None:
+        started, lease = token
+        if lease is None:
+            return super().release(token, overloaded)
+        overloaded = overloaded or time.time() - started > self.latency_target
+        try:
+            self._release_script(
+                keys=self._keys,
+                args=[
+                    int(time.time() * 1000), lease, int(started * 1000), "1" if overloaded else "0",
+                    self._initial, self.min_limit, self.max_limit, self.backoff,
+                ],
+            )
+        except Exception as e:
+            # El lugar vence solo (lease_ms); el ajuste del límite de este request se pierde
+            logger.warning(f"No se pudo liberar el lugar en Redis: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            limit, in_flight = self._redis.get(self._keys[1]), self._redis.zcard(self._keys[0])
+            return {"kind": "redis", "limit": round(float(limit or self._initial), 2), "in_flight": in_flight}
+        except Exception as e:
+            return {"kind": "redis", "error": str(e), "local": super().stats()}
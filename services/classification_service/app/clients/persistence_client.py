@@ -1,90 +1,484 @@
-import httpx
-import requests
-from tenacity import retry, stop_after_attempt, wait_exponential
-from typing import Dict, Any, Optional
+import gzip
+import importlib.util
 import logging
-from ..models import ChunkResponse, SaveClassifiedChunkRequest
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
+
+from ..models import ChunkResponse, MultiChunkResponse, SaveClassifiedChunkRequest
+from .breaker import CircuitBreaker, RetryBudget
+from .limiter import LocalLimiter, RedisLimiter
+
+try:  # formato binario de lotes; sin msgpack se usa JSON
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:  # Content-Encoding zstd opcional
+    import zstandard
+except ImportError:
+    zstandard = None
 
 logger = logging.getLogger(__name__)
 
+# Pool de conexiones keep-alive hacia persistencia: uno por proceso y por URL, compartido
+# por todas las instancias de PersistenceClient (cada worker de Celery tiene el suyo)
+PERSISTENCE_POOL_MAX_CONNECTIONS = int(os.getenv("PERSISTENCE_POOL_MAX_CONNECTIONS", "20"))
+PERSISTENCE_POOL_MAX_KEEPALIVE = int(os.getenv("PERSISTENCE_POOL_MAX_KEEPALIVE", "10"))
+PERSISTENCE_KEEPALIVE_EXPIRY = float(os.getenv("PERSISTENCE_KEEPALIVE_EXPIRY", "60"))
+PERSISTENCE_CONNECT_TIMEOUT = float(os.getenv("PERSISTENCE_CONNECT_TIMEOUT", "5"))
+# HTTP/2 en el cliente asíncrono: requiere httpx[http2] y se negocia por TLS (ALPN);
+# contra uvicorn en http:// la conexión sigue siendo HTTP/1.1 keep-alive
+PERSISTENCE_HTTP2 = os.getenv("PERSISTENCE_HTTP2", "false").lower() == "true"
+# Socket unix de persistencia (uvicorn --uds) cuando ambos servicios corren en el mismo host
+PERSISTENCE_UDS = os.getenv("PERSISTENCE_UDS") or None
+# Formato de /data/chunk y /data/save_classified_chunk: json o msgpack (columnar, opcional)
+PERSISTENCE_WIRE_FORMAT = os.getenv("PERSISTENCE_WIRE_FORMAT", "json").lower()
+# Compresión de los cuerpos msgpack: none, gzip o zstd (en localhost/socket unix no conviene)
+PERSISTENCE_COMPRESSION = os.getenv("PERSISTENCE_COMPRESSION", "none").lower()
+# Columnas A..Q que se piden en cada lote (vacío: todas). El clasificador puntúa el texto de todos los
+# valores de la fila, así que proyectar columnas puede cambiar la clasificación
+PERSISTENCE_CHUNK_FIELDS = os.getenv("PERSISTENCE_CHUNK_FIELDS", "")
+
+# Límite de concurrencia adaptativo (AIMD): local (por proceso), redis (común a todos los workers) u off
+PERSISTENCE_LIMITER = os.getenv("PERSISTENCE_LIMITER", "local").lower()
+PERSISTENCE_LIMIT_INITIAL = float(os.getenv("PERSISTENCE_LIMIT_INITIAL", "4"))
+PERSISTENCE_LIMIT_MIN = float(os.getenv("PERSISTENCE_LIMIT_MIN", "1"))
+PERSISTENCE_LIMIT_MAX = float(os.getenv("PERSISTENCE_LIMIT_MAX", str(PERSISTENCE_POOL_MAX_CONNECTIONS)))
+# Un request más lento que esto cuenta como saturación (igual que un timeout o un 429/5xx)
+PERSISTENCE_LATENCY_TARGET = float(os.getenv("PERSISTENCE_LATENCY_TARGET", "5"))
+PERSISTENCE_LIMIT_BACKOFF = float(os.getenv("PERSISTENCE_LIMIT_BACKOFF", "0.7"))
+# Espera máxima por un lugar dentro del límite
+PERSISTENCE_LIMIT_WAIT = float(os.getenv("PERSISTENCE_LIMIT_WAIT", "60"))
+PERSISTENCE_LIMITER_PREFIX = os.getenv("PERSISTENCE_LIMITER_PREFIX", "sentinel:persistence_limiter")
+# Circuit breaker: fallas seguidas que lo abren y segundos abierto antes del request de prueba
+PERSISTENCE_BREAKER_FAILURES = int(os.getenv("PERSISTENCE_BREAKER_FAILURES", "5"))
+PERSISTENCE_BREAKER_RESET = float(os.getenv("PERSISTENCE_BREAKER_RESET", "30"))
+# Presupuesto de reintentos: fichas por request y máximo acumulable (un reintento gasta una)
+PERSISTENCE_RETRY_RATIO = float(os.getenv("PERSISTENCE_RETRY_RATIO", "0.2"))
+PERSISTENCE_RETRY_BUDGET_MAX = float(os.getenv("PERSISTENCE_RETRY_BUDGET_MAX", "10"))
+
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+_lock = threading.Lock()
+_pid: Optional[int] = None
+_sync_clients: Dict[str, httpx.Client] = {}
+_async_clients: Dict[str, httpx.AsyncClient] = {}
+_limiter: Optional[LocalLimiter] = None
+_breaker: Optional[CircuitBreaker] = None
+_budget: Optional[RetryBudget] = None
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=PERSISTENCE_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=PERSISTENCE_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=PERSISTENCE_KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout(seconds: float) -> httpx.Timeout:
+    return httpx.Timeout(seconds, connect=min(seconds, PERSISTENCE_CONNECT_TIMEOUT))
+
+
+def _http2_enabled() -> bool:
+    if PERSISTENCE_HTTP2 and importlib.util.find_spec("h2") is None:
+        logger.warning("PERSISTENCE_HTTP2=true pero falta el paquete h2 (httpx[http2]); se usa HTTP/1.1")
+        return False
+    return PERSISTENCE_HTTP2
+
+
+def _check_pid() -> None:
+    # Tras un fork (prefork de Celery) el hijo no reutiliza los sockets heredados del padre:
+    # se descartan sin cerrarlos y cada proceso abre su propio pool
+    global _pid, _limiter, _breaker, _budget
+    pid = os.getpid()
+    if _pid != pid:
+        _sync_clients.clear()
+        _async_clients.clear()
+        _limiter = None
+        _breaker = CircuitBreaker(PERSISTENCE_BREAKER_FAILURES, PERSISTENCE_BREAKER_RESET)
+        _budget = RetryBudget(PERSISTENCE_RETRY_RATIO, PERSISTENCE_RETRY_BUDGET_MAX)
+        _pid = pid
+
+
+def _new_limiter() -> Optional[LocalLimiter]:
+    params = dict(
+        initial=PERSISTENCE_LIMIT_INITIAL,
+        min_limit=PERSISTENCE_LIMIT_MIN,
+        max_limit=PERSISTENCE_LIMIT_MAX,
+        latency_target=PERSISTENCE_LATENCY_TARGET,
+        backoff=PERSISTENCE_LIMIT_BACKOFF,
+    )
+    if PERSISTENCE_LIMITER == "off":
+        return None
+    if PERSISTENCE_LIMITER == "redis":
+        from redis import Redis
+        from redis.backoff import NoBackoff
+        from redis.retry import Retry
+
+        # Sin reintentos propios: si Redis no responde se pasa enseguida al límite local
+        redis_client = Redis(
+            host=os.getenv("REDIS_HOST", "localhost"),
+            port=int(os.getenv("REDIS_PORT", "6379")),
+            db=int(os.getenv("REDIS_DB", "0")),
+            password=os.getenv("REDIS_PASSWORD"),
+            socket_timeout=2,
+            socket_connect_timeout=2,
+            retry=Retry(NoBackoff(), 0),
+        )
+        # Un lugar tomado vence después del timeout más largo de un request (si el worker muere)
+        return RedisLimiter(redis_client, PERSISTENCE_LIMITER_PREFIX, lease_ms=70_000, poll_interval=0.05, **params)
+    return LocalLimiter(**params)
+
+
+def get_limiter() -> Optional[LocalLimiter]:
+    """Límite de concurrencia del proceso (None con PERSISTENCE_LIMITER=off)."""
+    global _limiter
+    with _lock:
+        _check_pid()
+        if _limiter is None and PERSISTENCE_LIMITER != "off":
+            _limiter = _new_limiter()
+        return _limiter
+
+
+def get_breaker() -> CircuitBreaker:
+    """Circuit breaker del proceso hacia persistencia."""
+    with _lock:
+        _check_pid()
+        return _breaker
+
+
+def get_retry_budget() -> RetryBudget:
+    with _lock:
+        _check_pid()
+        return _budget
+
+
+def _overloaded(r: Optional[httpx.Response]) -> bool:
+    # Sin respuesta (timeout, conexión rechazada) o 429/5xx: persistencia no da abasto
+    return r is None or r.status_code == 429 or r.status_code >= 500
+
+
+def _retryable(exc: BaseException) -> bool:
+    """Solo se reintentan fallas transitorias de red o 429/5xx, y solo si queda presupuesto."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        transient = _overloaded(exc.response)
+    else:
+        transient = isinstance(exc, httpx.TransportError)
+    if not transient:
+        return False
+    if not get_retry_budget().withdraw():
+        logger.warning(f"Presupuesto de reintentos hacia persistencia agotado; no se reintenta: {exc}")
+        return False
+    return True
+
+
+# Reintentos de cada método: CircuitOpenError, LimiterTimeout y 4xx llegan al llamador sin reintentar
+_retry = retry(
+    retry=retry_if_exception(_retryable),
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=0.5, max=4),
+    reraise=True,
+)
+
+
+def _sync_client(base_url: str) -> httpx.Client:
+    with _lock:
+        _check_pid()
+        client = _sync_clients.get(base_url)
+        if client is None:
+            transport = httpx.HTTPTransport(limits=_limits(), uds=PERSISTENCE_UDS)
+            client = httpx.Client(base_url=base_url, transport=transport)
+            _sync_clients[base_url] = client
+        return client
+
+
+def _async_client(base_url: str) -> httpx.AsyncClient:
+    with _lock:
+        _check_pid()
+        client = _async_clients.get(base_url)
+        if client is None:
+            transport = httpx.AsyncHTTPTransport(limits=_limits(), http2=_http2_enabled(), uds=PERSISTENCE_UDS)
+            client = httpx.AsyncClient(base_url=base_url, transport=transport)
+            _async_clients[base_url] = client
+        return client
+
+
+def close_clients() -> None:
+    """Cierra los pools síncronos del proceso (apagado del worker)."""
+    with _lock:
+        clients = list(_sync_clients.values())
+        _sync_clients.clear()
+    for client in clients:
+        client.close()
+
+
+async def aclose_clients() -> None:
+    """Cierra los pools asíncronos del proceso (shutdown de FastAPI)."""
+    with _lock:
+        clients = list(_async_clients.values())
+        _async_clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+def _use_msgpack() -> bool:
+    if PERSISTENCE_WIRE_FORMAT != "msgpack":
+        return False
+    if msgpack is None:
+        logger.warning("PERSISTENCE_WIRE_FORMAT=msgpack pero falta el paquete msgpack; se usa JSON")
+        return False
+    return True
+
+
+def _compression() -> Optional[str]:
+    if PERSISTENCE_COMPRESSION == "zstd" and zstandard is None:
+        logger.warning("PERSISTENCE_COMPRESSION=zstd pero falta el paquete zstandard; se usa gzip")
+        return "gzip"
+    return PERSISTENCE_COMPRESSION if PERSISTENCE_COMPRESSION in ("gzip", "zstd") else None
+
+
+def _chunk_request(row_range: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
+    """Parámetros y headers de /data/chunk: proyección de columnas, rango de row_index opcional y formato negociado."""
+    params = {"fields": PERSISTENCE_CHUNK_FIELDS} if PERSISTENCE_CHUNK_FIELDS else {}
+    if row_range is not None:
+        params["row_from"], params["row_to"] = row_range
+    headers = {}
+    if _use_msgpack():
+        headers["Accept"] = f"{MSGPACK_MEDIA_TYPE}, application/json;q=0.5"
+        headers["Accept-Encoding"] = _compression() or "identity"
+    return {"params": params, "headers": headers}
+
+
+def _parse_chunk(r: httpx.Response) -> Tuple[ChunkResponse, Optional[int]]:
+    """Lote de /data/chunk o /data/save_classified_chunk/next y, en el segundo caso, las filas guardadas."""
+    # httpx ya descomprime gzip/zstd; un servidor sin msgpack responde JSON
+    if r.headers.get("content-type", "").startswith(MSGPACK_MEDIA_TYPE):
+        payload = msgpack.unpackb(r.content, raw=False)
+        columns = payload["columns"]
+        names = list(columns)
+        items = [dict(zip(names, row)) for row in zip(*columns.values())]
+        chunk = ChunkResponse.model_validate({"document_id": payload["document_id"], "items": items, "saved": payload.get("saved")})
+    else:
+        # Validar directamente desde los bytes, sin pasar por json.loads
+        chunk = ChunkResponse.model_validate_json(r.content)
+    return chunk, chunk.saved
+
+
+def _save_json(payload: SaveClassifiedChunkRequest) -> Dict[str, Any]:
+    return {
+        "document_id": payload.document_id,
+        "items": [
+            {
+                "raw_incident_id": row.raw_incident_id,
+                "col_s": row.categoria,
+                "col_t": row.subtipo,
+                "col_ab": row.observaciones,
+            }
+            for row in payload.rows
+        ],
+    }
+
+
+def _save_request(payload: SaveClassifiedChunkRequest) -> Dict[str, Any]:
+    """Traduce las filas clasificadas al contrato de persistencia: col_s calificación, col_t modalidad, col_ab observaciones."""
+    if not _use_msgpack():
+        return {"json": _save_json(payload)}
+    body = msgpack.packb(
+        {
+            "document_id": payload.document_id,
+            "items": {
+                "raw_incident_id": [row.raw_incident_id for row in payload.rows],
+                "col_s": [row.categoria for row in payload.rows],
+                "col_t": [row.subtipo for row in payload.rows],
+                "col_ab": [row.observaciones for row in payload.rows],
+            },
+        },
+        use_bin_type=True,
+    )
+    headers = {"Content-Type": MSGPACK_MEDIA_TYPE}
+    encoding = _compression()
+    if encoding == "zstd":
+        body, headers["Content-Encoding"] = zstandard.ZstdCompressor().compress(body), "zstd"
+    elif encoding == "gzip":
+        body, headers["Content-Encoding"] = gzip.compress(body, compresslevel=1), "gzip"
+    return {"content": body, "headers": headers}
+
+
+def _save_and_next_request(payload: SaveClassifiedChunkRequest, size: int) -> Dict[str, Any]:
+    """Cuerpo del guardado más parámetros y headers del siguiente lote (size=0: solo guardar)."""
+    request = _chunk_request()
+    request["params"]["limit"] = size
+    save = _save_request(payload)
+    request["headers"].update(save.pop("headers", {}))
+    return {**request, **save}
+
+
 class PersistenceClient:
     def __init__(self, base_url: str):
         self.base_url = base_url.rstrip("/")
-    
+
+    def _send(self, method: str, path: str, timeout: float, limited: bool = True, **kwargs) -> httpx.Response:
+        # `limited`: pasa por el límite adaptativo (todo salvo health y generate_final)
+        # Sin lugar en el límite (LimiterTimeout) el request no sale: no cuenta para el breaker ni el presupuesto
+        breaker = get_breaker()
+        breaker.before_request()
+        limiter = get_limiter() if limited else None
+        token = None
+        r = None
+        sent = False
+        try:
+            token = limiter.acquire(PERSISTENCE_LIMIT_WAIT) if limiter else None
+            get_retry_budget().deposit()
+            sent = True
+            r = _sync_client(self.base_url).request(method, path, timeout=_timeout(timeout), **kwargs)
+        finally:
+            if token:
+                limiter.release(token, _overloaded(r))
+            if sent:
+                breaker.record(_overloaded(r))
+            else:
+                breaker.cancel()
+        r.raise_for_status()
+        return r
+
+    async def _asend(self, method: str, path: str, timeout: float, limited: bool = True, **kwargs) -> httpx.Response:
+        breaker = get_breaker()
+        breaker.before_request()
+        limiter = get_limiter() if limited else None
+        token = None
+        r = None
+        sent = False
+        try:
+            token = await limiter.acquire_async(PERSISTENCE_LIMIT_WAIT) if limiter else None
+            get_retry_budget().deposit()
+            sent = True
+            r = await _async_client(self.base_url).request(method, path, timeout=_timeout(timeout), **kwargs)
+        finally:
+            if token:
+                limiter.release(token, _overloaded(r))
+            if sent:
+                breaker.record(_overloaded(r))
+            else:
+                breaker.cancel()
+        r.raise_for_status()
+        return r
+
+    def _request(self, method: str, path: str, timeout: float, **kwargs) -> Any:
+        return self._send(method, path, timeout, **kwargs).json()
+
+    async def _arequest(self, method: str, path: str, timeout: float, **kwargs) -> Any:
+        return (await self._asend(method, path, timeout, **kwargs)).json()
+
     # Métodos asíncronos (para FastAPI)
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.5, max=4))
+    @_retry
     async def health(self):
-        async with httpx.AsyncClient(timeout=30) as client:
-            r = await client.get(f"{self.base_url}/health")
-            r.raise_for_status()
-            return r.json()
-    
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.5, max=4))
-    async def get_chunk(self, document_id: str, size: int = 200) -> ChunkResponse:
-        async with httpx.AsyncClient(timeout=60) as client:
-            r = await client.get(f"{self.base_url}/data/chunk/{document_id}", params={"size": size})
-            r.raise_for_status()
-            # Validar respuesta con Pydantic
-            raw_data = r.json()
-            return ChunkResponse(**raw_data)
-    
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.5, max=4))
+        return await self._arequest("GET", "/health", 30, limited=False)
+
+    @_retry
+    async def get_chunk(self, document_id: str, size: int = 200, row_range: Optional[Tuple[int, int]] = None) -> ChunkResponse:
+        request = _chunk_request(row_range)
+        request["params"]["limit"] = size
+        return _parse_chunk(await self._asend("GET", f"/data/chunk/{document_id}", 60, **request))[0]
+
+    @_retry
     async def save_classified_chunk(self, payload: SaveClassifiedChunkRequest):
-        async with httpx.AsyncClient(timeout=60) as client:
-            # Validar payload con Pydantic antes de enviar
-            validated_payload = payload.dict()
-            r = await client.post(f"{self.base_url}/data/save_classified_chunk", json=validated_payload)
-            r.raise_for_status()
-            return r.json()
-    
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.5, max=4))
+        return await self._arequest("POST", "/data/save_classified_chunk", 60, **_save_request(payload))
+
+    @_retry
+    async def save_and_fetch_next(self, payload: SaveClassifiedChunkRequest, size: int = 200) -> Tuple[int, ChunkResponse]:
+        """Guarda el lote y trae el siguiente en el mismo request: (guardadas, siguiente lote)."""
+        request = _save_and_next_request(payload, size)
+        chunk, saved = _parse_chunk(await self._asend("POST", "/data/save_classified_chunk/next", 60, **request))
+        return saved, chunk
+
+    @_retry
+    async def get_document_stats(self, document_id: str) -> Dict[str, Any]:
+        """Progreso del documento (total, clasificadas, pendientes, %) desde document_stats."""
+        return await self._arequest("GET", f"/document/{document_id}/stats", 10)
+
+    @_retry
     async def generate_final(self, document_id: str):
-        async with httpx.AsyncClient(timeout=120) as client:
-            r = await client.post(f"{self.base_url}/sheet/generate_final/{document_id}")
-            r.raise_for_status()
-            return r.json()
-    
+        return await self._arequest("POST", f"/sheet/generate_final/{document_id}", 120, limited=False)
+
     # Métodos síncronos (para Celery workers)
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.5, max=4))
+    @_retry
     def health_sync(self):
         try:
-            r = requests.get(f"{self.base_url}/health", timeout=30)
-            r.raise_for_status()
-            return r.json()
+            return self._request("GET", "/health", 30, limited=False)
         except Exception as e:
             logger.error(f"Error en health check síncrono: {e}")
             raise
-    
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.5, max=4))
-    def get_chunk_sync(self, document_id: str, size: int = 200) -> ChunkResponse:
+
+    @_retry
+    def get_chunk_sync(self, document_id: str, size: int = 200, row_range: Optional[Tuple[int, int]] = None) -> ChunkResponse:
+        """Filas sin clasificar; con row_range solo las de ese rango de row_index (descriptor de la cola de lotes)."""
         try:
-            r = requests.get(f"{self.base_url}/data/chunk/{document_id}", params={"size": size}, timeout=60)
-            r.raise_for_status()
-            # Validar respuesta con Pydantic
-            raw_data = r.json()
-            return ChunkResponse(**raw_data)
+            request = _chunk_request(row_range)
+            request["params"]["limit"] = size
+            return _parse_chunk(self._send("GET", f"/data/chunk/{document_id}", 60, **request))[0]
         except Exception as e:
             logger.error(f"Error obteniendo chunk síncrono: {e}")
             raise
-    
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.5, max=4))
+
+    @_retry
     def save_classified_chunk_sync(self, payload: SaveClassifiedChunkRequest):
         try:
-            # Validar payload con Pydantic antes de enviar
-            validated_payload = payload.dict()
-            r = requests.post(f"{self.base_url}/data/save_classified_chunk", json=payload, timeout=60)
-            r.raise_for_status()
-            return r.json()
+            return self._request("POST", "/data/save_classified_chunk", 60, **_save_request(payload))
         except Exception as e:
             logger.error(f"Error guardando chunk clasificado síncrono: {e}")
             raise
-    
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.5, max=4))
+
+    @_retry
+    def save_and_fetch_next_sync(self, payload: SaveClassifiedChunkRequest, size: int = 200) -> Tuple[int, ChunkResponse]:
+        """Guarda el lote y trae el siguiente en el mismo request: (guardadas, siguiente lote)."""
+        try:
+            request = _save_and_next_request(payload, size)
+            chunk, saved = _parse_chunk(self._send("POST", "/data/save_classified_chunk/next", 60, **request))
+            return saved, chunk
+        except Exception as e:
+            logger.error(f"Error guardando chunk clasificado y obteniendo el siguiente síncrono: {e}")
+            raise
+
+    @_retry
+    def get_chunks_sync(self, document_ids: List[str], size: int) -> List[ChunkResponse]:
+        """Hasta `size` filas sin clasificar en total de varios documentos (lote combinado), en JSON."""
+        try:
+            params = {"document_id": document_ids, "limit": size}
+            if PERSISTENCE_CHUNK_FIELDS:
+                params["fields"] = PERSISTENCE_CHUNK_FIELDS
+            r = self._send("GET", "/data/chunks", 60, params=params)
+            return MultiChunkResponse.model_validate_json(r.content).documents
+        except Exception as e:
+            logger.error(f"Error obteniendo lotes de varios documentos síncrono: {e}")
+            raise
+
+    @_retry
+    def save_classified_chunks_sync(self, payloads: List[SaveClassifiedChunkRequest]):
+        """Guarda los lotes clasificados de varios documentos en un request (uno por documento en persistencia)."""
+        try:
+            body = {"documents": [_save_json(payload) for payload in payloads]}
+            return self._request("POST", "/data/save_classified_chunks", 60, json=body)
+        except Exception as e:
+            logger.error(f"Error guardando lotes de varios documentos síncrono: {e}")
+            raise
+
+    @_retry
+    def get_document_stats_sync(self, document_id: str) -> Dict[str, Any]:
+        try:
+            return self._request("GET", f"/document/{document_id}/stats", 10)
+        except Exception as e:
+            logger.error(f"Error obteniendo estadísticas del documento síncrono: {e}")
+            raise
+
+    @_retry
     def generate_final_sync(self, document_id: str):
         try:
-            r = requests.post(f"{self.base_url}/sheet/generate_final/{document_id}", timeout=120)
-            r.raise_for_status()
-            return r.json()
+            return self._request("POST", f"/sheet/generate_final/{document_id}", 120, limited=False)
         except Exception as e:
             logger.error(f"Error generando archivo final síncrono: {e}")
             raise
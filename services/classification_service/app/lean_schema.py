@@ -0,0 +1,32 @@
+"""
+Esquemas TypedDict derivados de modelos Pydantic, para validar lotes de filas como dicts.
+
+Lo usan los dos servicios: clasificación lo importa como parte de su app y persistencia lo carga
+por ruta (copiado junto a su app en Docker, o este mismo archivo en el repo), igual que classifier.py.
+Solo depende de pydantic.
+"""
+from functools import lru_cache
+from typing import Annotated, List, Type, get_args, get_origin
+
+from pydantic import BaseModel
+from typing_extensions import NotRequired, Required, TypedDict
+
+
+@lru_cache(maxsize=None)
+def lean_schema(model: Type[BaseModel]) -> type:
+    """
+    TypedDict con los campos, tipos y restricciones de `model` (las listas de modelos pasan a listas
+    de su TypedDict). Validado con un TypeAdapter acepta y rechaza lo mismo que el modelo pero devuelve
+    dicts: sin instanciar un modelo por fila ni volcarlo después con model_dump. Los campos opcionales
+    ausentes quedan ausentes en lugar de None y las claves desconocidas se ignoran, como en el modelo.
+    No copia validadores propios (estos modelos no tienen).
+    """
+    fields = {}
+    for name, field in model.model_fields.items():
+        annotation = field.annotation
+        if get_origin(annotation) is list and isinstance(get_args(annotation)[0], type) and issubclass(get_args(annotation)[0], BaseModel):
+            annotation = List[lean_schema(get_args(annotation)[0])]
+        if field.metadata:
+            annotation = Annotated[(annotation, *field.metadata)]
+        fields[name] = Required[annotation] if field.is_required() else NotRequired[annotation]
+    return TypedDict(f"{model.__name__}Row", fields)
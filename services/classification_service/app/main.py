@@ -5,15 +5,21 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
+import asyncio
 import os
 import time
 import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 import re
 from dotenv import load_dotenv
-from .models import ClassifyOptions, ClassifyResponse, HealthResponse
+from .models import ClassifyOptions, ClassifyResponse, ClassifyRowsRequest, ClassifyRowsResponse, HealthResponse
+from .classifier import classify_rows, rule_engine
 from .celery_app import celery_app
-from .tasks import classify_document_task
+from .tasks import classify_document_task, document_batcher, enqueue_small_document
+from .clients.document_batcher import SMALL_DOC_MAX_ROWS
+from .clients.persistence_client import PersistenceClient, aclose_clients
 import logging
 
 # Configurar logging con formato de auditoría de seguridad
@@ -326,10 +332,36 @@ PERSISTENCE_HOST = os.getenv("PERSISTENCE_HOST", "localhost")
 PERSISTENCE_PORT = os.getenv("PERSISTENCE_PORT", "8001")
 PERSISTENCE_URL = f"http://{PERSISTENCE_HOST}:{PERSISTENCE_PORT}"
 
+# Clasificación en línea (POST /classify/rows): filas por request, pool de CPU y requests en curso admitidos
+CLASSIFY_ROWS_MAX = int(os.getenv("CLASSIFY_ROWS_MAX", "100"))
+CLASSIFY_ROWS_EXECUTOR = os.getenv("CLASSIFY_ROWS_EXECUTOR", "thread").lower()
+CLASSIFY_ROWS_WORKERS = int(os.getenv("CLASSIFY_ROWS_WORKERS", "2"))
+CLASSIFY_ROWS_MAX_PENDING = int(os.getenv("CLASSIFY_ROWS_MAX_PENDING", "4"))
+
+# Pool acotado: las reglas corren fuera del event loop, que sigue atendiendo el resto de los endpoints.
+# Con hilos comparten el GIL con el loop; con procesos (cada uno compila su motor al arrancar) usan otros núcleos
+if CLASSIFY_ROWS_EXECUTOR == "process":
+    rows_executor = ProcessPoolExecutor(
+        max_workers=CLASSIFY_ROWS_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=rule_engine,
+    )
+else:
+    rows_executor = ThreadPoolExecutor(max_workers=CLASSIFY_ROWS_WORKERS, thread_name_prefix="classify-rows")
+rows_slots = asyncio.Semaphore(CLASSIFY_ROWS_MAX_PENDING)
+
 @app.on_event("startup")
 async def startup_event():
     logger.info("Servicio de clasificación asíncrono iniciado")
     logger.info(f"URL del servicio de persistencia: {PERSISTENCE_URL}")
+    # Motor de reglas compilado antes del primer request de /classify/rows
+    await asyncio.get_running_loop().run_in_executor(rows_executor, rule_engine)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Cierra el pool keep-alive hacia persistencia
+    await aclose_clients()
+    rows_executor.shutdown(wait=False)
 
 @app.get("/health", response_model=HealthResponse)
 @limiter.limit("30/minute")  # Rate limiting agresivo para endpoints públicos
@@ -361,6 +393,56 @@ async def health_check(request: Request):
             error=str(e)
         )
 
+@app.post("/classify/rows", response_model=ClassifyRowsResponse)
+@limiter.limit(f"{AUTHENTICATED_RATE_LIMIT}/minute")
+async def classify_text_rows(
+    request: Request,
+    payload: ClassifyRowsRequest,
+    token_verified: bool = Depends(verify_api_token)
+):
+    """
+    Clasifica en línea hasta CLASSIFY_ROWS_MAX textos con el motor de reglas en memoria, sin
+    importar un Excel ni encolar una tarea. Responde en el orden recibido.
+    """
+    validate_request_size(request)
+    if len(payload.rows) > CLASSIFY_ROWS_MAX:
+        raise HTTPException(status_code=400, detail=f"Máximo {CLASSIFY_ROWS_MAX} filas por request")
+    # Con el pool saturado se rechaza enseguida en lugar de encolar y alargar la latencia de todos
+    if rows_slots.locked():
+        raise HTTPException(status_code=503, detail="Clasificador saturado, reintentar", headers={"Retry-After": "1"})
+
+    start = time.perf_counter()
+    try:
+        async with rows_slots:
+            results = await asyncio.get_running_loop().run_in_executor(
+                rows_executor, classify_rows, [{"texto": row.texto} for row in payload.rows]
+            )
+    except Exception as e:
+        logger.error(f"Error al clasificar filas en línea: {e}")
+        raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
+
+    return ClassifyRowsResponse(
+        results=[{**result, "row_id": row.row_id} for row, result in zip(payload.rows, results)],
+        elapsed_ms=round((time.perf_counter() - start) * 1000, 2),
+    )
+
+async def is_small_document(document_id: str, options: ClassifyOptions) -> bool:
+    """
+    True si el documento va a un lote combinado: SMALL_DOC_BATCHING activo, hasta SMALL_DOC_MAX_ROWS
+    filas pendientes y un max_batches que no corta antes de terminarlo. Sin estadísticas, tarea propia.
+    """
+    if document_batcher is None:
+        return False
+    try:
+        stats = await PersistenceClient(PERSISTENCE_URL).get_document_stats(document_id)
+    except Exception as e:
+        logger.warning(f"No se pudieron obtener estadísticas del documento {document_id}: {e}")
+        return False
+    pending = stats["pending_rows"]
+    return 0 < pending <= SMALL_DOC_MAX_ROWS and (
+        options.max_batches is None or options.max_batches * options.batch_size >= pending
+    )
+
 @app.post("/classify/{document_id}", response_model=ClassifyResponse)
 @limiter.limit("10/minute")  # Rate limiting extremo para operaciones pesadas
 async def classify_document(
@@ -380,6 +462,19 @@ async def classify_document(
     validate_input_security(document_id, options)
     
     try:
+        if await is_small_document(document_id, options):
+            # Documento chico: se clasifica junto con los demás anotados en la misma ventana
+            task_id = enqueue_small_document(document_id, options.strategy.value, options.generate_final)
+            logger.info(f"Documento {document_id} agregado al lote combinado {task_id}")
+            return ClassifyResponse(
+                document_id=document_id,
+                task_id=task_id,
+                status="enqueued",
+                message="Documento agregado a un lote combinado de documentos chicos",
+                strategy=options.strategy,
+                options=options.dict()
+            )
+        
         # Encolar tarea de clasificación
         task = classify_document_task.delay(
             document_id=document_id,
@@ -473,10 +568,18 @@ async def get_document_progress(
                         "started": task.get("time_start", 0)
                     })
         
+        # Filas totales/clasificadas desde document_stats (O(1) en persistencia)
+        try:
+            stats = await PersistenceClient(PERSISTENCE_URL).get_document_stats(document_id)
+        except Exception as e:
+            logger.warning(f"No se pudieron obtener estadísticas del documento {document_id}: {e}")
+            stats = None
+        
         return {
             "document_id": document_id,
             "active_tasks": len(document_tasks),
-            "tasks": document_tasks
+            "tasks": document_tasks,
+            "stats": stats
         }
         
     except Exception as e:
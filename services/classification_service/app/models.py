@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field, validator, HttpUrl
 from typing import Optional, List, Dict, Any, Union
 from enum import Enum
+from .lean_schema import lean_schema
 
 class StrategyEnum(str, Enum):
     """Estrategias de clasificación válidas"""
@@ -41,7 +42,7 @@ class ClassifyOptions(BaseModel):
 class RawIncidentData(BaseModel):
     """Datos de incidente sin clasificar del Servicio de Persistencia"""
     id: int
-    document_id: str = Field(..., min_length=1, max_length=64)
+    document_id: Optional[str] = Field(None, min_length=1, max_length=64)
     row_index: int = Field(..., ge=0)
     source_path: Optional[str] = None
     col_a: Optional[str] = None
@@ -63,12 +64,20 @@ class RawIncidentData(BaseModel):
     col_q: Optional[str] = None
     created_at: Optional[str] = None
 
+# Fila de un lote validada con el esquema de RawIncidentData, como dict
+RawIncidentRow = lean_schema(RawIncidentData)
+
 class ChunkResponse(BaseModel):
     """Respuesta de chunk de datos del Servicio de Persistencia"""
-    chunk_id: Optional[str] = None
-    rows: List[RawIncidentData] = Field(default_factory=list)
-    total_available: Optional[int] = None
-    has_more: bool = True
+    document_id: Optional[str] = None
+    # Filas como dicts (validados como RawIncidentData): el clasificador trabaja sobre dicts
+    items: List[RawIncidentRow] = Field(default_factory=list)
+    # Filas guardadas, solo en la respuesta de /data/save_classified_chunk/next
+    saved: Optional[int] = None
+
+class MultiChunkResponse(BaseModel):
+    """Lotes de varios documentos (/data/chunks): uno por documento leído, en el orden pedido"""
+    documents: List[ChunkResponse] = Field(default_factory=list)
 
 class ClassifiedRow(BaseModel):
     """Fila clasificada con validaciones estrictas"""
@@ -89,6 +98,28 @@ class SaveClassifiedChunkRequest(BaseModel):
     document_id: str = Field(..., min_length=1, max_length=64)
     rows: List[ClassifiedRow] = Field(..., min_items=1, max_items=1000)
 
+class TextRow(BaseModel):
+    """Texto a clasificar en línea (relato, calificaciones, etc.)"""
+    row_id: Optional[str] = Field(None, max_length=64)
+    texto: str = Field(..., max_length=10000)
+
+class ClassifyRowsRequest(BaseModel):
+    """Request de POST /classify/rows: el límite de filas se valida contra CLASSIFY_ROWS_MAX"""
+    rows: List[TextRow] = Field(..., min_length=1)
+
+class ClassifiedText(BaseModel):
+    """Resultado de una fila clasificada en línea"""
+    row_id: Optional[str] = None
+    categoria: Optional[str] = None
+    subtipo: Optional[str] = None
+    score: float = 0
+    observaciones: Optional[str] = None
+
+class ClassifyRowsResponse(BaseModel):
+    """Respuesta de POST /classify/rows, en el orden de las filas recibidas"""
+    results: List[ClassifiedText]
+    elapsed_ms: float
+
 class ClassifyResponse(BaseModel):
     """Respuesta del endpoint de clasificación"""
     document_id: str = Field(..., min_length=1, max_length=64)
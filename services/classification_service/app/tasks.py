@@ -1,12 +1,19 @@
 from celery import current_task
+from celery.exceptions import Retry
+import httpx
 from .celery_app import celery_app
 from .classifier import classify_rows
-from .clients.persistence_client import PersistenceClient
+from .clients.breaker import CircuitOpenError
+from .clients.chunk_queue import open_chunk_queue
+from .clients.document_batcher import SMALL_DOC_BATCH_ROWS, SMALL_DOC_WINDOW, open_document_batcher
+from .clients.limiter import LimiterTimeout
+from .clients.persistence_client import PersistenceClient, _overloaded
 from .models import SaveClassifiedChunkRequest, ClassifiedRow
 import os
 import logging
+import random
 from dotenv import load_dotenv
-from redis import ConnectionError, TimeoutError
+from redis import ConnectionError, RedisError, TimeoutError
 
 # Cargar variables de entorno
 load_dotenv()
@@ -20,7 +27,86 @@ PERSISTENCE_HOST = os.getenv("PERSISTENCE_HOST", "localhost")
 PERSISTENCE_PORT = os.getenv("PERSISTENCE_PORT", "8001")
 PERSISTENCE_URL = f"http://{PERSISTENCE_HOST}:{PERSISTENCE_PORT}"
 
-@celery_app.task(bind=True, name="classify_document_task")
+# Reprogramación de la tarea cuando persistencia falla: espera base, tope y cantidad máxima
+TASK_RETRY_BACKOFF = float(os.getenv("TASK_RETRY_BACKOFF", "5"))
+TASK_RETRY_BACKOFF_MAX = float(os.getenv("TASK_RETRY_BACKOFF_MAX", "300"))
+TASK_MAX_RETRIES = int(os.getenv("TASK_MAX_RETRIES", "8"))
+
+# Errores de persistencia candidatos a reprogramar la tarea (ver _reschedulable; el resto la falla)
+PERSISTENCE_ERRORS = (CircuitOpenError, LimiterTimeout, httpx.TransportError, httpx.HTTPStatusError)
+
+# Cola de lotes publicada por persistencia al importar (None si CHUNK_QUEUE_ENABLED no está activo)
+chunk_queue = open_chunk_queue()
+
+# Lotes combinados de documentos chicos (None si SMALL_DOC_BATCHING no está activo)
+document_batcher = open_document_batcher()
+
+def _queue_has_document(document_id: str) -> bool:
+    """True si hay que tomar los lotes del documento de la cola; sin cola (o sin Redis) se leen de la base."""
+    if chunk_queue is None:
+        return False
+    try:
+        return chunk_queue.has_document(document_id)
+    except RedisError as e:
+        logger.warning(f"Cola de lotes no disponible, se leen los lotes de la base: {e}")
+        return False
+
+def _document_stats(client: PersistenceClient, document_id: str):
+    """Contadores del documento; None si persistencia no los puede dar (el progreso se estima)."""
+    try:
+        return client.get_document_stats_sync(document_id)
+    except Exception as e:
+        logger.warning(f"No se pudieron obtener estadísticas del documento {document_id}: {e}")
+        return None
+
+def _reschedulable(error: Exception) -> bool:
+    """Solo se reprograma si persistencia no da abasto; un 4xx no se arregla reintentando y falla la tarea."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return _overloaded(error.response)
+    return True
+
+def _reschedule(task, document_id: str, batch_count: int, total_processed: int, error: Exception, kwargs=None):
+    """
+    Reprograma la tarea con countdown en lugar de dormir el worker. Los guardados son idempotentes y
+    la tarea retoma desde el primer lote sin clasificar, así que reiniciarla no repite trabajo guardado.
+    Con el circuito abierto se espera lo que indica el breaker; si no, backoff exponencial con jitter.
+    `kwargs` reemplaza los argumentos del reintento (la tarea combinada pasa los documentos que tomó).
+    """
+    retries = task.request.retries
+    if retries >= TASK_MAX_RETRIES:
+        error_msg = f"Lote {batch_count + 1} falló después de {retries} reprogramaciones: {error}"
+        logger.error(error_msg)
+        task.update_state(
+            state="FAILURE",
+            meta={
+                "error": error_msg,
+                "failed_batch": batch_count + 1,
+                "total_processed": total_processed,
+                "status": "Tarea fallida por error en lote"
+            }
+        )
+        raise Exception(error_msg)
+    
+    if isinstance(error, CircuitOpenError):
+        countdown = error.retry_after
+    else:
+        countdown = min(TASK_RETRY_BACKOFF_MAX, TASK_RETRY_BACKOFF * 2 ** retries)
+    countdown *= 0.8 + random.random() * 0.4
+    logger.warning(
+        f"Persistencia no disponible en lote {batch_count + 1} de {document_id} ({error}); "
+        f"reprogramando en {countdown:.0f}s ({retries + 1}/{TASK_MAX_RETRIES})"
+    )
+    task.update_state(
+        state="PROGRESS",
+        meta={
+            "current_batch": batch_count + 1,
+            "total_processed": total_processed,
+            "status": f"Persistencia no disponible, reintento en {countdown:.0f}s"
+        }
+    )
+    raise task.retry(exc=error, countdown=countdown, max_retries=TASK_MAX_RETRIES, kwargs=kwargs)
+
+@celery_app.task(bind=True, name="classify_document_task", max_retries=TASK_MAX_RETRIES)
 def classify_document_task(
     self,
     document_id: str,
@@ -63,6 +149,19 @@ def classify_document_task(
         total_processed = 0
         batch_count = 0
         current_progress = 0
+        # Lote pendiente de clasificar: lo trae el guardado del lote anterior (None: pedirlo)
+        chunk_data = None
+        # Con la cola los lotes salen de los descriptores publicados al importar; al vaciarse se
+        # revisa la base una vez por si quedó alguna fila sin descriptor
+        queue_mode = _queue_has_document(document_id)
+        
+        # Contadores O(1) de persistencia (document_stats) leídos una vez; el progreso sigue con los
+        # `saved` de cada guardado, sin un request extra por lote
+        stats = _document_stats(client, document_id)
+        total_rows = stats["total_rows"] if stats else None
+        classified_total = stats["classified_rows"] if stats else None
+        # Lote del último progreso publicado (una toma vacía de la cola no vuelve a publicarlo)
+        reported_batch = None
         
         # Actualizar estado de la tarea
         self.update_state(
@@ -87,37 +186,64 @@ def classify_document_task(
                 logger.warning(f"Alcanzado límite máximo de filas: {MAX_TOTAL_ROWS}")
                 break
             
-            # Actualizar progreso
-            current_progress = min(95, (batch_count / (max_batches or 10)) * 100)
-            self.update_state(
-                state="PROGRESS",
-                meta={
-                    "progress": current_progress,
-                    "current_batch": batch_count + 1,
-                    "total_processed": total_processed,
-                    "status": f"Procesando lote {batch_count + 1}"
-                }
-            )
-            
-            # Sistema de reintentos para cada lote
-            max_retries = 3
-            retry_count = 0
-            chunk_processed = False
+            # Actualizar progreso con los contadores locales
+            if reported_batch != batch_count:
+                if total_rows:
+                    current_progress = min(95, round(classified_total * 100 / total_rows, 2))
+                else:
+                    current_progress = min(95, (batch_count / (max_batches or 10)) * 100)
+                self.update_state(
+                    state="PROGRESS",
+                    meta={
+                        "progress": current_progress,
+                        "current_batch": batch_count + 1,
+                        "total_processed": total_processed,
+                        "total_rows": total_rows,
+                        "classified_rows": classified_total,
+                        "status": f"Procesando lote {batch_count + 1}"
+                    }
+                )
+                reported_batch = batch_count
             
-            while retry_count < max_retries and not chunk_processed:
-                try:
-                    # Obtener chunk de datos no clasificados
+            # Las fallas de persistencia reprograman la tarea (ver _reschedule) en lugar de dormir el worker
+            document_done = False
+            descriptor = None
+            try:
+                if queue_mode:
+                    descriptor = chunk_queue.take(document_id)
+                    if descriptor is None:
+                        # Sin descriptores nuevos: si otro worker tiene alguno se espera a que lo confirme o se libere
+                        if chunk_queue.remaining(document_id) == 0:
+                            logger.info(f"Cola de lotes vacía para documento {document_id}; se revisa la base")
+                            queue_mode = False
+                        continue
+                    chunk_data = client.get_chunk_sync(document_id, MAX_BATCH_SIZE, (descriptor.row_from, descriptor.row_to))
+                # Obtener chunk de datos no clasificados (solo el primero; los siguientes llegan con el guardado)
+                elif chunk_data is None:
                     chunk_data = client.get_chunk_sync(document_id, batch_size)
-                    
-                    if not chunk_data.get("rows"):
-                        logger.info(f"No hay más datos para clasificar en documento {document_id}")
-                        break
-                    
+                
+                if not chunk_data.items and descriptor is not None:
+                    # Rango ya clasificado (descriptor repetido o entregado de nuevo)
+                    chunk_queue.ack(document_id, descriptor)
+                    chunk_data = None
+                elif not chunk_data.items:
+                    logger.info(f"No hay más datos para clasificar en documento {document_id}")
+                    document_done = True
+                else:
                     # Clasificar el chunk
-                    rows = chunk_data["rows"]
-                    logger.info(f"Clasificando lote {batch_count + 1}: {len(rows)} filas (intento {retry_count + 1})")
+                    rows = chunk_data.items
+                    logger.info(f"Clasificando lote {batch_count + 1}: {len(rows)} filas")
                     
-                    classified_rows = classify_rows(rows, strategy)
+                    classified_rows = [
+                        ClassifiedRow(
+                            row_id=row["row_index"],
+                            raw_incident_id=row["id"],
+                            categoria=result["categoria"],
+                            subtipo=result["subtipo"],
+                            observaciones=result["observaciones"],
+                        )
+                        for row, result in zip(rows, classify_rows(rows, strategy))
+                    ]
                     
                     # Crear payload validado con Pydantic
                     save_payload = SaveClassifiedChunkRequest(
@@ -125,41 +251,36 @@ def classify_document_task(
                         rows=classified_rows
                     )
                     
-                    client.save_classified_chunk_sync(save_payload)
+                    if descriptor is not None:
+                        # El descriptor se confirma recién con el lote guardado; si el worker cae antes, otro lo reclama
+                        saved = client.save_classified_chunk_sync(save_payload)["saved"]
+                        chunk_queue.ack(document_id, descriptor)
+                        chunk_data = None
+                    else:
+                        # Guardar y traer el siguiente lote en el mismo request; tras el último lote permitido solo se guarda
+                        last_batch = (max_batches and batch_count + 1 >= max_batches) or total_processed + len(rows) >= MAX_TOTAL_ROWS
+                        saved, chunk_data = client.save_and_fetch_next_sync(save_payload, 0 if last_batch else batch_size)
+                    if classified_total is not None:
+                        classified_total += saved
                     total_processed += len(rows)
                     batch_count += 1
-                    chunk_processed = True
                     
                     logger.info(f"Lote {batch_count} procesado exitosamente: {len(rows)} filas")
                     
-                except Exception as e:
-                    retry_count += 1
-                    logger.error(f"Error procesando lote {batch_count + 1} (intento {retry_count}/{max_retries}): {e}")
-                    
-                    if retry_count >= max_retries:
-                        # Lote falló después de todos los reintentos - FALLAR TAREA COMPLETA
-                        error_msg = f"Lote {batch_count + 1} falló después de {max_retries} reintentos: {str(e)}"
-                        logger.error(error_msg)
-                        
-                        # Marcar tarea como fallida
-                        self.update_state(
-                            state="FAILURE",
-                            meta={
-                                "error": error_msg,
-                                "failed_batch": batch_count + 1,
-                                "total_processed": total_processed,
-                                "status": "Tarea fallida por error en lote"
-                            }
-                        )
-                        
-                        # Re-lanzar excepción para que Celery marque la tarea como fallida
-                        raise Exception(error_msg)
-                    
-                    # Esperar antes del reintento (backoff exponencial)
-                    import time
-                    wait_time = 2 ** retry_count  # 2, 4, 8 segundos
-                    logger.info(f"Esperando {wait_time} segundos antes del reintento...")
-                    time.sleep(wait_time)
+            except PERSISTENCE_ERRORS as e:
+                if not _reschedulable(e):
+                    raise
+                _reschedule(self, document_id, batch_count, total_processed, e)
+            except RedisError as e:
+                # La cola es una optimización: sin Redis se siguen leyendo los lotes de la base
+                if not queue_mode:
+                    raise
+                logger.warning(f"Cola de lotes no disponible, se leen los lotes de la base: {e}")
+                queue_mode = False
+                chunk_data = None
+            
+            if document_done:
+                break
         
         # Generar archivo final si se solicita
         if generate_final:
@@ -195,6 +316,10 @@ def classify_document_task(
             "status": "completed"
         }
         
+    except Retry:
+        # Reprogramada por _reschedule: no es una falla
+        raise
+        
     except (ConnectionError, TimeoutError) as redis_error:
         # Error específico de Redis - fallo controlado
         error_msg = f"Error de conexión con Redis durante clasificación: {str(redis_error)}"
@@ -226,6 +351,127 @@ def classify_document_task(
         # Re-lanzar excepción para que Celery la maneje
         raise
 
+def enqueue_small_document(document_id: str, strategy: str, generate_final: bool) -> str:
+    """
+    Suma el documento al lote combinado abierto de su estrategia y devuelve el task_id de la tarea
+    que lo va a clasificar; la primera anotación de cada ventana la encola con SMALL_DOC_WINDOW de espera.
+    """
+    task_id, schedule = document_batcher.add(document_id, strategy, generate_final)
+    if schedule:
+        classify_documents_task.apply_async(
+            kwargs={"strategy": strategy}, task_id=task_id, countdown=SMALL_DOC_WINDOW
+        )
+    return task_id
+
+@celery_app.task(bind=True, name="classify_documents_task", max_retries=TASK_MAX_RETRIES)
+def classify_documents_task(self, strategy: str = "rules", documents: list = None):
+    """
+    Clasifica juntos varios documentos chicos: un request trae hasta SMALL_DOC_BATCH_ROWS filas de
+    todos, se clasifican en una sola pasada y otro request las guarda por documento. Sin `documents`
+    toma los anotados en la ventana (ver enqueue_small_document); los reintentos los reciben explícitos.
+    """
+    MAX_TOTAL_ROWS = 100000  # Máximo 100,000 filas totales
+    # Persistencia acepta hasta 1000 filas por documento en cada guardado
+    batch_rows = min(SMALL_DOC_BATCH_ROWS, 1000)
+    
+    try:
+        if documents is None:
+            documents = document_batcher.drain(strategy, self.request.id)
+        
+        logger.info(f"Iniciando lote combinado de {len(documents)} documentos (estrategia: {strategy})")
+        client = PersistenceClient(PERSISTENCE_URL)
+        pending = [doc["document_id"] for doc in documents]
+        processed = {document_id: 0 for document_id in pending}
+        total_processed = 0
+        batch_count = 0
+        
+        while pending and total_processed < MAX_TOTAL_ROWS:
+            self.update_state(
+                state="PROGRESS",
+                meta={
+                    "documents": len(documents),
+                    "pending_documents": len(pending),
+                    "current_batch": batch_count + 1,
+                    "total_processed": total_processed,
+                    "status": f"Procesando lote combinado {batch_count + 1}"
+                }
+            )
+            try:
+                chunks = client.get_chunks_sync(pending, batch_rows)
+                if not chunks:
+                    break
+                rows = [row for chunk in chunks for row in chunk.items]
+                results = iter(classify_rows(rows, strategy)) if rows else iter(())
+                
+                payloads = []
+                for chunk in chunks:
+                    if not chunk.items:
+                        # Documento sin filas pendientes: terminado
+                        pending.remove(chunk.document_id)
+                        continue
+                    classified_rows = [
+                        ClassifiedRow(
+                            row_id=row["row_index"],
+                            raw_incident_id=row["id"],
+                            categoria=result["categoria"],
+                            subtipo=result["subtipo"],
+                            observaciones=result["observaciones"],
+                        )
+                        for row, result in zip(chunk.items, results)
+                    ]
+                    payloads.append(SaveClassifiedChunkRequest(document_id=chunk.document_id, rows=classified_rows))
+                
+                if payloads:
+                    client.save_classified_chunks_sync(payloads)
+                    batch_count += 1
+                for payload in payloads:
+                    processed[payload.document_id] += len(payload.rows)
+                    total_processed += len(payload.rows)
+                logger.info(f"Lote combinado {batch_count}: {len(rows)} filas de {len(payloads)} documentos")
+                
+            except PERSISTENCE_ERRORS as e:
+                if not _reschedulable(e):
+                    raise
+                # Los terminados solo vuelven si piden archivo final (se generan al final de la tarea)
+                retry_documents = [doc for doc in documents if doc["document_id"] in pending or doc["generate_final"]]
+                _reschedule(
+                    self, f"{len(pending)} documentos", batch_count, total_processed, e,
+                    kwargs={"strategy": strategy, "documents": retry_documents},
+                )
+        
+        # Archivos finales de los documentos que lo pidieron
+        for doc in documents:
+            if doc["generate_final"]:
+                try:
+                    client.generate_final_sync(doc["document_id"])
+                except Exception as e:
+                    logger.error(f"Error al generar archivo final de {doc['document_id']}: {e}")
+        
+        logger.info(f"Lote combinado completado: {len(documents)} documentos, {total_processed} filas, {batch_count} lotes")
+        return {
+            "documents": processed,
+            "total_processed": total_processed,
+            "total_batches": batch_count,
+            "strategy": strategy,
+            "status": "completed"
+        }
+        
+    except Retry:
+        # Reprogramada por _reschedule: no es una falla
+        raise
+        
+    except Exception as e:
+        logger.error(f"Error fatal en lote combinado de documentos: {e}")
+        self.update_state(
+            state="FAILURE",
+            meta={
+                "error": str(e),
+                "error_type": "general_error",
+                "status": "Error fatal en lote combinado"
+            }
+        )
+        raise
+
 @celery_app.task(name="health_check_task")
 def health_check_task():
     """
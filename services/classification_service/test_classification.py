@@ -0,0 +1,201 @@
+import os
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("REDIS_PASSWORD", "test")
+
+import httpx
+import pytest
+
+from app.clients import persistence_client
+from app.clients.breaker import CircuitBreaker, CircuitOpenError, RetryBudget
+from app.clients.document_batcher import DocumentBatcher
+from app.clients.limiter import LimiterTimeout, LocalLimiter
+from app.clients.persistence_client import PersistenceClient
+
+PERSISTENCE_URL = "http://persistencia.test"
+
+
+def _persistencia_falsa(monkeypatch, status_code: int, budget: RetryBudget):
+    """Cliente de persistencia contra un transporte que responde siempre `status_code`; devuelve los paths pedidos."""
+    pedidos = []
+
+    def responder(request: httpx.Request) -> httpx.Response:
+        pedidos.append(request.url.path)
+        return httpx.Response(status_code, json={"detail": "falla"})
+
+    persistence_client.get_breaker()  # inicializa el estado del proceso antes de reemplazarlo
+    monkeypatch.setattr(persistence_client, "_breaker", CircuitBreaker(100, 30))
+    monkeypatch.setattr(persistence_client, "_budget", budget)
+    monkeypatch.setattr(persistence_client, "_limiter", None)
+    monkeypatch.setitem(
+        persistence_client._sync_clients,
+        PERSISTENCE_URL,
+        httpx.Client(base_url=PERSISTENCE_URL, transport=httpx.MockTransport(responder)),
+    )
+    return pedidos
+
+
+def test_breaker_half_open_deja_pasar_una_sola_prueba():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record(True)
+    breaker.before_request()
+    breaker.record(True)
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+    # Pasado reset_timeout sale un request de prueba; los demás esperan su resultado
+    time.sleep(0.06)
+    breaker.before_request()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+    breaker.record(False)
+    breaker.before_request()
+    assert breaker.stats() == {"state": "closed", "consecutive_failures": 0}
+
+
+def test_breaker_prueba_fallida_reabre_el_circuito():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record(True)
+    time.sleep(0.06)
+    breaker.before_request()
+    breaker.record(True)
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.before_request()
+    assert breaker.stats()["state"] == "open" and error.value.retry_after >= 0.05
+
+
+def test_presupuesto_agotado_corta_los_reintentos(monkeypatch):
+    budget = RetryBudget(ratio=0.1, max_tokens=1)
+    pedidos = _persistencia_falsa(monkeypatch, 503, budget)
+    client = PersistenceClient(PERSISTENCE_URL)
+
+    # Una ficha: un solo reintento; sin fichas, el request falla sin reintentar
+    with pytest.raises(httpx.HTTPStatusError):
+        client.get_document_stats_sync("doc")
+    assert len(pedidos) == 2
+    with pytest.raises(httpx.HTTPStatusError):
+        client.get_document_stats_sync("doc")
+    assert len(pedidos) == 3
+
+
+def test_sin_lugar_en_el_limite_no_abre_el_circuito(monkeypatch):
+    budget = RetryBudget(ratio=1, max_tokens=5)
+    budget.withdraw()
+    pedidos = _persistencia_falsa(monkeypatch, 200, budget)
+    monkeypatch.setattr(persistence_client, "_breaker", CircuitBreaker(1, 30))
+    lleno = LocalLimiter(initial=1, min_limit=1, max_limit=1, latency_target=5, backoff=0.5)
+    lleno.acquire(1)
+    monkeypatch.setattr(persistence_client, "_limiter", lleno)
+    monkeypatch.setattr(persistence_client, "PERSISTENCE_LIMIT_WAIT", 0.05)
+
+    # El request no sale: ni falla para el breaker ni deposita fichas
+    with pytest.raises(LimiterTimeout):
+        PersistenceClient(PERSISTENCE_URL).get_document_stats_sync("doc")
+    assert pedidos == [] and budget.stats()["tokens"] == 4
+    assert persistence_client.get_breaker().stats() == {"state": "closed", "consecutive_failures": 0}
+
+
+def test_breaker_prueba_que_no_sale_libera_el_half_open():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record(True)
+    time.sleep(0.06)
+    breaker.before_request()
+    breaker.cancel()
+    breaker.before_request()
+
+
+def test_limite_aimd_baja_una_vez_por_ventana_y_sube_de_a_poco():
+    limiter = LocalLimiter(initial=8, min_limit=1, max_limit=20, latency_target=5, backoff=0.5)
+    previo = limiter.acquire(1)
+    time.sleep(0.01)
+    primero = limiter.acquire(1)
+    limiter.release(primero, overloaded=True)
+    assert limiter.stats()["limit"] == 4
+    # El request que salió antes de la baja no vuelve a bajar el límite
+    limiter.release(previo, overloaded=True)
+    assert limiter.stats()["limit"] == 4
+
+    # Sin saturación y con la mitad del límite en uso crece 1/límite por request
+    tokens = [limiter.acquire(1) for _ in range(2)]
+    limiter.release(tokens[0], overloaded=False)
+    assert limiter.stats()["limit"] == 4.25
+    limiter.release(tokens[1], overloaded=False)
+
+    lleno = LocalLimiter(initial=1, min_limit=1, max_limit=1, latency_target=5, backoff=0.5)
+    lleno.acquire(1)
+    with pytest.raises(LimiterTimeout):
+        lleno.acquire(0.05)
+
+
+def _importar_tasks(monkeypatch):
+    """app.tasks sin Redis: celery_app espera a Redis al importarse, así que el ping responde sin conectar."""
+    import redis
+
+    monkeypatch.setattr(redis.Redis, "ping", lambda self, **kwargs: True)
+    from app import tasks
+
+    return tasks
+
+
+def test_reprogramacion_solo_por_fallas_transitorias(monkeypatch):
+    tasks = _importar_tasks(monkeypatch)
+
+    def http_error(status_code: int) -> httpx.HTTPStatusError:
+        request = httpx.Request("GET", f"{PERSISTENCE_URL}/data/chunk/doc")
+        return httpx.HTTPStatusError("falla", request=request, response=httpx.Response(status_code, request=request))
+
+    assert tasks._reschedulable(http_error(503)) and tasks._reschedulable(http_error(429))
+    assert tasks._reschedulable(httpx.ConnectError("rechazada")) and tasks._reschedulable(CircuitOpenError(30))
+    assert not tasks._reschedulable(http_error(404))
+
+    # Con el circuito abierto la tarea vuelve cuando lo indica el breaker (±20% de jitter)
+    reintentos = []
+    tarea = SimpleNamespace(
+        request=SimpleNamespace(retries=0),
+        update_state=lambda **kwargs: None,
+        retry=lambda **kwargs: reintentos.append(kwargs) or RuntimeError("reprogramada"),
+    )
+    with pytest.raises(RuntimeError):
+        tasks._reschedule(tarea, "doc", 0, 0, CircuitOpenError(30))
+    assert 24 <= reintentos[0]["countdown"] <= 36
+
+    # Agotadas las reprogramaciones la tarea falla
+    tarea.request.retries = tasks.TASK_MAX_RETRIES
+    with pytest.raises(Exception, match="reprogramaciones"):
+        tasks._reschedule(tarea, "doc", 0, 0, CircuitOpenError(30))
+    assert len(reintentos) == 1
+
+    # Un 4xx de persistencia falla la tarea sin reprogramarla
+    pedidos = _persistencia_falsa(monkeypatch, 404, RetryBudget(ratio=0.1, max_tokens=10))
+    monkeypatch.setattr(tasks, "PERSISTENCE_URL", PERSISTENCE_URL)
+    monkeypatch.setattr(tasks, "chunk_queue", None)
+    # El estado de la tarea queda en memoria en lugar del result backend de Redis
+    estados = []
+    monkeypatch.setattr(tasks.classify_document_task, "update_state", lambda **kwargs: estados.append(kwargs["state"]))
+    result = tasks.classify_document_task.apply(kwargs={"document_id": "doc"})
+    assert result.failed() and "404" in str(result.result)
+    assert pedidos == ["/document/doc/stats", "/data/chunk/doc"]
+    assert estados[-1] == "FAILURE"
+
+
+def test_lote_combinado_cada_documento_en_la_tarea_que_lo_anoto():
+    fakeredis = pytest.importorskip("fakeredis")
+    batcher = DocumentBatcher(fakeredis.FakeRedis(decode_responses=True), "test:small_docs", window=2, max_docs=2)
+
+    tarea_a, programar = batcher.add("doc1", "rules", False)
+    assert programar
+    assert batcher.add("doc2", "rules", True) == (tarea_a, False)
+    # Ventana llena: el siguiente abre otra tarea
+    tarea_b, programar = batcher.add("doc3", "rules", False)
+    assert programar and tarea_b != tarea_a
+
+    assert batcher.drain("rules", tarea_a) == [
+        {"document_id": "doc1", "generate_final": False}, {"document_id": "doc2", "generate_final": True}
+    ]
+    # Lo anotado después de que la tarea B cierra su ventana va a otra tarea, no se pierde
+    assert batcher.drain("rules", tarea_b) == [{"document_id": "doc3", "generate_final": False}]
+    tarea_c, programar = batcher.add("doc4", "rules", False)
+    assert programar and tarea_c not in (tarea_a, tarea_b)
+    assert batcher.drain("rules", tarea_a) == []
+    assert batcher.drain("rules", tarea_c) == [{"document_id": "doc4", "generate_final": False}]
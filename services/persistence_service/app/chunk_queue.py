@@ -0,0 +1,82 @@
+"""
+Cola de lotes en Redis (opcional, CHUNK_QUEUE_ENABLED).
+
+Cuando un import confirma, se publica un descriptor (document_id, row_from, row_to, filas) por cada
+rango de hasta CHUNK_QUEUE_SIZE filas sin clasificar en un stream por documento, con un consumer
+group para los workers de clasificación. Los workers toman descriptores con XREADGROUP bloqueante y
+los confirman con XACK al guardar; los que quedan sin confirmar (worker caído) se reparten de nuevo
+con XAUTOCLAIM. Encontrar trabajo cuesta O(1) por lote y no consulta la base.
+
+La cola es una optimización: si Redis no está o pierde el stream, los workers vuelven a pedir
+/data/chunk, que lee las filas sin clasificar de la base.
+"""
+import logging
+import os
+from typing import List, Optional, Tuple
+
+try:  # redis es opcional: sin el paquete la cola queda deshabilitada
+    import redis
+except ImportError:
+    redis = None
+
+
+logger = logging.getLogger("persistence_service")
+
+CHUNK_QUEUE_ENABLED = os.getenv("CHUNK_QUEUE_ENABLED", "false").lower() == "true"
+CHUNK_QUEUE_PREFIX = os.getenv("CHUNK_QUEUE_PREFIX", "sentinel:chunks")
+CHUNK_QUEUE_GROUP = os.getenv("CHUNK_QUEUE_GROUP", "classifiers")
+# Filas sin clasificar por descriptor
+CHUNK_QUEUE_SIZE = int(os.getenv("CHUNK_QUEUE_SIZE", "200"))
+# Vida del stream de un documento que nadie termina de clasificar
+CHUNK_QUEUE_TTL = int(os.getenv("CHUNK_QUEUE_TTL", str(7 * 24 * 3600)))
+
+
+class ChunkQueue:
+    def __init__(self, redis_client, prefix: str, group: str, ttl: int):
+        self._redis = redis_client
+        self._prefix = prefix
+        self._group = group
+        self._ttl = ttl
+
+    def stream(self, document_id: str) -> str:
+        return f"{self._prefix}:{document_id}"
+
+    def publish(self, document_id: str, ranges: List[Tuple[int, int, int]]) -> int:
+        """Encola un descriptor por rango (row_from, row_to, filas). Devuelve cuántos se publicaron."""
+        if not ranges:
+            return 0
+        key = self.stream(document_id)
+        try:
+            # Grupo desde el principio del stream: recibe también lo publicado antes de que lea un worker
+            self._redis.xgroup_create(key, self._group, id="0", mkstream=True)
+        except redis.ResponseError as exc:
+            if "BUSYGROUP" not in str(exc):
+                raise
+        pipe = self._redis.pipeline(transaction=True)
+        for row_from, row_to, rows in ranges:
+            pipe.xadd(key, {"document_id": document_id, "row_from": row_from, "row_to": row_to, "rows": rows})
+        pipe.expire(key, self._ttl)
+        pipe.execute()
+        return len(ranges)
+
+    def discard(self, document_id: str) -> None:
+        """Borra los descriptores pendientes de un documento eliminado."""
+        self._redis.delete(self.stream(document_id))
+
+
+def open_chunk_queue() -> Optional[ChunkQueue]:
+    """Cola configurada por entorno (REDIS_HOST/PORT/DB/PASSWORD), o None si está deshabilitada."""
+    if not CHUNK_QUEUE_ENABLED:
+        return None
+    if redis is None:
+        logger.warning("CHUNK_QUEUE_ENABLED=true pero el paquete redis no está instalado: cola de lotes deshabilitada")
+        return None
+    client = redis.Redis(
+        host=os.getenv("REDIS_HOST", "localhost"),
+        port=int(os.getenv("REDIS_PORT", "6379")),
+        db=int(os.getenv("REDIS_DB", "0")),
+        password=os.getenv("REDIS_PASSWORD"),
+        socket_timeout=5,
+        socket_connect_timeout=5,
+    )
+    return ChunkQueue(client, CHUNK_QUEUE_PREFIX, CHUNK_QUEUE_GROUP, CHUNK_QUEUE_TTL)
@@ -1,277 +1,199 @@
-import os
-import sqlite3
-from contextlib import contextmanager
-from typing import Dict, Iterable, List, Optional, Tuple
-
-import psycopg2
-import psycopg2.extras
-
-
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./persistence.db")
-
-
-def _is_postgres() -> bool:
-    return DATABASE_URL.startswith("postgres://") or DATABASE_URL.startswith("postgresql://")
-
-
-def _sqlite_path() -> str:
-    # sqlite:///./persistence.db -> ./persistence.db
-    if DATABASE_URL.startswith("sqlite///"):
-        return DATABASE_URL[len("sqlite///") :]
-    if DATABASE_URL.startswith("sqlite:///"):
-        return DATABASE_URL[len("sqlite:///") :]
-    if DATABASE_URL.startswith("sqlite://"):
-        return DATABASE_URL[len("sqlite://") :]
-    return "./persistence.db"
-
-
-@contextmanager
-def get_connection():
-    if _is_postgres():
-        conn = psycopg2.connect(DATABASE_URL)
-        try:
-            yield conn
-            conn.commit()
-        except Exception:
-            conn.rollback()
-            raise
-        finally:
-            conn.close()
-    else:
-        path = _sqlite_path()
-        conn = sqlite3.connect(path, check_same_thread=False)
-        try:
-            conn.execute("PRAGMA foreign_keys=ON;")
-            yield conn
-            conn.commit()
-        except Exception:
-            conn.rollback()
-            raise
-        finally:
-            conn.close()
+"""
+Fachada de acceso a datos usada por los endpoints.
+Cada función delega en el backend de almacenamiento seleccionado (ver app.storage);
+el SQL de cada motor vive en su propio módulo.
+"""
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .ruleset import load_dictionary, ruleset_version
+from .storage import (
+    CLASSIFIED_COLUMNS,
+    EXPORT_COLUMNS,
+    EXPORT_FETCH_SIZE,
+    RAW_COLUMNS,
+    ROLLUP_DIMENSIONS,
+    SEARCH_COLUMNS,
+    get_backend,
+)
+from .storage.codes import dictionary_entries
 
 
 def init_db() -> None:
-    if _is_postgres():
-        create_raw = """
-        CREATE TABLE IF NOT EXISTS raw_incidents (
-            id SERIAL PRIMARY KEY,
-            document_id VARCHAR(64) NOT NULL,
-            row_index INTEGER NOT NULL,
-            source_path TEXT,
-            col_a TEXT, col_b TEXT, col_c TEXT, col_d TEXT, col_e TEXT, col_f TEXT, col_g TEXT, col_h TEXT,
-            col_i TEXT, col_j TEXT, col_k TEXT, col_l TEXT, col_m TEXT, col_n TEXT, col_o TEXT, col_p TEXT, col_q TEXT,
-            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
-            CONSTRAINT uq_raw_document_row UNIQUE (document_id, row_index)
-        );
-        CREATE INDEX IF NOT EXISTS ix_raw_document_row ON raw_incidents(document_id, row_index);
-        """
-        create_classified = """
-        CREATE TABLE IF NOT EXISTS classified_incidents (
-            id SERIAL PRIMARY KEY,
-            document_id VARCHAR(64) NOT NULL,
-            raw_incident_id INTEGER NOT NULL REFERENCES raw_incidents(id) ON DELETE CASCADE,
-            col_r TEXT, col_s TEXT, col_t TEXT, col_u TEXT, col_v TEXT, col_w TEXT, col_x TEXT, col_y TEXT, col_z TEXT,
-            col_aa TEXT, col_ab TEXT,
-            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
-            CONSTRAINT uq_classified_raw UNIQUE (raw_incident_id)
-        );
-        CREATE INDEX IF NOT EXISTS ix_classified_document_raw ON classified_incidents(document_id, raw_incident_id);
-        """
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(create_raw)
-                cur.execute(create_classified)
-    else:
-        create_raw = """
-        CREATE TABLE IF NOT EXISTS raw_incidents (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            document_id TEXT NOT NULL,
-            row_index INTEGER NOT NULL,
-            source_path TEXT,
-            col_a TEXT, col_b TEXT, col_c TEXT, col_d TEXT, col_e TEXT, col_f TEXT, col_g TEXT, col_h TEXT,
-            col_i TEXT, col_j TEXT, col_k TEXT, col_l TEXT, col_m TEXT, col_n TEXT, col_o TEXT, col_p TEXT, col_q TEXT,
-            created_at TEXT DEFAULT (datetime('now')),
-            CONSTRAINT uq_raw_document_row UNIQUE (document_id, row_index)
-        );
-        CREATE INDEX IF NOT EXISTS ix_raw_document_row ON raw_incidents(document_id, row_index);
-        """
-        create_classified = """
-        CREATE TABLE IF NOT EXISTS classified_incidents (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            document_id TEXT NOT NULL,
-            raw_incident_id INTEGER NOT NULL,
-            col_r TEXT, col_s TEXT, col_t TEXT, col_u TEXT, col_v TEXT, col_w TEXT, col_x TEXT, col_y TEXT, col_z TEXT,
-            col_aa TEXT, col_ab TEXT,
-            created_at TEXT DEFAULT (datetime('now')),
-            CONSTRAINT uq_classified_raw UNIQUE (raw_incident_id),
-            FOREIGN KEY (raw_incident_id) REFERENCES raw_incidents(id) ON DELETE CASCADE
-        );
-        CREATE INDEX IF NOT EXISTS ix_classified_document_raw ON classified_incidents(document_id, raw_incident_id);
-        """
-        with get_connection() as conn:
-            cur = conn.cursor()
-            cur.executescript(create_raw)
-            cur.executescript(create_classified)
+    """Crea el esquema y sincroniza category_codes con el diccionario vigente."""
+    backend = get_backend()
+    backend.init_schema()
+    backend.sync_category_codes(dictionary_entries(load_dictionary()), ruleset_version())
+
+
+def start_maintenance() -> None:
+    get_backend().start_maintenance()
+
+
+def pool_stats() -> Dict:
+    """Métricas del pool de conexiones (espera de checkout, saturación, reciclado)."""
+    backend = get_backend()
+    return {"backend": backend.name, **backend.stats()}
+
+
+def get_connection(document_id: Optional[str] = None, create: bool = False):
+    return get_backend().connection(document_id, create=create)
+
+
+def prepare_document_storage(document_id: str) -> None:
+    """
+    Prepara el almacenamiento de un documento antes de importarlo.
+    Con POSTGRES_PARTITIONING=document crea sus particiones LIST y con SQLITE_SHARDING
+    da de alta su archivo; en otros modos no hace nada.
+    """
+    get_backend().prepare_document(document_id)
+
+
+def drop_document(document_id: str) -> None:
+    """Elimina todas las filas de un documento (DETACH + DROP, borrado de shard o DELETE en cascada)."""
+    get_backend().drop_document(document_id)
+
+
+def find_document_by_fingerprint(fingerprint: str) -> Optional[str]:
+    return get_backend().find_fingerprint(fingerprint)
+
+
+def record_document_fingerprint(fingerprint: str, document_id: str, file_sha256: str, ruleset_version: str) -> None:
+    get_backend().record_fingerprint(fingerprint, document_id, file_sha256, ruleset_version)
+
+
+def forget_document_fingerprints(document_id: str) -> None:
+    get_backend().forget_fingerprints(document_id)
+
+
+def apply_document_delta(
+    document_id: str, rows: Iterable[Tuple[int, Optional[str], List[Optional[str]]]]
+) -> Optional[Dict[str, int]]:
+    """
+    Import incremental sobre un documento existente: inserta filas nuevas, actualiza las que
+    cambiaron (y las deja pendientes de clasificar) y no toca las iguales. None si no existe.
+    """
+    return get_backend().apply_delta(document_id, rows)
 
 
 def insert_raw_incident(document_id: str, row_index: int, source_path: Optional[str], values_a_q: List[Optional[str]]) -> None:
-    if _is_postgres():
-        sql = (
-            "INSERT INTO raw_incidents (document_id, row_index, source_path, col_a, col_b, col_c, col_d, col_e, col_f, col_g, col_h, col_i, col_j, col_k, col_l, col_m, col_n, col_o, col_p, col_q) "
-            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT DO NOTHING"
-        )
-        params = [document_id, row_index, source_path] + values_a_q
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, params)
-    else:
-        sql = (
-            "INSERT OR IGNORE INTO raw_incidents (document_id, row_index, source_path, col_a, col_b, col_c, col_d, col_e, col_f, col_g, col_h, col_i, col_j, col_k, col_l, col_m, col_n, col_o, col_p, col_q) "
-            "VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)"
-        )
-        params = [document_id, row_index, source_path] + values_a_q
-        with get_connection() as conn:
-            cur = conn.cursor()
-            cur.execute(sql, params)
-
-
-def fetch_unclassified_chunk(document_id: str, limit: int) -> List[Dict]:
-    if _is_postgres():
-        sql = (
-            "SELECT r.* FROM raw_incidents r WHERE r.document_id=%s AND NOT EXISTS (SELECT 1 FROM classified_incidents c WHERE c.raw_incident_id=r.id) "
-            "ORDER BY r.row_index ASC LIMIT %s"
-        )
-        with get_connection() as conn:
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                cur.execute(sql, (document_id, limit))
-                rows = cur.fetchall()
-                return [dict(row) for row in rows]
-    else:
-        sql = (
-            "SELECT r.* FROM raw_incidents r WHERE r.document_id=? AND NOT EXISTS (SELECT 1 FROM classified_incidents c WHERE c.raw_incident_id=r.id) "
-            "ORDER BY r.row_index ASC LIMIT ?"
-        )
-        with get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            cur = conn.cursor()
-            cur.execute(sql, (document_id, limit))
-            return [dict(row) for row in cur.fetchall()]
+    get_backend().insert_raw_incident(document_id, row_index, source_path, values_a_q)
+
+
+def insert_raw_incidents(document_id: str, rows: Iterable[Tuple[int, Optional[str], List[Optional[str]]]]) -> int:
+    """
+    Importa filas (row_index, source_path, valores A..Q) en una sola transacción junto con
+    sus contadores de document_stats. Devuelve las filas insertadas.
+    """
+    return get_backend().insert_raw_incidents(document_id, rows)
+
+
+def get_document_stats(document_id: str) -> Optional[Dict[str, Any]]:
+    """Progreso del documento leído de document_stats, sin recorrer las tablas de incidentes."""
+    return get_backend().get_document_stats(document_id)
+
+
+def fetch_unclassified_chunk(document_id: str, limit: int, row_range: Optional[Tuple[int, int]] = None) -> List[Dict]:
+    return get_backend().fetch_unclassified_chunk(document_id, limit, row_range)
+
+
+def fetch_unclassified_chunks(document_ids: List[str], limit: int) -> List[Tuple[str, List[Dict]]]:
+    """Hasta `limit` filas sin clasificar en total de varios documentos: (document_id, filas) por documento leído."""
+    return get_backend().fetch_unclassified_chunks(document_ids, limit)
+
+
+def unclassified_row_ranges(document_id: str, size: int) -> List[Tuple[int, int, int]]:
+    """Rangos (row_from, row_to, filas) de row_index con hasta `size` filas sin clasificar (cola de lotes)."""
+    return get_backend().unclassified_row_ranges(document_id, size)
 
 
 def insert_classified_items(document_id: str, items: List[Dict]) -> int:
     """
-    Inserta items clasificados en una transacción atómica.
-    Si falla cualquier INSERT, se hace ROLLBACK de todo el lote.
+    Inserta items clasificados en una transacción atómica con una sola sentencia por lote.
+    Si falla el INSERT, se hace ROLLBACK de todo el lote.
+    Devuelve la cantidad exacta de filas insertadas (las ya clasificadas se ignoran).
+    """
+    return get_backend().insert_classified_items(document_id, items)
+
+
+def save_classified_and_fetch_next(document_id: str, items: List[Dict], limit: int) -> Tuple[int, List[Dict]]:
+    """
+    Guarda un lote clasificado y devuelve el siguiente lote sin clasificar en la misma transacción.
+    Devuelve (guardados, filas); con limit=0 solo guarda.
+    """
+    return get_backend().save_and_fetch_next(document_id, items, limit)
+
+
+def insert_classified_group(batches: List[Tuple[str, List[Dict]]]) -> List[Tuple[Optional[int], Optional[Exception]]]:
+    """
+    Group commit: guarda varios lotes (document_id, items) en una transacción, un SAVEPOINT por lote.
+    Devuelve, por lote y en el mismo orden, (guardados, error).
+    """
+    return get_backend().insert_classified_group(batches)
+
+
+def rollup_counts(
+    group_by: List[str],
+    document_ids: Optional[List[str]] = None,
+    filters: Optional[Dict[str, str]] = None,
+    mes_desde: Optional[str] = None,
+    mes_hasta: Optional[str] = None,
+) -> List[Tuple]:
+    """
+    Conteos de filas clasificadas agrupados por calificación, modalidad, jurisdicción y/o mes,
+    de uno, varios o todos los documentos, leídos de los conteos pre-agregados.
+    Cada tupla es (valores de group_by..., total).
     """
-    if not items:
-        return 0
-    
-    saved = 0
-    
-    if _is_postgres():
-        sql = (
-            "INSERT INTO classified_incidents (document_id, raw_incident_id, col_r, col_s, col_t, col_u, col_v, col_w, col_x, col_y, col_z, col_aa, col_ab) "
-            "VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s) ON CONFLICT (raw_incident_id) DO NOTHING"
-        )
-        
-        # Crear conexión manual para control de transacción
-        conn = psycopg2.connect(DATABASE_URL)
-        try:
-            with conn.cursor() as cur:
-                # Iniciar transacción
-                cur.execute("BEGIN")
-                
-                for it in items:
-                    params = (
-                        document_id,
-                        it["raw_incident_id"],
-                        it.get("col_r"), it.get("col_s"), it.get("col_t"), it.get("col_u"), it.get("col_v"),
-                        it.get("col_w"), it.get("col_x"), it.get("col_y"), it.get("col_z"), it.get("col_aa"), it.get("col_ab"),
-                    )
-                    cur.execute(sql, params)
-                    saved += cur.rowcount and 1 or 0
-                
-                # Commit de toda la transacción
-                conn.commit()
-                
-        except Exception as e:
-            # ROLLBACK automático en caso de error
-            conn.rollback()
-            raise Exception(f"Error en transacción atómica: {str(e)}. Se hizo ROLLBACK de {len(items)} items.")
-        finally:
-            conn.close()
-            
-    else:
-        sql = (
-            "INSERT OR IGNORE INTO classified_incidents (document_id, raw_incident_id, col_r, col_s, col_t, col_u, col_v, col_w, col_x, col_y, col_z, col_aa, col_ab) "
-            "VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)"
-        )
-        
-        # Crear conexión manual para control de transacción
-        path = _sqlite_path()
-        conn = sqlite3.connect(path, check_same_thread=False)
-        try:
-            conn.execute("PRAGMA foreign_keys=ON;")
-            cur = conn.cursor()
-            
-            # Iniciar transacción
-            cur.execute("BEGIN TRANSACTION")
-            
-            for it in items:
-                params = (
-                    document_id,
-                    it["raw_incident_id"],
-                    it.get("col_r"), it.get("col_s"), it.get("col_t"), it.get("col_u"), it.get("col_v"),
-                    it.get("col_w"), it.get("col_x"), it.get("col_y"), it.get("col_z"), it.get("col_aa"), it.get("col_ab"),
-                )
-                cur.execute(sql, params)
-                saved += 1 if cur.rowcount else 0
-            
-            # Commit de toda la transacción
-            conn.commit()
-            
-        except Exception as e:
-            # ROLLBACK automático en caso de error
-            conn.rollback()
-            raise Exception(f"Error en transacción atómica: {str(e)}. Se hizo ROLLBACK de {len(items)} items.")
-        finally:
-            conn.close()
-    
-    return saved
-
-
-def fetch_raws(document_id: str) -> List[Dict]:
-    if _is_postgres():
-        sql = "SELECT * FROM raw_incidents WHERE document_id=%s ORDER BY row_index ASC"
-        with get_connection() as conn:
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                cur.execute(sql, (document_id,))
-                return [dict(r) for r in cur.fetchall()]
-    else:
-        sql = "SELECT * FROM raw_incidents WHERE document_id=? ORDER BY row_index ASC"
-        with get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            cur = conn.cursor()
-            cur.execute(sql, (document_id,))
-            return [dict(r) for r in cur.fetchall()]
-
-
-def fetch_classified_map(document_id: str) -> Dict[int, Dict]:
-    if _is_postgres():
-        sql = "SELECT * FROM classified_incidents WHERE document_id=%s"
-        with get_connection() as conn:
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                cur.execute(sql, (document_id,))
-                rows = cur.fetchall()
-                return {int(r["raw_incident_id"]): dict(r) for r in rows}
-    else:
-        sql = "SELECT * FROM classified_incidents WHERE document_id=?"
-        with get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            cur = conn.cursor()
-            cur.execute(sql, (document_id,))
-            rows = cur.fetchall()
-            return {int(r["raw_incident_id"]): dict(r) for r in rows}
+    return get_backend().rollup_counts(group_by, document_ids, filters, mes_desde, mes_hasta)
 
 
+def search_incidents(
+    query: str, document_ids: Optional[List[str]] = None, limit: int = 20, offset: int = 0
+) -> Tuple[List[Tuple], bool]:
+    """
+    Búsqueda de texto completo sobre A..Q (FTS5 en SQLite, tsvector + GIN en Postgres), de uno,
+    varios o todos los documentos: (filas, truncated). Cada tupla sigue SEARCH_COLUMNS, de más a
+    menos relevante dentro de la ventana de SEARCH_RANK_WINDOW; truncated indica que hubo más
+    coincidencias y que siguen por id descendente.
+    """
+    return get_backend().search(query, document_ids, limit, offset)
+
+
+def iter_export_rows(document_id: str, fetch_size: int = EXPORT_FETCH_SIZE) -> Iterator[Tuple]:
+    """
+    Recorre el documento en orden de row_index con un único LEFT JOIN entre raw y clasificados.
+    Cada fila es una tupla con el orden de EXPORT_COLUMNS; ningún consumidor materializa
+    el documento en memoria.
+    """
+    return get_backend().iter_export_rows(document_id, fetch_size)
+
+
+__all__ = [
+    "CLASSIFIED_COLUMNS",
+    "EXPORT_COLUMNS",
+    "EXPORT_FETCH_SIZE",
+    "RAW_COLUMNS",
+    "ROLLUP_DIMENSIONS",
+    "SEARCH_COLUMNS",
+    "apply_document_delta",
+    "drop_document",
+    "fetch_unclassified_chunk",
+    "fetch_unclassified_chunks",
+    "find_document_by_fingerprint",
+    "forget_document_fingerprints",
+    "get_connection",
+    "get_document_stats",
+    "init_db",
+    "insert_classified_group",
+    "insert_classified_items",
+    "insert_raw_incident",
+    "insert_raw_incidents",
+    "iter_export_rows",
+    "pool_stats",
+    "prepare_document_storage",
+    "record_document_fingerprint",
+    "rollup_counts",
+    "save_classified_and_fetch_next",
+    "search_incidents",
+    "start_maintenance",
+    "unclassified_row_ranges",
+]
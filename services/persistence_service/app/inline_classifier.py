@@ -0,0 +1,90 @@
+"""
+Clasificación en proceso para documentos chicos (INLINE_CLASSIFY_MAX_ROWS > 0).
+
+Las planillas diarias de unos cientos de filas pasan más tiempo en la cola de Celery, Redis y los
+viajes HTTP por lote que clasificándose. Si después de un import quedan hasta
+INLINE_CLASSIFY_MAX_ROWS filas sin clasificar, persistencia carga el motor de reglas del servicio
+de clasificación (classifier.py, como biblioteca) y guarda el resultado con la capa de storage en el
+mismo request: el import vuelve ya clasificado. Documentos más grandes siguen yendo a los workers.
+"""
+import importlib.util
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+from .database import RAW_COLUMNS, fetch_unclassified_chunk, get_document_stats, insert_classified_items
+
+logger = logging.getLogger("persistence_service")
+
+# Filas sin clasificar hasta las que se clasifica en el request del import (0: deshabilitado)
+INLINE_CLASSIFY_MAX_ROWS = int(os.getenv("INLINE_CLASSIFY_MAX_ROWS", "0"))
+# Mismas columnas que lee un worker (PERSISTENCE_CHUNK_FIELDS; vacío: todas): el puntaje depende del texto recibido
+INLINE_CLASSIFY_FIELDS = [f.strip() for f in os.getenv("INLINE_CLASSIFY_FIELDS", "").split(",") if f.strip()]
+
+_APP_DIR = Path(__file__).resolve().parent
+# classifier.py copiado junto a la app (Docker) o el del servicio de clasificación en el repo
+CLASSIFIER_CANDIDATES = [
+    _APP_DIR.parent / "classifier" / "classifier.py",
+    _APP_DIR.parents[1] / "classification_service" / "app" / "classifier.py",
+]
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def _classifier_path() -> Optional[Path]:
+    if os.getenv("CLASSIFIER_PATH"):
+        return Path(os.getenv("CLASSIFIER_PATH"))
+    return next((path for path in CLASSIFIER_CANDIDATES if path.exists()), None)
+
+
+def load_engine():
+    """Módulo classifier.py cargado por ruta (no es un paquete importable desde persistencia)."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            path = _classifier_path()
+            if path is None or not path.exists():
+                raise FileNotFoundError("classifier.py no encontrado (CLASSIFIER_PATH)")
+            spec = importlib.util.spec_from_file_location("sentinel_classifier", path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            _engine = module
+        return _engine
+
+
+def classify_inline(document_id: str) -> Optional[int]:
+    """
+    Clasifica en proceso las filas pendientes del documento si no superan INLINE_CLASSIFY_MAX_ROWS.
+    Devuelve las filas guardadas, o None si el documento queda para los workers (deshabilitado,
+    demasiado grande o error: el import no falla por esto).
+    """
+    if INLINE_CLASSIFY_MAX_ROWS <= 0:
+        return None
+    stats = get_document_stats(document_id)
+    if stats is None or not 0 < stats["total_rows"] - stats["classified_rows"] <= INLINE_CLASSIFY_MAX_ROWS:
+        return None
+    try:
+        engine = load_engine()
+        # Las mismas claves, en el mismo orden, que las filas de /data/chunk en JSON
+        columns: List[str] = ["id", "row_index"] + (INLINE_CLASSIFY_FIELDS or RAW_COLUMNS)
+        rows = [{c: r.get(c) for c in columns} for r in fetch_unclassified_chunk(document_id, INLINE_CLASSIFY_MAX_ROWS)]
+        results = engine.classify_rows(rows, "rules")
+        # Mismo contrato que el cliente de clasificación: col_s calificación, col_t modalidad, col_ab observaciones
+        items = [
+            {
+                "raw_incident_id": row["id"],
+                "col_s": result["categoria"] or None,
+                "col_t": result["subtipo"] or None,
+                "col_ab": result["observaciones"],
+            }
+            for row, result in zip(rows, results)
+        ]
+        saved = insert_classified_items(document_id, items)
+        logger.info("Clasificadas en proceso %s filas para document_id=%s", saved, document_id)
+        return saved
+    except Exception:
+        logger.exception("Error al clasificar en proceso document_id=%s; queda para los workers", document_id)
+        return None
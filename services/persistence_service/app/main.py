@@ -1,30 +1,85 @@
+import csv
+import hashlib
+import io
 import logging
 import os
 import uuid
-from typing import List
+from itertools import chain
+from typing import Dict, Iterator, List, Optional, Tuple
 from pathlib import Path
 
-from fastapi import FastAPI, HTTPException, Path, Query, UploadFile, File
-from fastapi.responses import FileResponse
+from fastapi import Depends, FastAPI, HTTPException, Path, Query, Request, Response, UploadFile, File
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import TypeAdapter, ValidationError
 
 from .database import (
+    apply_document_delta,
+    EXPORT_COLUMNS,
+    EXPORT_FETCH_SIZE,
+    drop_document,
     fetch_unclassified_chunk,
+    fetch_unclassified_chunks,
+    find_document_by_fingerprint,
+    forget_document_fingerprints,
+    get_document_stats,
     init_db,
+    insert_classified_group,
     insert_classified_items,
-    insert_raw_incident,
-    fetch_raws,
-    fetch_classified_map,
+    insert_raw_incidents,
+    iter_export_rows,
+    pool_stats,
+    prepare_document_storage,
+    RAW_COLUMNS,
+    record_document_fingerprint,
+    rollup_counts,
+    ROLLUP_DIMENSIONS,
+    save_classified_and_fetch_next,
+    SEARCH_COLUMNS,
+    search_incidents,
+    start_maintenance,
+    unclassified_row_ranges,
 )
 from .models import (
     ChunkResponse,
+    DocumentStatsResponse,
     GenerateFinalResponse,
+    MultiChunkResponse,
     PrepareRequest,
     PrepareResponse,
-    SaveClassifiedChunkRequest,
+    SaveAndNextResponse,
     SaveClassifiedChunkResponse,
+    SaveClassifiedChunksResponse,
+    SaveClassifiedItem,
+    SearchHit,
+    SearchResponse,
+    StatsGroup,
+    StatsResponse,
+    chunk_adapter,
+    multi_chunk_adapter,
+    save_and_next_adapter,
+    save_classified_adapter,
+    save_classified_many_adapter,
 )
 
+from .chunk_queue import CHUNK_QUEUE_SIZE, open_chunk_queue
+from .inline_classifier import classify_inline
+from .ruleset import import_fingerprint, ruleset_version
+from .wire import (
+    MSGPACK_MEDIA_TYPE,
+    BodyTooLarge,
+    accepts_msgpack,
+    compress,
+    decompress,
+    is_msgpack,
+    pack_chunk,
+    pick_encoding,
+    unpack_items,
+)
+from .write_coalescer import GroupCommitWriter
+
 from openpyxl import load_workbook, Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import PatternFill
 
 
@@ -45,6 +100,50 @@ UPLOADS_DIR = DATA_DIR / "uploads"
 FINAL_DIR = DATA_DIR / "final"
 
 
+# Columnas A..Q que debe tener todo Excel importado
+MIN_REQUIRED_COLS = 17
+
+
+# Group commit de /data/save_classified_chunk: agrupa lotes concurrentes en una sola transacción
+SAVE_COALESCE_ENABLED = os.getenv("SAVE_COALESCE_ENABLED", "false").lower() == "true"
+SAVE_COALESCE_WINDOW_MS = float(os.getenv("SAVE_COALESCE_WINDOW_MS", "5"))
+SAVE_COALESCE_MAX_ROWS = int(os.getenv("SAVE_COALESCE_MAX_ROWS", "5000"))
+
+save_writer = (
+    GroupCommitWriter(window_ms=SAVE_COALESCE_WINDOW_MS, max_rows=SAVE_COALESCE_MAX_ROWS)
+    if SAVE_COALESCE_ENABLED
+    else None
+)
+
+# Cola de lotes en Redis (CHUNK_QUEUE_ENABLED): descriptores publicados al importar
+chunk_queue = open_chunk_queue()
+
+
+def publish_chunks(document_id: str) -> None:
+    """
+    Publica en la cola de lotes los rangos sin clasificar del documento, después del COMMIT del import.
+    Un error no falla el import: sin descriptores los workers leen las filas pendientes de la base.
+    """
+    if chunk_queue is None:
+        return
+    try:
+        published = chunk_queue.publish(document_id, unclassified_row_ranges(document_id, CHUNK_QUEUE_SIZE))
+        logger.info("Publicados %s lotes en la cola para document_id=%s", published, document_id)
+    except Exception:
+        logger.exception("No se pudieron publicar los lotes de document_id=%s", document_id)
+
+
+def after_import(document_id: str) -> Optional[int]:
+    """
+    Después del COMMIT de un import: un documento chico se clasifica en el mismo request
+    (INLINE_CLASSIFY_MAX_ROWS) y lo que quede sin clasificar se publica en la cola de lotes.
+    Devuelve las filas clasificadas en proceso (None si quedan para los workers).
+    """
+    classified = classify_inline(document_id)
+    publish_chunks(document_id)
+    return classified
+
+
 def ensure_directories():
     """Crea los directorios necesarios para uploads y archivos finales"""
     UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
@@ -53,18 +152,45 @@ def ensure_directories():
     logger.info("Directorios de datos creados/verificados")
 
 
+def _worksheet_rows(ws, source_path: str) -> Iterator[Tuple[int, str, List[Optional[str]]]]:
+    """Filas (row_index, source_path, valores A..Q) del Excel; fila 1 es encabezado y se saltan las vacías."""
+    for idx, row in enumerate(ws.iter_rows(min_row=2, max_col=MIN_REQUIRED_COLS, values_only=True), start=2):
+        values = list(row)
+        # Si la fila está completamente vacía, se salta
+        if all(v is None for v in values):
+            continue
+        values_a_q = [str(v) if v is not None else None for v in values]
+        values_a_q += [None] * (MIN_REQUIRED_COLS - len(values_a_q))
+        yield idx, source_path, values_a_q
+
+
 @app.on_event("startup")
 def on_startup():
     init_db()
+    start_maintenance()
     ensure_directories()
+    if save_writer is not None:
+        save_writer.start()
     logger.info("Base de datos inicializada y directorios creados")
 
 
+@app.on_event("shutdown")
+def on_shutdown():
+    if save_writer is not None:
+        save_writer.stop()
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
 
+@app.get("/health/db")
+def health_db():
+    """Métricas del pool de conexiones: tiempo de espera de checkout y saturación."""
+    return {"status": "ok", "pool": pool_stats()}
+
+
 @app.post("/sheet/prepare", response_model=PrepareResponse)
 def prepare_sheet(payload: PrepareRequest):
     """
@@ -81,45 +207,21 @@ def prepare_sheet(payload: PrepareRequest):
         ws = wb.active
 
         # Validación: mínimo 17 columnas (A..Q)
-        min_required_cols = 17
-        if ws.max_column < min_required_cols:
+        if ws.max_column < MIN_REQUIRED_COLS:
             logger.error("El Excel no posee las columnas A-Q requeridas (encontradas: %s)", ws.max_column)
             raise HTTPException(status_code=400, detail="El Excel no posee las columnas A-Q requeridas")
 
+        if payload.base_document_id:
+            return _apply_delta(payload.base_document_id, ws, file_path)
+
         document_id = str(uuid.uuid4())
-        num_imported = 0
-
-        # Asumimos fila 1 como encabezado. Importamos desde fila 2.
-        for idx, row in enumerate(ws.iter_rows(min_row=2, max_col=min_required_cols, values_only=True), start=2):
-            values = list(row)
-            # Si la fila está completamente vacía, se salta
-            if all(v is None for v in values):
-                continue
-
-            values_a_q = [
-                str(values[0]) if len(values) > 0 and values[0] is not None else None,
-                str(values[1]) if len(values) > 1 and values[1] is not None else None,
-                str(values[2]) if len(values) > 2 and values[2] is not None else None,
-                str(values[3]) if len(values) > 3 and values[3] is not None else None,
-                str(values[4]) if len(values) > 4 and values[4] is not None else None,
-                str(values[5]) if len(values) > 5 and values[5] is not None else None,
-                str(values[6]) if len(values) > 6 and values[6] is not None else None,
-                str(values[7]) if len(values) > 7 and values[7] is not None else None,
-                str(values[8]) if len(values) > 8 and values[8] is not None else None,
-                str(values[9]) if len(values) > 9 and values[9] is not None else None,
-                str(values[10]) if len(values) > 10 and values[10] is not None else None,
-                str(values[11]) if len(values) > 11 and values[11] is not None else None,
-                str(values[12]) if len(values) > 12 and values[12] is not None else None,
-                str(values[13]) if len(values) > 13 and values[13] is not None else None,
-                str(values[14]) if len(values) > 14 and values[14] is not None else None,
-                str(values[15]) if len(values) > 15 and values[15] is not None else None,
-                str(values[16]) if len(values) > 16 and values[16] is not None else None,
-            ]
-            insert_raw_incident(document_id, idx, file_path, values_a_q)
-            num_imported += 1
+        prepare_document_storage(document_id)
+        # Una sola transacción para todo el Excel (incluye el alta en document_stats)
+        num_imported = insert_raw_incidents(document_id, _worksheet_rows(ws, file_path))
+        classified = after_import(document_id)
 
         logger.info("Importadas %s filas para document_id=%s", num_imported, document_id)
-        return PrepareResponse(document_id=document_id, rows_imported=num_imported)
+        return PrepareResponse(document_id=document_id, rows_imported=num_imported, classified_rows=classified)
     except HTTPException:
         raise
     except Exception as exc:
@@ -127,24 +229,93 @@ def prepare_sheet(payload: PrepareRequest):
         raise HTTPException(status_code=500, detail=f"Error al preparar hoja: {exc}")
 
 
+def _apply_delta(document_id: str, ws, source_path: str) -> PrepareResponse:
+    """Import incremental de la hoja sobre un documento existente (solo se escriben las diferencias)."""
+    delta = apply_document_delta(document_id, _worksheet_rows(ws, source_path))
+    if delta is None:
+        raise HTTPException(status_code=404, detail="No hay datos para el document_id base indicado")
+    if delta["inserted"] or delta["updated"] or delta["removed"]:
+        # El contenido cambió: las huellas anteriores y el Excel final ya no lo representan
+        forget_document_fingerprints(document_id)
+        final_path = FINAL_DIR / f"final_{document_id}.xlsx"
+        if final_path.exists():
+            final_path.unlink()
+    classified = None
+    if delta["inserted"] or delta["updated"]:
+        # Filas nuevas o modificadas vuelven a clasificarse; los rangos ya encolados que queden vacíos se confirman sin trabajo
+        classified = after_import(document_id)
+    logger.info(
+        "Import incremental document_id=%s: %s nuevas, %s modificadas, %s iguales, %s quitadas",
+        document_id,
+        delta["inserted"],
+        delta["updated"],
+        delta["unchanged"],
+        delta["removed"],
+    )
+    return PrepareResponse(
+        document_id=document_id,
+        rows_imported=delta["inserted"],
+        rows_updated=delta["updated"],
+        rows_unchanged=delta["unchanged"],
+        rows_removed=delta["removed"],
+        classified_rows=classified,
+    )
+
+
+def _deduplicated_response(fingerprint: str) -> Optional[PrepareResponse]:
+    """Respuesta para un Excel ya importado con las mismas reglas, o None si hay que importarlo."""
+    document_id = find_document_by_fingerprint(fingerprint)
+    if document_id is None:
+        return None
+    stats = get_document_stats(document_id)
+    if stats is None:
+        # La huella quedó apuntando a un documento que ya no tiene filas
+        return None
+    final_path = FINAL_DIR / f"final_{document_id}.xlsx"
+    logger.info("Excel ya importado (huella %s...): se reutiliza document_id=%s", fingerprint[:12], document_id)
+    return PrepareResponse(
+        document_id=document_id,
+        rows_imported=stats["total_rows"],
+        deduplicated=True,
+        classified_rows=stats["classified_rows"],
+        final_file_path=str(final_path) if final_path.exists() else None,
+    )
+
+
 @app.post("/sheet/prepare-upload", response_model=PrepareResponse)
-def prepare_sheet_upload(file: UploadFile = File(...)):
+def prepare_sheet_upload(
+    file: UploadFile = File(...),
+    force: bool = Query(False, description="Reimportar aunque el mismo archivo ya se haya procesado"),
+    base_document_id: Optional[str] = Query(None, description="Documento a actualizar con un import incremental"),
+):
     """
     Recibe un archivo Excel subido, lo guarda y procesa usando la misma lógica que /sheet/prepare.
     Devuelve un document_id para identificar el dataset.
+    Si el mismo contenido ya se importó con la misma versión de reglas, devuelve el documento
+    existente (con su clasificación y su Excel final) sin reimportar; `force` lo evita.
+    Con `base_document_id` solo se aplican las diferencias sobre ese documento.
     """
     try:
         # Validar que sea un archivo Excel
         if not file.filename.lower().endswith(('.xlsx', '.xls')):
             raise HTTPException(status_code=400, detail="El archivo debe ser un Excel (.xlsx o .xls)")
         
+        content = file.file.read()
+        file_sha256 = hashlib.sha256(content).hexdigest()
+        version = ruleset_version()
+        fingerprint = import_fingerprint(file_sha256, version)
+        if not force:
+            cached = _deduplicated_response(fingerprint)
+            # En modo incremental solo sirve si la hoja ya es la versión actual del documento base
+            if cached is not None and base_document_id in (None, cached.document_id):
+                return cached
+        
         # Generar document_id único
         document_id = str(uuid.uuid4())
         
         # Guardar archivo en UPLOADS_DIR
         upload_path = UPLOADS_DIR / f"{document_id}.xlsx"
         with open(upload_path, "wb") as buffer:
-            content = file.file.read()
             buffer.write(content)
         
         logger.info("Archivo guardado en: %s", upload_path)
@@ -154,44 +325,23 @@ def prepare_sheet_upload(file: UploadFile = File(...)):
         ws = wb.active
         
         # Validación: mínimo 17 columnas (A..Q)
-        min_required_cols = 17
-        if ws.max_column < min_required_cols:
+        if ws.max_column < MIN_REQUIRED_COLS:
             logger.error("El Excel no posee las columnas A-Q requeridas (encontradas: %s)", ws.max_column)
             raise HTTPException(status_code=400, detail="El Excel no posee las columnas A-Q requeridas")
         
-        num_imported = 0
-        
-        # Asumimos fila 1 como encabezado. Importamos desde fila 2.
-        for idx, row in enumerate(ws.iter_rows(min_row=2, max_col=min_required_cols, values_only=True), start=2):
-            values = list(row)
-            # Si la fila está completamente vacía, se salta
-            if all(v is None for v in values):
-                continue
-            
-            values_a_q = [
-                str(values[0]) if len(values) > 0 and values[0] is not None else None,
-                str(values[1]) if len(values) > 1 and values[1] is not None else None,
-                str(values[2]) if len(values) > 2 and values[2] is not None else None,
-                str(values[3]) if len(values) > 3 and values[3] is not None else None,
-                str(values[4]) if len(values) > 4 and values[4] is not None else None,
-                str(values[5]) if len(values) > 5 and values[5] is not None else None,
-                str(values[6]) if len(values) > 6 and values[6] is not None else None,
-                str(values[7]) if len(values) > 7 and values[7] is not None else None,
-                str(values[8]) if len(values) > 8 and values[8] is not None else None,
-                str(values[9]) if len(values) > 9 and values[9] is not None else None,
-                str(values[10]) if len(values) > 10 and values[10] is not None else None,
-                str(values[11]) if len(values) > 11 and values[11] is not None else None,
-                str(values[12]) if len(values) > 12 and values[12] is not None else None,
-                str(values[13]) if len(values) > 13 and values[13] is not None else None,
-                str(values[14]) if len(values) > 14 and values[14] is not None else None,
-                str(values[15]) if len(values) > 15 and values[15] is not None else None,
-                str(values[16]) if len(values) > 16 and values[16] is not None else None,
-            ]
-            insert_raw_incident(document_id, idx, str(upload_path), values_a_q)
-            num_imported += 1
+        if base_document_id:
+            response = _apply_delta(base_document_id, ws, str(upload_path))
+            record_document_fingerprint(fingerprint, base_document_id, file_sha256, version)
+            return response
+
+        prepare_document_storage(document_id)
+        # Una sola transacción para todo el Excel (incluye el alta en document_stats)
+        num_imported = insert_raw_incidents(document_id, _worksheet_rows(ws, str(upload_path)))
+        record_document_fingerprint(fingerprint, document_id, file_sha256, version)
+        classified = after_import(document_id)
         
         logger.info("Importadas %s filas para document_id=%s", num_imported, document_id)
-        return PrepareResponse(document_id=document_id, rows_imported=num_imported)
+        return PrepareResponse(document_id=document_id, rows_imported=num_imported, classified_rows=classified)
     except HTTPException:
         raise
     except Exception as exc:
@@ -199,73 +349,205 @@ def prepare_sheet_upload(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Error al preparar hoja desde upload: {exc}")
 
 
-@app.get("/data/chunk/{document_id}", response_model=ChunkResponse)
+def chunk_columns(fields: Optional[str]) -> List[str]:
+    """Columnas de un lote: id y row_index más la proyección de A..Q pedida en `fields` (todas por defecto)."""
+    projection = [f.strip() for f in fields.split(",") if f.strip()] if fields else RAW_COLUMNS
+    unknown = [f for f in projection if f not in RAW_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"fields inválido: {fields} (columnas: col_a..col_q)")
+    return ["id", "row_index"] + projection
+
+
+def msgpack_response(request: Request, body: bytes) -> Response:
+    """Respuesta msgpack, comprimida con gzip/zstd si el cliente lo acepta."""
+    body, encoding = compress(body, pick_encoding(request.headers.get("accept-encoding")))
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=MSGPACK_MEDIA_TYPE, headers=headers)
+
+
+def validated_json_response(adapter: TypeAdapter, content: Dict) -> Response:
+    """
+    Respuesta JSON validada y serializada por `adapter` (ver lean_schema) en una sola pasada: sin
+    construir el modelo de respuesta y volver a validarlo por response_model, que queda solo para OpenAPI.
+    """
+    return Response(content=adapter.dump_json(adapter.validate_python(content)), media_type="application/json")
+
+
+@app.get("/data/chunk/{document_id}", response_model=ChunkResponse, response_model_exclude_unset=True)
 def get_data_chunk(
+    request: Request,
     document_id: str = Path(..., description="Identificador del documento"),
     limit: int = Query(100, ge=1, le=1000, description="Cantidad máxima de filas a devolver"),
+    fields: Optional[str] = Query(None, description="Columnas A..Q a devolver, separadas por coma (id y row_index van siempre)"),
+    row_from: Optional[int] = Query(None, ge=0, description="Primer row_index del rango (descriptor de la cola de lotes)"),
+    row_to: Optional[int] = Query(None, ge=0, description="Último row_index del rango, inclusive"),
 ):
+    """
+    Lote de filas sin clasificar. Con `Accept: application/x-msgpack` se devuelve en msgpack
+    columnar (comprimido con gzip/zstd según Accept-Encoding); `fields` limita las columnas A..Q.
+    Con row_from/row_to solo se leen filas de ese rango de row_index.
+    """
+    columns = chunk_columns(fields)
+    if (row_from is None) != (row_to is None) or (row_from is not None and row_from > row_to):
+        raise HTTPException(status_code=400, detail="row_from y row_to van juntos y row_from <= row_to")
+    row_range = (row_from, row_to) if row_from is not None else None
     try:
-        rows = fetch_unclassified_chunk(document_id, limit)
-        items = [
-            {
-                "id": r["id"],
-                "row_index": r["row_index"],
-                "col_a": r.get("col_a"),
-                "col_b": r.get("col_b"),
-                "col_c": r.get("col_c"),
-                "col_d": r.get("col_d"),
-                "col_e": r.get("col_e"),
-                "col_f": r.get("col_f"),
-                "col_g": r.get("col_g"),
-                "col_h": r.get("col_h"),
-                "col_i": r.get("col_i"),
-                "col_j": r.get("col_j"),
-                "col_k": r.get("col_k"),
-                "col_l": r.get("col_l"),
-                "col_m": r.get("col_m"),
-                "col_n": r.get("col_n"),
-                "col_o": r.get("col_o"),
-                "col_p": r.get("col_p"),
-                "col_q": r.get("col_q"),
-            }
-            for r in rows
-        ]
-        logger.info("Devueltos %s registros no clasificados para document_id=%s", len(items), document_id)
-        return ChunkResponse(document_id=document_id, items=items)
+        rows = fetch_unclassified_chunk(document_id, limit, row_range)
+        logger.info("Devueltos %s registros no clasificados para document_id=%s", len(rows), document_id)
+        if accepts_msgpack(request.headers.get("accept")):
+            return msgpack_response(request, pack_chunk(document_id, columns, rows))
+        items = [{c: r.get(c) for c in columns} for r in rows]
+        return validated_json_response(chunk_adapter, {"document_id": document_id, "items": items})
     except Exception as exc:
         logger.exception("Error al obtener lote")
         raise HTTPException(status_code=500, detail=f"Error al obtener lote: {exc}")
 
 
+async def read_classified_chunk(request: Request) -> Tuple[str, List[Dict]]:
+    """Cuerpo de /data/save_classified_chunk: JSON o msgpack columnar, opcionalmente con gzip/zstd."""
+    body = await request.body()
+    try:
+        body = decompress(body, request.headers.get("content-encoding"))
+        if is_msgpack(request.headers.get("content-type")):
+            return unpack_items(body, list(SaveClassifiedItem.model_fields))
+        payload = save_classified_adapter.validate_json(body)
+    except ValidationError as exc:
+        raise RequestValidationError([{**e, "loc": ("body",) + tuple(e["loc"])} for e in exc.errors(include_url=False)])
+    except BodyTooLarge as exc:
+        raise HTTPException(status_code=413, detail=f"Cuerpo demasiado grande: {exc}")
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Cuerpo inválido: {exc}")
+    return payload["document_id"], payload["items"]
+
+
 @app.post("/data/save_classified_chunk", response_model=SaveClassifiedChunkResponse)
-def save_classified_chunk(payload: SaveClassifiedChunkRequest):
+def save_classified_chunk(chunk: Tuple[str, List[Dict]] = Depends(read_classified_chunk)):
+    document_id, items = chunk
+    try:
+        if save_writer is not None:
+            saved = save_writer.submit(document_id, items)
+        else:
+            saved = insert_classified_items(document_id, items)
+        logger.info("Guardados %s registros clasificados para document_id=%s", saved, document_id)
+        return SaveClassifiedChunkResponse(document_id=document_id, saved=saved)
+    except Exception as exc:
+        logger.exception("Error al guardar clasificados")
+        raise HTTPException(status_code=500, detail=f"Error al guardar clasificados: {exc}")
+
+
+@app.post("/data/save_classified_chunk/next", response_model=SaveAndNextResponse, response_model_exclude_unset=True)
+def save_classified_chunk_and_next(
+    request: Request,
+    chunk: Tuple[str, List[Dict]] = Depends(read_classified_chunk),
+    limit: int = Query(100, ge=0, le=1000, description="Filas del siguiente lote (0: solo guardar)"),
+    fields: Optional[str] = Query(None, description="Columnas A..Q del siguiente lote, separadas por coma"),
+):
+    """
+    Guarda un lote clasificado (mismo cuerpo que /data/save_classified_chunk) y devuelve el
+    siguiente lote sin clasificar del documento, leído en la misma transacción: un viaje por lote
+    en lugar de dos. Negocia msgpack igual que /data/chunk.
+    """
+    document_id, items = chunk
+    columns = chunk_columns(fields)
     try:
-        saved = insert_classified_items(
-            payload.document_id,
-            [item.model_dump() for item in payload.items],
+        if save_writer is not None:
+            # El group commit agrupa el guardado con otros lotes; el siguiente lote se lee después
+            saved = save_writer.submit(document_id, items)
+            rows = fetch_unclassified_chunk(document_id, limit) if limit else []
+        else:
+            saved, rows = save_classified_and_fetch_next(document_id, items, limit)
+        logger.info(
+            "Guardados %s registros clasificados y devueltos %s no clasificados para document_id=%s",
+            saved, len(rows), document_id,
         )
-        logger.info("Guardados %s registros clasificados para document_id=%s", saved, payload.document_id)
-        return SaveClassifiedChunkResponse(document_id=payload.document_id, saved=saved)
+        if accepts_msgpack(request.headers.get("accept")):
+            return msgpack_response(request, pack_chunk(document_id, columns, rows, saved=saved))
+        items = [{c: r.get(c) for c in columns} for r in rows]
+        return validated_json_response(save_and_next_adapter, {"document_id": document_id, "saved": saved, "items": items})
     except Exception as exc:
         logger.exception("Error al guardar clasificados")
         raise HTTPException(status_code=500, detail=f"Error al guardar clasificados: {exc}")
 
 
+@app.get("/data/chunks", response_model=MultiChunkResponse)
+def get_data_chunks(
+    document_id: List[str] = Query(..., description="Documentos a leer, en orden (repetible)"),
+    limit: int = Query(500, ge=1, le=2000, description="Cantidad máxima de filas en total"),
+    fields: Optional[str] = Query(None, description="Columnas A..Q a devolver, separadas por coma (id y row_index van siempre)"),
+):
+    """
+    Filas sin clasificar de varios documentos chicos en un solo request (lotes combinados de los
+    workers): se recorren en orden hasta juntar `limit` filas. Un documento con `items` vacío no
+    tiene pendientes; los que no entraron en el límite no aparecen en la respuesta.
+    """
+    columns = chunk_columns(fields)
+    try:
+        chunks = fetch_unclassified_chunks(list(dict.fromkeys(document_id)), limit)
+        logger.info(
+            "Devueltos %s registros no clasificados de %s documentos",
+            sum(len(rows) for _, rows in chunks), len(chunks),
+        )
+        documents = [
+            {"document_id": doc_id, "items": [{c: r.get(c) for c in columns} for r in rows]}
+            for doc_id, rows in chunks
+        ]
+        return validated_json_response(multi_chunk_adapter, {"documents": documents})
+    except Exception as exc:
+        logger.exception("Error al obtener lotes")
+        raise HTTPException(status_code=500, detail=f"Error al obtener lotes: {exc}")
+
+
+async def read_classified_chunks(request: Request) -> List[Tuple[str, List[Dict]]]:
+    """Cuerpo JSON de /data/save_classified_chunks: (document_id, items) por documento."""
+    try:
+        payload = save_classified_many_adapter.validate_json(await request.body())
+    except ValidationError as exc:
+        raise RequestValidationError([{**e, "loc": ("body",) + tuple(e["loc"])} for e in exc.errors(include_url=False)])
+    return [(doc["document_id"], doc["items"]) for doc in payload["documents"]]
+
+
+@app.post("/data/save_classified_chunks", response_model=SaveClassifiedChunksResponse)
+def save_classified_chunks(batches: List[Tuple[str, List[Dict]]] = Depends(read_classified_chunks)):
+    """
+    Guarda los lotes clasificados de varios documentos ({documents: [{document_id, items}]}) en un
+    request: una transacción con un SAVEPOINT por documento. Si algún documento falla se responde 500;
+    los demás quedan guardados y reintentar el request no los duplica.
+    """
+    try:
+        results = insert_classified_group(batches)
+    except Exception as exc:
+        logger.exception("Error al guardar clasificados")
+        raise HTTPException(status_code=500, detail=f"Error al guardar clasificados: {exc}")
+    errors = [(doc_id, error) for (doc_id, _), (_, error) in zip(batches, results) if error is not None]
+    if errors:
+        for doc_id, error in errors:
+            logger.error("Error al guardar clasificados de document_id=%s: %s", doc_id, error)
+        raise HTTPException(status_code=500, detail=f"Error al guardar clasificados: {errors[0][1]}")
+    logger.info(
+        "Guardados %s registros clasificados de %s documentos", sum(saved for saved, _ in results), len(batches)
+    )
+    return SaveClassifiedChunksResponse(
+        documents=[
+            SaveClassifiedChunkResponse(document_id=doc_id, saved=saved)
+            for (doc_id, _), (saved, _) in zip(batches, results)
+        ]
+    )
+
+
 @app.post("/sheet/generate_final/{document_id}", response_model=GenerateFinalResponse)
 def generate_final_sheet(document_id: str):
     try:
-        # Traer todos los raw para el document_id
-        raws = fetch_raws(document_id)
-        if not raws:
+        # Un único recorrido ordenado por row_index (raw LEFT JOIN clasificados)
+        rows = iter_export_rows(document_id)
+        first = next(rows, None)
+        if first is None:
             raise HTTPException(status_code=404, detail="No hay datos para el document_id indicado")
 
-        # Mapear clasificados por raw_incident_id
-        classified_by_raw = fetch_classified_map(document_id)
-
-        # Construir nuevo Excel con encabezados A..Q y R..AB
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "final"
+        # Workbook en modo write-only: las filas se vuelcan a disco a medida que se escriben
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(title="final")
 
         headers_a_q = [
             "A",
@@ -299,59 +581,32 @@ def generate_final_sheet(document_id: str):
             "AA",
             "AB",
         ]
-        ws.append(headers_a_q + headers_r_ab)
 
-        # Color de relleno para columnas R-AB
+        # Color de relleno para columnas R-AB (incluyendo encabezados), aplicado en la misma pasada
         fill = PatternFill(fill_type="solid", start_color="FFB2A1C7", end_color="FFB2A1C7")
+        num_a_q = len(headers_a_q)
 
-        # Escribir datos fila por fila
-        for r in raws:
-            a_q_values = [
-                r.get("col_a"),
-                r.get("col_b"),
-                r.get("col_c"),
-                r.get("col_d"),
-                r.get("col_e"),
-                r.get("col_f"),
-                r.get("col_g"),
-                r.get("col_h"),
-                r.get("col_i"),
-                r.get("col_j"),
-                r.get("col_k"),
-                r.get("col_l"),
-                r.get("col_m"),
-                r.get("col_n"),
-                r.get("col_o"),
-                r.get("col_p"),
-                r.get("col_q"),
-            ]
-            c = classified_by_raw.get(r["id"])
-            r_ab_values = [
-                c.get("col_r") if c else None,
-                c.get("col_s") if c else None,
-                c.get("col_t") if c else None,
-                c.get("col_u") if c else None,
-                c.get("col_v") if c else None,
-                c.get("col_w") if c else None,
-                c.get("col_x") if c else None,
-                c.get("col_y") if c else None,
-                c.get("col_z") if c else None,
-                c.get("col_aa") if c else None,
-                c.get("col_ab") if c else None,
-            ]
-            ws.append(a_q_values + r_ab_values)
-
-        # Aplicar color a todas las celdas de columnas R..AB (incluyendo encabezados)
-        # Columnas R..AB corresponden a índices 18..28 (1-based)
-        for row in ws.iter_rows(min_row=1, max_row=ws.max_row, min_col=18, max_col=28):
-            for cell in row:
+        def styled_row(values):
+            out = list(values[:num_a_q])
+            for value in values[num_a_q:]:
+                cell = WriteOnlyCell(ws, value=value)
                 cell.fill = fill
+                out.append(cell)
+            return out
+
+        ws.append(styled_row(headers_a_q + headers_r_ab))
+
+        num_rows = 0
+        for values in chain([first], rows):
+            # Las tuplas de export empiezan con row_index e id del raw; el Excel solo lleva A..AB
+            ws.append(styled_row(values[2:]))
+            num_rows += 1
 
         output_name = f"final_{document_id}.xlsx"
         output_path = FINAL_DIR / output_name
         wb.save(output_path)
         logger.info("Excel final generado: %s", output_path)
-        return GenerateFinalResponse(document_id=document_id, file_path=str(output_path), rows=len(raws))
+        return GenerateFinalResponse(document_id=document_id, file_path=str(output_path), rows=num_rows)
     except HTTPException:
         raise
     except Exception as exc:
@@ -359,6 +614,42 @@ def generate_final_sheet(document_id: str):
         raise HTTPException(status_code=500, detail=f"Error al generar Excel final: {exc}")
 
 
+@app.get("/sheet/export_csv/{document_id}")
+def export_csv(document_id: str):
+    """
+    Exporta el documento (A..Q + R..AB) como CSV en streaming, en orden de row_index.
+    """
+    try:
+        rows = iter_export_rows(document_id)
+        first = next(rows, None)
+        if first is None:
+            raise HTTPException(status_code=404, detail="No hay datos para el document_id indicado")
+
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+            for num, values in enumerate(chain([first], rows), start=1):
+                writer.writerow(values)
+                if num % EXPORT_FETCH_SIZE == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate(0)
+            yield buffer.getvalue()
+
+        logger.info("Exportando CSV para document_id=%s", document_id)
+        return StreamingResponse(
+            generate(),
+            media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="final_{document_id}.csv"'},
+        )
+    except HTTPException:
+        raise
+    except Exception as exc:
+        logger.exception("Error al exportar CSV")
+        raise HTTPException(status_code=500, detail=f"Error al exportar CSV: {exc}")
+
+
 @app.get("/sheet/final/{document_id}")
 def download_final_sheet(document_id: str):
     """
@@ -384,3 +675,116 @@ def download_final_sheet(document_id: str):
         raise HTTPException(status_code=500, detail=f"Error al descargar archivo final: {exc}")
 
 
+@app.get("/document/{document_id}/stats", response_model=DocumentStatsResponse)
+def document_stats(document_id: str):
+    """
+    Progreso del documento en O(1): lee los contadores de document_stats, que se actualizan
+    en la misma transacción que la importación y el guardado de clasificados.
+    """
+    try:
+        stats = get_document_stats(document_id)
+        if stats is None:
+            raise HTTPException(status_code=404, detail="No hay datos para el document_id indicado")
+        total = stats["total_rows"]
+        classified = stats["classified_rows"]
+        return DocumentStatsResponse(
+            **stats,
+            pending_rows=max(total - classified, 0),
+            progress=round(classified * 100.0 / total, 2) if total else 0.0,
+        )
+    except HTTPException:
+        raise
+    except Exception as exc:
+        logger.exception("Error al obtener estadísticas del documento")
+        raise HTTPException(status_code=500, detail=f"Error al obtener estadísticas del documento: {exc}")
+
+
+@app.get("/stats", response_model=StatsResponse)
+def aggregated_stats(
+    group_by: str = Query("calificacion", description="Dimensiones separadas por coma: calificacion, modalidad, jurisdiccion, mes"),
+    document_id: Optional[List[str]] = Query(None, description="Documentos a incluir (repetible); sin valor, todos"),
+    calificacion: Optional[str] = None,
+    modalidad: Optional[str] = None,
+    jurisdiccion: Optional[str] = None,
+    mes_desde: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"),
+    mes_hasta: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"),
+):
+    """
+    Conteos de filas clasificadas agrupados por calificación, modalidad, jurisdicción y/o mes,
+    sobre uno, varios o todos los documentos. Se leen de los conteos pre-agregados que se
+    actualizan al guardar cada lote: no se recorren las tablas de incidentes.
+    """
+    dimensions = [d.strip() for d in group_by.split(",") if d.strip()]
+    unknown = [d for d in dimensions if d not in ROLLUP_DIMENSIONS]
+    if unknown or len(set(dimensions)) != len(dimensions):
+        raise HTTPException(
+            status_code=400,
+            detail=f"group_by inválido: {group_by} (dimensiones: {', '.join(ROLLUP_DIMENSIONS)})",
+        )
+    filters = {
+        name: value
+        for name, value in (("calificacion", calificacion), ("modalidad", modalidad), ("jurisdiccion", jurisdiccion))
+        if value is not None
+    }
+    try:
+        rows = rollup_counts(dimensions, document_id, filters, mes_desde, mes_hasta)
+        groups = [
+            StatsGroup(**{name: value or None for name, value in zip(dimensions, row[:-1])}, total=row[-1])
+            for row in rows
+        ]
+        return StatsResponse(
+            group_by=dimensions, document_ids=document_id, total=sum(g.total for g in groups), groups=groups
+        )
+    except Exception as exc:
+        logger.exception("Error al obtener estadísticas agregadas")
+        raise HTTPException(status_code=500, detail=f"Error al obtener estadísticas agregadas: {exc}")
+
+
+@app.get("/search", response_model=SearchResponse)
+def search(
+    q: str = Query(..., min_length=1, description="Palabras a buscar; \"entre comillas\" para una frase exacta"),
+    document_id: Optional[List[str]] = Query(None, description="Documentos a incluir (repetible); sin valor, todos"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Búsqueda de texto completo sobre las columnas A..Q (relato, calle, localidad, patentes, alias...)
+    de todos los documentos importados, ordenada por relevancia y paginada con limit / offset.
+    Usa el índice mantenido en el import: no se recorren las filas. Con truncated, solo las
+    SEARCH_RANK_WINDOW coincidencias más recientes se ordenan por relevancia; las demás siguen
+    en las páginas posteriores, de la más nueva a la más vieja (ranked=false).
+    """
+    try:
+        # Se pide una fila de más para saber si hay otra página sin contar el total
+        rows, truncated = search_incidents(q, document_id, limit + 1, offset)
+        items = [SearchHit(**dict(zip(SEARCH_COLUMNS, row))) for row in rows[:limit]]
+        return SearchResponse(
+            query=q, limit=limit, offset=offset, has_more=len(rows) > limit, truncated=truncated, items=items
+        )
+    except Exception as exc:
+        logger.exception("Error al buscar incidentes")
+        raise HTTPException(status_code=500, detail=f"Error al buscar incidentes: {exc}")
+
+
+@app.delete("/document/{document_id}")
+def delete_document(document_id: str):
+    """
+    Elimina un documento: sus filas raw y clasificadas y el Excel final generado.
+    Con POSTGRES_PARTITIONING=document se descartan sus particiones completas.
+    """
+    try:
+        drop_document(document_id)
+        if chunk_queue is not None:
+            try:
+                chunk_queue.discard(document_id)
+            except Exception as exc:
+                # Los descriptores que queden apuntan a filas que ya no existen: se confirman sin trabajo
+                logger.warning("No se pudo borrar la cola de lotes de document_id=%s: %s", document_id, exc)
+        final_path = FINAL_DIR / f"final_{document_id}.xlsx"
+        if final_path.exists():
+            final_path.unlink()
+        logger.info("Documento eliminado: %s", document_id)
+        return {"document_id": document_id, "deleted": True}
+    except Exception as exc:
+        logger.exception("Error al eliminar documento")
+        raise HTTPException(status_code=500, detail=f"Error al eliminar documento: {exc}")
@@ -1,15 +1,37 @@
+import importlib.util
+import sys
+from datetime import datetime
+from pathlib import Path
 from typing import List, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
+
+_APP_DIR = Path(__file__).resolve().parent
+# lean_schema.py copiado junto a la app (Docker) o el del servicio de clasificación en el repo
+LEAN_SCHEMA_CANDIDATES = [
+    _APP_DIR.parent / "classifier" / "lean_schema.py",
+    _APP_DIR.parents[1] / "classification_service" / "app" / "lean_schema.py",
+]
 
 
 class PrepareRequest(BaseModel):
     file_path: str = Field(..., description="Ruta absoluta del archivo Excel a procesar")
+    base_document_id: Optional[str] = Field(
+        None, description="Documento a actualizar con un import incremental en lugar de crear uno nuevo"
+    )
 
 
 class PrepareResponse(BaseModel):
     document_id: str
     rows_imported: int
+    # Re-subida de un Excel ya importado con las mismas reglas: se devuelve el documento existente
+    deduplicated: bool = False
+    classified_rows: Optional[int] = None
+    final_file_path: Optional[str] = None
+    # Import incremental (base_document_id): filas actualizadas, iguales y quitadas
+    rows_updated: Optional[int] = None
+    rows_unchanged: Optional[int] = None
+    rows_removed: Optional[int] = None
 
 
 class RawIncidentItem(BaseModel):
@@ -64,9 +86,97 @@ class SaveClassifiedChunkResponse(BaseModel):
     saved: int
 
 
+class MultiChunkResponse(BaseModel):
+    # Un lote por documento leído, en el orden pedido; los que no entraron en el límite no aparecen
+    documents: List[ChunkResponse]
+
+
+class SaveClassifiedChunksRequest(BaseModel):
+    documents: List[SaveClassifiedChunkRequest]
+
+
+class SaveClassifiedChunksResponse(BaseModel):
+    documents: List[SaveClassifiedChunkResponse]
+
+
+class SaveAndNextResponse(BaseModel):
+    document_id: str
+    saved: int
+    # Siguiente lote sin clasificar, leído en la misma transacción del guardado
+    items: List[RawIncidentItem]
+
+
+def _load_lean_schema():
+    """lean_schema.py del servicio de clasificación (un solo helper para ambos servicios), cargado por ruta."""
+    for path in LEAN_SCHEMA_CANDIDATES:
+        if path.exists():
+            spec = importlib.util.spec_from_file_location("sentinel_lean_schema", path)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[spec.name] = module
+            spec.loader.exec_module(module)
+            return module.lean_schema
+    raise ImportError("lean_schema.py no encontrado")
+
+
+lean_schema = _load_lean_schema()
+
+
+# Validación de los endpoints de lotes (alto volumen) sobre dicts en lugar de modelos por fila
+chunk_adapter = TypeAdapter(lean_schema(ChunkResponse))
+save_classified_adapter = TypeAdapter(lean_schema(SaveClassifiedChunkRequest))
+save_and_next_adapter = TypeAdapter(lean_schema(SaveAndNextResponse))
+multi_chunk_adapter = TypeAdapter(lean_schema(MultiChunkResponse))
+save_classified_many_adapter = TypeAdapter(lean_schema(SaveClassifiedChunksRequest))
+
+
 class GenerateFinalResponse(BaseModel):
     document_id: str
     file_path: str
     rows: int
 
 
+class DocumentStatsResponse(BaseModel):
+    document_id: str
+    total_rows: int
+    classified_rows: int
+    pending_rows: int
+    progress: float = Field(..., description="Porcentaje clasificado (0-100)")
+    last_row_index: Optional[int] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    last_classified_at: Optional[datetime] = None
+
+
+class StatsGroup(BaseModel):
+    calificacion: Optional[str] = None
+    modalidad: Optional[str] = None
+    jurisdiccion: Optional[str] = None
+    mes: Optional[str] = Field(None, description="AAAA-MM")
+    total: int
+
+
+class StatsResponse(BaseModel):
+    group_by: List[str]
+    document_ids: Optional[List[str]] = None
+    total: int
+    groups: List[StatsGroup]
+
+
+class SearchHit(BaseModel):
+    document_id: str
+    row_index: int
+    raw_incident_id: int
+    score: float = Field(..., description="Relevancia (mayor es mejor)")
+    snippet: Optional[str] = Field(None, description="Fragmento con los términos entre [ ]")
+    ranked: bool = Field(True, description="False: fuera de la ventana de ranking, ordenada por antigüedad")
+
+
+class SearchResponse(BaseModel):
+    query: str
+    limit: int
+    offset: int
+    has_more: bool
+    truncated: bool = Field(
+        False, description="Hay más coincidencias que SEARCH_RANK_WINDOW: solo las más recientes se ordenan por relevancia"
+    )
+    items: List[SearchHit]
@@ -0,0 +1,38 @@
+import hashlib
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict
+
+
+# Diccionario de reglas que usa el clasificador (montado en /app/config en docker-compose)
+RULESET_PATH = Path(os.getenv("RULESET_PATH", "./config/diccionario_policial.json"))
+# Permite fijar la versión a mano (p. ej. un tag de release) en lugar de derivarla del archivo
+RULESET_VERSION = os.getenv("RULESET_VERSION", "")
+
+
+@lru_cache(maxsize=1)
+def ruleset_version() -> str:
+    """
+    Versión del conjunto de reglas: RULESET_VERSION si está definida, si no los primeros
+    16 hex del sha256 del diccionario (se calcula una vez por proceso).
+    Cambiar el diccionario invalida las huellas de import.
+    """
+    if RULESET_VERSION:
+        return RULESET_VERSION
+    if not RULESET_PATH.exists():
+        return "sin-diccionario"
+    return hashlib.sha256(RULESET_PATH.read_bytes()).hexdigest()[:16]
+
+
+def load_dictionary() -> Dict[str, Any]:
+    """Contenido de diccionario_policial.json ({} si no está montado)."""
+    if not RULESET_PATH.exists():
+        return {}
+    return json.loads(RULESET_PATH.read_text(encoding="utf-8"))
+
+
+def import_fingerprint(file_sha256: str, version: str) -> str:
+    """Huella de un import: mismo archivo con las mismas reglas produce la misma clasificación."""
+    return hashlib.sha256(f"{file_sha256}:{version}".encode("utf-8")).hexdigest()
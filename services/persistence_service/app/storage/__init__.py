@@ -0,0 +1,77 @@
+"""
+Backends de almacenamiento de la persistencia.
+El motor se elige con STORAGE_BACKEND (o se deduce de DATABASE_URL / SQLITE_SHARDING) y su
+módulo se importa recién al seleccionarlo: en modo SQLite no se carga psycopg2.
+"""
+import importlib
+import os
+import threading
+from typing import Dict, Optional
+
+from .base import (
+    CLASSIFIED_COLUMNS,
+    DATABASE_URL,
+    EXPORT_COLUMNS,
+    EXPORT_FETCH_SIZE,
+    RAW_COLUMNS,
+    ROLLUP_DIMENSIONS,
+    SEARCH_COLUMNS,
+    StorageBackend,
+)
+
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "").lower()
+SQLITE_SHARDING = os.getenv("SQLITE_SHARDING", "false").lower() == "true"
+
+# nombre -> "módulo:Clase", relativo a este paquete
+_BACKENDS: Dict[str, str] = {
+    "postgres": ".postgres:PostgresBackend",
+    "sqlite": ".sqlite:SQLiteBackend",
+    "sqlite_sharded": ".sharded:ShardedSQLiteBackend",
+}
+
+_backend: Optional[StorageBackend] = None
+_backend_lock = threading.Lock()
+
+
+def register_backend(name: str, target: str) -> None:
+    """Registra un motor adicional como "paquete.modulo:Clase" (se importa solo si se elige)."""
+    _BACKENDS[name.lower()] = target
+
+
+def backend_name() -> str:
+    if STORAGE_BACKEND:
+        return STORAGE_BACKEND
+    if DATABASE_URL.startswith("postgres://") or DATABASE_URL.startswith("postgresql://"):
+        return "postgres"
+    if SQLITE_SHARDING:
+        return "sqlite_sharded"
+    return "sqlite"
+
+
+def get_backend() -> StorageBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = backend_name()
+                if name not in _BACKENDS:
+                    raise ValueError(f"STORAGE_BACKEND desconocido: {name} (disponibles: {', '.join(sorted(_BACKENDS))})")
+                module_name, class_name = _BACKENDS[name].split(":")
+                module = importlib.import_module(module_name, package=__name__)
+                _backend = getattr(module, class_name)()
+    return _backend
+
+
+__all__ = [
+    "CLASSIFIED_COLUMNS",
+    "EXPORT_COLUMNS",
+    "EXPORT_FETCH_SIZE",
+    "RAW_COLUMNS",
+    "ROLLUP_DIMENSIONS",
+    "SEARCH_COLUMNS",
+    "StorageBackend",
+    "backend_name",
+    "get_backend",
+    "register_backend",
+]
@@ -0,0 +1,770 @@
+import hashlib
+import logging
+import os
+import re
+from abc import ABC, abstractmethod
+from collections import Counter
+from contextlib import contextmanager
+from itertools import islice
+from typing import Any, ContextManager, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .codes import CategoryCodes
+
+
+logger = logging.getLogger("persistence_service")
+
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./persistence.db")
+
+# Pool de conexiones (en SQLite: una conexión persistente por hilo)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = float(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = float(os.getenv("DB_POOL_PRE_PING", "30"))
+
+# Filas traídas por viaje al recorrer un documento completo (export)
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "2000"))
+
+# Filas por sentencia al importar un Excel (toda la importación va en una sola transacción)
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+
+# /search ordena por relevancia solo las N coincidencias más recientes: rankear todas las filas que
+# contienen un término frecuente cuesta segundos con millones de filas. Las más viejas siguen después,
+# por id descendente (sin rankear), y la respuesta lo indica con truncated
+SEARCH_RANK_WINDOW = int(os.getenv("SEARCH_RANK_WINDOW", "20000"))
+
+RAW_COLUMNS = [
+    "col_a", "col_b", "col_c", "col_d", "col_e", "col_f", "col_g", "col_h", "col_i",
+    "col_j", "col_k", "col_l", "col_m", "col_n", "col_o", "col_p", "col_q",
+]
+CLASSIFIED_COLUMNS = [
+    "col_r", "col_s", "col_t", "col_u", "col_v", "col_w", "col_x", "col_y", "col_z", "col_aa", "col_ab",
+]
+# Orden de los valores en las tuplas devueltas por iter_export_rows
+EXPORT_COLUMNS = ["row_index", "raw_incident_id"] + RAW_COLUMNS + CLASSIFIED_COLUMNS
+# Calificación (col_s) y modalidad (col_t) se guardan como códigos de category_codes
+CODE_COLUMNS = ["col_s_code", "col_t_code"]
+# El SELECT del export trae además los códigos; decode_export_row los vuelve a texto
+EXPORT_SELECT = ", ".join(
+    ["r.row_index", "r.id"]
+    + [f"r.{c}" for c in RAW_COLUMNS]
+    + [f"c.{c}" for c in CLASSIFIED_COLUMNS]
+    + [f"c.{c}" for c in CODE_COLUMNS]
+)
+# Columnas de un lote sin clasificar (sin row_hash ni el vector de búsqueda de Postgres)
+CHUNK_SELECT = ", ".join(f"r.{c}" for c in ["id", "document_id", "row_index", "source_path"] + RAW_COLUMNS)
+RAW_INSERT_FIELDS = ["document_id", "row_index", "source_path"] + RAW_COLUMNS + ["row_hash"]
+RAW_INSERT_COLUMNS = ", ".join(RAW_INSERT_FIELDS)
+CLASSIFIED_INSERT_FIELDS = ["document_id", "raw_incident_id"] + CLASSIFIED_COLUMNS + CODE_COLUMNS
+CLASSIFIED_INSERT_COLUMNS = ", ".join(CLASSIFIED_INSERT_FIELDS)
+CATEGORY_CODE_COLUMNS = ["code", "kind", "parent", "value", "base_legal"]
+# Orden de los valores en las tuplas devueltas por search
+SEARCH_COLUMNS = ["document_id", "row_index", "raw_incident_id", "score", "snippet", "ranked"]
+# Dimensiones de classified_rollups, los conteos pre-agregados que responde /stats
+ROLLUP_DIMENSIONS = ["calificacion", "modalidad", "jurisdiccion", "mes"]
+# Orden de los valores al leer document_stats
+DOCUMENT_STATS_COLUMNS = [
+    "document_id", "total_rows", "classified_rows", "last_row_index", "created_at", "updated_at", "last_classified_at",
+]
+
+BatchResult = Tuple[Optional[int], Optional[Exception]]
+# (row_index, source_path, valores A..Q)
+RawRow = Tuple[int, Optional[str], List[Optional[str]]]
+
+
+def ping(conn) -> None:
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT 1")
+        cur.fetchone()
+    finally:
+        cur.close()
+    # En psycopg2 el SELECT abre una transacción; se cierra para no dejarla colgada
+    conn.rollback()
+
+
+@contextmanager
+def pooled_connection(pool) -> Iterator[Any]:
+    """
+    Toma una conexión del pool y la devuelve al terminar.
+    Hace COMMIT si el bloque termina bien y ROLLBACK en cualquier otro caso
+    (incluido un generador que se cierra a mitad de la lectura).
+    """
+    conn = pool.acquire()
+    committed = False
+    discard = False
+    try:
+        yield conn
+        conn.commit()
+        committed = True
+    finally:
+        if not committed:
+            try:
+                conn.rollback()
+            except Exception:
+                # La conexión quedó inutilizable: no vuelve al pool
+                discard = True
+        pool.release(conn, discard=discard)
+
+
+def execute(conn, sql: str) -> None:
+    cur = conn.cursor()
+    try:
+        cur.execute(sql)
+    finally:
+        cur.close()
+
+
+def row_hash(values_a_q: List[Optional[str]]) -> str:
+    """Huella del contenido A..Q de una fila (distingue None de cadena vacía)."""
+    joined = "\x1f".join("\x00" if v is None else v for v in values_a_q)
+    return hashlib.sha1(joined.encode("utf-8")).hexdigest()
+
+
+def raw_params(document_id: str, rows: List["RawRow"]) -> List[Tuple]:
+    return [
+        (document_id, row_index, source_path) + tuple(values_a_q) + (row_hash(values_a_q),)
+        for row_index, source_path, values_a_q in rows
+    ]
+
+
+_COL_S = CLASSIFIED_COLUMNS.index("col_s")
+_COL_T = CLASSIFIED_COLUMNS.index("col_t")
+_EXPORT_COL_S = EXPORT_COLUMNS.index("col_s")
+_EXPORT_COL_T = EXPORT_COLUMNS.index("col_t")
+
+
+def classified_params(document_id: str, items: List[Dict], codes: CategoryCodes) -> List[Tuple]:
+    """
+    Valores de INSERT de R..AB más los códigos de calificación y modalidad.
+    Un texto que está en el diccionario se guarda solo como código (su columna TEXT queda NULL);
+    un texto libre desconocido se guarda tal cual y sin código.
+    """
+    params = []
+    for it in items:
+        values = [it.get(c) for c in CLASSIFIED_COLUMNS]
+        s_code, t_code = codes.encode(values[_COL_S], values[_COL_T])
+        if s_code is not None:
+            values[_COL_S] = None
+        if t_code is not None:
+            values[_COL_T] = None
+        params.append((document_id, it["raw_incident_id"]) + tuple(values) + (s_code, t_code))
+    return params
+
+
+def decode_export_row(row: Tuple, codes: CategoryCodes) -> Tuple:
+    """Fila de EXPORT_SELECT -> tupla con el orden de EXPORT_COLUMNS, con los códigos vueltos a texto."""
+    s_code, t_code = row[-2], row[-1]
+    if s_code is None and t_code is None:
+        return tuple(row[:-2])
+    values = list(row[:-2])
+    if s_code is not None:
+        values[_EXPORT_COL_S] = codes.decode(s_code)
+    if t_code is not None:
+        values[_EXPORT_COL_T] = codes.decode(t_code)
+    return tuple(values)
+
+
+_ISO_DATE = re.compile(r"^(\d{4})-(\d{2})")
+_DMY_DATE = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4})")
+
+
+def incident_month(*values: Optional[str]) -> str:
+    """
+    Mes "AAAA-MM" del primer valor con fecha reconocible (el import guarda str(datetime) o
+    el texto de la celda); "" si ninguno la tiene.
+    """
+    for value in values:
+        if not value:
+            continue
+        match = _ISO_DATE.match(value)
+        if match:
+            return f"{match.group(1)}-{match.group(2)}"
+        match = _DMY_DATE.match(value)
+        if match:
+            return f"{match.group(3)}-{int(match.group(2)):02d}"
+    return ""
+
+
+def rollup_key(calificacion: Optional[str], modalidad: Optional[str], jurisdiccion: Optional[str], mes: str) -> Tuple:
+    # Mismo orden que ROLLUP_DIMENSIONS; "" en lugar de NULL para que formen parte de la clave
+    return (calificacion or "", modalidad or "", jurisdiccion or "", mes)
+
+
+class StorageBackend(ABC):
+    """
+    Contrato de almacenamiento de la persistencia: importar filas A..Q, reclamar lotes sin
+    clasificar, guardar R..AB y recorrer el documento para exportarlo.
+    Los endpoints solo hablan con esta interfaz (vía app.database); cada motor implementa
+    su SQL y su manejo de conexiones en su propio módulo.
+    """
+
+    name = "base"
+    # Marcador de parámetros del driver (DB-API): "?" en sqlite3, "%s" en psycopg2
+    placeholder = "?"
+    # category_codes en memoria; se carga al sincronizar o en el primer uso
+    _codes: Optional[CategoryCodes] = None
+
+    # -- Ciclo de vida ----------------------------------------------------------------------
+
+    @abstractmethod
+    def init_schema(self) -> None:
+        """Crea tablas e índices si no existen."""
+
+    def start_maintenance(self) -> None:
+        """Tareas periódicas del motor (por defecto ninguna)."""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Métricas de conexiones para /health/db."""
+
+    @abstractmethod
+    def connection(self, document_id: Optional[str] = None, create: bool = False) -> ContextManager[Any]:
+        """Conexión transaccional: COMMIT al salir bien del bloque, ROLLBACK en otro caso."""
+
+    def _catalog_connection(self) -> ContextManager[Any]:
+        # Conexión para tablas globales (huellas, códigos); salvo en shards es la misma base
+        return self.connection()
+
+    # -- Documentos -------------------------------------------------------------------------
+
+    def prepare_document(self, document_id: str) -> None:
+        """Prepara el almacenamiento de un documento antes de importarlo (por defecto nada)."""
+
+    def document_exists(self, document_id: str) -> bool:
+        # Solo los motores que crean almacenamiento por documento necesitan saberlo antes de conectar
+        return True
+
+    @abstractmethod
+    def drop_document(self, document_id: str) -> None:
+        """Elimina todas las filas de un documento."""
+
+    # -- Deduplicación de imports -----------------------------------------------------------
+
+    @abstractmethod
+    def find_fingerprint(self, fingerprint: str) -> Optional[str]:
+        """document_id ya importado con esa huella de contenido (archivo + versión de reglas), o None."""
+
+    @abstractmethod
+    def record_fingerprint(self, fingerprint: str, document_id: str, file_sha256: str, ruleset_version: str) -> None:
+        """Asocia la huella al documento; si ya existía (import forzado) apunta al más reciente."""
+
+    @abstractmethod
+    def forget_fingerprints(self, document_id: str) -> None:
+        """Quita las huellas del documento (su contenido cambió o se eliminó)."""
+
+    # -- Códigos de categorías --------------------------------------------------------------
+
+    def sync_category_codes(self, entries: Iterable[Tuple[str, str, str, Optional[str]]], ruleset_version: str) -> int:
+        """
+        Da de alta en category_codes las calificaciones y modalidades (kind, parent, value, base_legal)
+        del diccionario y marca con ruleset_version las que siguen vigentes. Los códigos nunca se
+        reasignan: lo clasificado con un diccionario anterior se sigue decodificando igual.
+        Devuelve los códigos nuevos.
+        """
+        p = self.placeholder
+        entries = {(kind, parent, value): base_legal for kind, parent, value, base_legal in entries}
+        with self._catalog_connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT kind, parent, value, base_legal, ruleset_version FROM category_codes")
+                existing = {
+                    (kind, parent, value): (base_legal, version)
+                    for kind, parent, value, base_legal, version in cur.fetchall()
+                }
+                new = [key + (base_legal, ruleset_version) for key, base_legal in entries.items() if key not in existing]
+                changed = [
+                    (base_legal, ruleset_version) + key
+                    for key, base_legal in entries.items()
+                    if key in existing and existing[key] != (base_legal, ruleset_version)
+                ]
+                if new:
+                    # DO NOTHING: otro proceso pudo darlas de alta al mismo tiempo
+                    cur.executemany(
+                        f"INSERT INTO category_codes (kind, parent, value, base_legal, ruleset_version) "
+                        f"VALUES ({p}, {p}, {p}, {p}, {p}) ON CONFLICT (kind, parent, value) DO NOTHING",
+                        new,
+                    )
+                if changed:
+                    cur.executemany(
+                        f"UPDATE category_codes SET base_legal={p}, ruleset_version={p} "
+                        f"WHERE kind={p} AND parent={p} AND value={p}",
+                        changed,
+                    )
+                cur.execute(f"SELECT {', '.join(CATEGORY_CODE_COLUMNS)} FROM category_codes")
+                self._codes = CategoryCodes(cur.fetchall())
+            finally:
+                cur.close()
+        if new:
+            logger.info("category_codes: %d códigos nuevos (diccionario %s)", len(new), ruleset_version)
+        return len(new)
+
+    def category_codes(self) -> CategoryCodes:
+        if self._codes is None:
+            with self._catalog_connection() as conn:
+                cur = conn.cursor()
+                try:
+                    cur.execute(f"SELECT {', '.join(CATEGORY_CODE_COLUMNS)} FROM category_codes")
+                    self._codes = CategoryCodes(cur.fetchall())
+                finally:
+                    cur.close()
+        return self._codes
+
+    # -- Import y lotes ---------------------------------------------------------------------
+
+    @abstractmethod
+    def _insert_raw(self, conn, document_id: str, rows: List[RawRow]) -> int:
+        """INSERT multi-fila de filas A..Q (idempotente por document_id + row_index); devuelve las insertadas."""
+
+    def insert_raw_incidents(self, document_id: str, rows: Iterable[RawRow]) -> int:
+        """
+        Importa las filas de un documento en UNA transacción, de a IMPORT_BATCH_SIZE por sentencia,
+        y actualiza document_stats en esa misma transacción. Devuelve las filas insertadas.
+        """
+        rows = iter(rows)
+        inserted = 0
+        last_row_index = None
+        with self.connection(document_id, create=True) as conn:
+            while True:
+                batch = list(islice(rows, IMPORT_BATCH_SIZE))
+                if not batch:
+                    break
+                inserted += self._insert_raw(conn, document_id, batch)
+                batch_last = max(row[0] for row in batch)
+                last_row_index = batch_last if last_row_index is None else max(last_row_index, batch_last)
+            # Se registra aunque el Excel no tenga filas: el documento existe con total 0
+            self._record_imported(conn, document_id, inserted, last_row_index)
+        return inserted
+
+    def insert_raw_incident(
+        self, document_id: str, row_index: int, source_path: Optional[str], values_a_q: List[Optional[str]]
+    ) -> None:
+        """Inserta una fila A..Q (idempotente por document_id + row_index)."""
+        self.insert_raw_incidents(document_id, [(row_index, source_path, values_a_q)])
+
+    def apply_delta(self, document_id: str, rows: Iterable[RawRow]) -> Optional[Dict[str, int]]:
+        """
+        Import incremental sobre un documento existente, comparando por row_index y row_hash:
+        - filas nuevas: se insertan;
+        - filas con contenido distinto: se actualizan y se borra su clasificación (vuelven a lotes);
+        - filas iguales: no se tocan y conservan su clasificación;
+        - filas que ya no están en la hoja: se eliminan.
+        Todo en una transacción, con document_stats ajustado. None si el documento no existe.
+        """
+        if self.get_document_stats(document_id) is None:
+            return None
+        p = self.placeholder
+        with self.connection(document_id) as conn:
+            cur = conn.cursor()
+            try:
+                existing = self._row_hashes(cur, document_id)
+                new_rows: List[RawRow] = []
+                changed: List[Tuple[int, RawRow]] = []
+                seen = set()
+                last_row_index = None
+                for row in rows:
+                    row_index, _, values_a_q = row
+                    seen.add(row_index)
+                    last_row_index = row_index if last_row_index is None else max(last_row_index, row_index)
+                    current = existing.get(row_index)
+                    if current is None:
+                        new_rows.append(row)
+                    elif current[1] != row_hash(values_a_q):
+                        changed.append((current[0], row))
+                removed = [raw_id for row_index, (raw_id, _) in existing.items() if row_index not in seen]
+
+                # Filas modificadas o quitadas pierden su clasificación (y su aporte a los conteos)
+                self._ensure_rollups(cur, document_id)
+                declassified_ids = [raw_id for raw_id, _ in changed] + removed
+                removed_counts = self._stored_rollup_counts(cur, document_id, declassified_ids)
+                self._add_rollups(cur, document_id, Counter({key: -total for key, total in removed_counts.items()}))
+                declassified = self._delete_by_ids(
+                    cur, "classified_incidents", "raw_incident_id", document_id, declassified_ids
+                )
+                self._delete_by_ids(cur, "raw_incidents", "id", document_id, removed)
+                if changed:
+                    assignments = ", ".join(f"{c}={p}" for c in ["source_path"] + RAW_COLUMNS + ["row_hash"])
+                    cur.executemany(
+                        f"UPDATE raw_incidents SET {assignments} WHERE document_id={p} AND id={p}",
+                        [
+                            (source_path,) + tuple(values_a_q) + (row_hash(values_a_q), document_id, raw_id)
+                            for raw_id, (_, source_path, values_a_q) in changed
+                        ],
+                    )
+                inserted = 0
+                for start in range(0, len(new_rows), IMPORT_BATCH_SIZE):
+                    inserted += self._insert_raw(conn, document_id, new_rows[start : start + IMPORT_BATCH_SIZE])
+                cur.execute(
+                    f"UPDATE document_stats SET total_rows = total_rows + {p}, classified_rows = classified_rows - {p}, "
+                    f"last_row_index = {p}, updated_at = CURRENT_TIMESTAMP WHERE document_id={p}",
+                    (inserted - len(removed), declassified, last_row_index, document_id),
+                )
+            finally:
+                cur.close()
+        return {
+            "inserted": inserted,
+            "updated": len(changed),
+            "removed": len(removed),
+            "unchanged": len(seen) - len(new_rows) - len(changed),
+            "declassified": declassified,
+        }
+
+    def _row_hashes(self, cur, document_id: str) -> Dict[int, Tuple[int, str]]:
+        """row_index -> (id, row_hash) del documento; calcula y guarda los que falten."""
+        p = self.placeholder
+        cur.execute(f"SELECT row_index, id, row_hash FROM raw_incidents WHERE document_id={p}", (document_id,))
+        hashes = {row_index: (raw_id, value) for row_index, raw_id, value in cur.fetchall()}
+        if any(value is None for _, value in hashes.values()):
+            # Filas importadas antes de existir row_hash: se calcula una vez desde sus valores
+            cur.execute(
+                f"SELECT row_index, id, {', '.join(RAW_COLUMNS)} FROM raw_incidents "
+                f"WHERE document_id={p} AND row_hash IS NULL",
+                (document_id,),
+            )
+            updates = []
+            for row in cur.fetchall():
+                value = row_hash(list(row[2:]))
+                hashes[row[0]] = (row[1], value)
+                updates.append((value, document_id, row[1]))
+            cur.executemany(f"UPDATE raw_incidents SET row_hash={p} WHERE document_id={p} AND id={p}", updates)
+        return hashes
+
+    def _delete_by_ids(self, cur, table: str, column: str, document_id: str, ids: List[int]) -> int:
+        p = self.placeholder
+        deleted = 0
+        # De a 500 ids por sentencia (límite de variables de SQLite)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start : start + 500]
+            cur.execute(
+                f"DELETE FROM {table} WHERE document_id={p} AND {column} IN ({', '.join([p] * len(chunk))})",
+                [document_id] + chunk,
+            )
+            deleted += cur.rowcount
+        return deleted
+
+    @abstractmethod
+    def _fetch_unclassified(
+        self, conn, document_id: str, limit: int, row_range: Optional[Tuple[int, int]] = None
+    ) -> List[Dict]:
+        """Primeras `limit` filas del documento sin clasificar (dentro de row_range si se indica), en orden de row_index."""
+
+    def fetch_unclassified_chunk(
+        self, document_id: str, limit: int, row_range: Optional[Tuple[int, int]] = None
+    ) -> List[Dict]:
+        if not self.document_exists(document_id):
+            return []
+        with self.connection(document_id) as conn:
+            return self._fetch_unclassified(conn, document_id, limit, row_range)
+
+    def fetch_unclassified_chunks(self, document_ids: List[str], limit: int) -> List[Tuple[str, List[Dict]]]:
+        """
+        Hasta `limit` filas sin clasificar en total de varios documentos, en el orden recibido:
+        (document_id, filas) por documento leído. Un documento con lista vacía no tiene pendientes;
+        los que no se llegaron a leer por el límite no aparecen.
+        """
+        chunks: List[Tuple[str, List[Dict]]] = []
+        remaining = limit
+        for document_id in document_ids:
+            if remaining <= 0:
+                break
+            rows = self.fetch_unclassified_chunk(document_id, remaining)
+            chunks.append((document_id, rows))
+            remaining -= len(rows)
+        return chunks
+
+    def unclassified_row_ranges(self, document_id: str, size: int) -> List[Tuple[int, int, int]]:
+        """
+        Rangos (row_from, row_to, filas) de row_index con hasta `size` filas sin clasificar cada uno,
+        que cubren todo el documento: los descriptores de la cola de lotes. Solo lee row_index.
+        """
+        if not self.document_exists(document_id):
+            return []
+        p = self.placeholder
+        with self.connection(document_id) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                    f"SELECT r.row_index FROM raw_incidents r WHERE r.document_id={p} AND NOT EXISTS "
+                    "(SELECT 1 FROM classified_incidents c WHERE c.document_id=r.document_id AND c.raw_incident_id=r.id) "
+                    "ORDER BY r.row_index",
+                    (document_id,),
+                )
+                indexes = [row[0] for row in cur.fetchall()]
+            finally:
+                cur.close()
+        chunks = (indexes[start:start + size] for start in range(0, len(indexes), size))
+        return [(chunk[0], chunk[-1], len(chunk)) for chunk in chunks]
+
+    # -- Progreso ---------------------------------------------------------------------------
+
+    @abstractmethod
+    def _record_imported(self, conn, document_id: str, inserted: int, last_row_index: Optional[int]) -> None:
+        """Suma filas importadas a document_stats (crea la fila del documento si no existe)."""
+
+    @abstractmethod
+    def _record_classified(self, conn, document_id: str, saved: int) -> None:
+        """Suma filas clasificadas a document_stats."""
+
+    @abstractmethod
+    def get_document_stats(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Contadores del documento en O(1) (total, clasificadas, último row_index, fechas) o None
+        si no existe. Los documentos importados antes de document_stats se cuentan una única vez.
+        """
+
+    # -- Guardado ---------------------------------------------------------------------------
+
+    @abstractmethod
+    def _insert_classified(self, conn, document_id: str, items: List[Dict]) -> List[int]:
+        """INSERT de un lote sobre una conexión ya abierta; devuelve los raw_incident_id insertados."""
+
+    def _save_classified(self, conn, document_id: str, items: List[Dict]) -> int:
+        # Contadores, conteos agregados y filas en la misma transacción (o SAVEPOINT): nunca se desfasan
+        cur = conn.cursor()
+        try:
+            self._ensure_rollups(cur, document_id)
+            inserted = self._insert_classified(conn, document_id, items)
+            if inserted:
+                self._record_classified(conn, document_id, len(inserted))
+                self._record_rollups(cur, document_id, items, inserted)
+        finally:
+            cur.close()
+        return len(inserted)
+
+    def _begin(self, conn) -> None:
+        """Abre la transacción explícitamente si el driver no lo hace solo."""
+
+    def insert_classified_items(self, document_id: str, items: List[Dict]) -> int:
+        """
+        Inserta items clasificados en una transacción atómica con una sola sentencia por lote.
+        Si falla el INSERT, se hace ROLLBACK de todo el lote.
+        Devuelve la cantidad exacta de filas insertadas (las ya clasificadas se ignoran).
+        """
+        if not items:
+            return 0
+
+        try:
+            with self.connection(document_id) as conn:
+                return self._save_classified(conn, document_id, items)
+        except Exception as e:
+            raise Exception(f"Error en transacción atómica: {str(e)}. Se hizo ROLLBACK de {len(items)} items.")
+
+    def save_and_fetch_next(self, document_id: str, items: List[Dict], limit: int) -> Tuple[int, List[Dict]]:
+        """
+        Guarda un lote clasificado y lee el siguiente lote sin clasificar en la misma transacción:
+        un solo viaje y un solo COMMIT por lote. Con limit=0 solo guarda. Devuelve (guardados, filas).
+        """
+        try:
+            with self.connection(document_id) as conn:
+                saved = self._save_classified(conn, document_id, items) if items else 0
+                return saved, self._fetch_unclassified(conn, document_id, limit) if limit else []
+        except Exception as e:
+            raise Exception(f"Error en transacción atómica: {str(e)}. Se hizo ROLLBACK de {len(items)} items.")
+
+    def insert_classified_group(self, batches: List[Tuple[str, List[Dict]]]) -> List[BatchResult]:
+        """
+        Group commit: guarda varios lotes (document_id, items) en UNA transacción y un solo COMMIT.
+        Cada lote va dentro de su propio SAVEPOINT, así un lote inválido se revierte sin afectar al resto
+        y se conserva la atomicidad por lote. Devuelve, por lote y en el mismo orden, (guardados, error).
+        Si falla el COMMIT, todos los lotes reciben el error.
+        """
+        return self._insert_classified_group_on(None, batches)
+
+    def _insert_classified_group_on(
+        self, document_id: Optional[str], batches: List[Tuple[str, List[Dict]]]
+    ) -> List[BatchResult]:
+        results: List[BatchResult] = []
+        try:
+            with self.connection(document_id) as conn:
+                self._begin(conn)
+                for num, (batch_document_id, items) in enumerate(batches):
+                    if not items:
+                        results.append((0, None))
+                        continue
+                    savepoint = f"lote_{num}"
+                    execute(conn, f"SAVEPOINT {savepoint}")
+                    try:
+                        saved = self._save_classified(conn, batch_document_id, items)
+                        execute(conn, f"RELEASE SAVEPOINT {savepoint}")
+                        results.append((saved, None))
+                    except Exception as e:
+                        execute(conn, f"ROLLBACK TO SAVEPOINT {savepoint}")
+                        execute(conn, f"RELEASE SAVEPOINT {savepoint}")
+                        results.append((
+                            None,
+                            Exception(f"Error en transacción atómica: {str(e)}. Se hizo ROLLBACK de {len(items)} items."),
+                        ))
+        except Exception as e:
+            error = Exception(f"Error en transacción atómica: {str(e)}. Se hizo ROLLBACK de {len(batches)} lotes.")
+            return [(None, error) for _ in batches]
+        return results
+
+    # -- Conteos pre-agregados --------------------------------------------------------------
+
+    def _record_rollups(self, cur, document_id: str, items: List[Dict], inserted: List[int]) -> None:
+        """Suma a classified_rollups los items recién insertados, agrupados por ROLLUP_DIMENSIONS."""
+        by_id = {}
+        for it in items:
+            by_id.setdefault(it["raw_incident_id"], it)
+        months = self._raw_months(cur, document_id, inserted)
+        counts = Counter(
+            rollup_key(by_id[raw_id].get("col_s"), by_id[raw_id].get("col_t"), by_id[raw_id].get("col_r"), months.get(raw_id, ""))
+            for raw_id in inserted
+        )
+        self._add_rollups(cur, document_id, counts)
+
+    def _raw_months(self, cur, document_id: str, raw_ids: List[int]) -> Dict[int, str]:
+        # Mes del hecho: fecha de inicio (G) o, si falta, fecha de carga (D)
+        p = self.placeholder
+        months: Dict[int, str] = {}
+        for start in range(0, len(raw_ids), 500):
+            chunk = raw_ids[start : start + 500]
+            cur.execute(
+                f"SELECT id, col_g, col_d FROM raw_incidents WHERE document_id={p} AND id IN ({', '.join([p] * len(chunk))})",
+                [document_id] + chunk,
+            )
+            for raw_id, col_g, col_d in cur.fetchall():
+                months[raw_id] = incident_month(col_g, col_d)
+        return months
+
+    def _stored_rollup_counts(self, cur, document_id: str, raw_ids: Optional[List[int]] = None) -> Counter:
+        """Conteos de las filas ya guardadas (todo el documento si raw_ids es None), decodificando los códigos."""
+        p = self.placeholder
+        codes = self.category_codes()
+        sql = (
+            "SELECT c.col_s, c.col_t, c.col_s_code, c.col_t_code, c.col_r, r.col_g, r.col_d "
+            "FROM classified_incidents c JOIN raw_incidents r ON r.document_id = c.document_id AND r.id = c.raw_incident_id "
+            f"WHERE c.document_id={p}"
+        )
+        if raw_ids is None:
+            batches = [([document_id], sql)]
+        else:
+            batches = [
+                (
+                    [document_id] + raw_ids[start : start + 500],
+                    f"{sql} AND c.raw_incident_id IN ({', '.join([p] * len(raw_ids[start : start + 500]))})",
+                )
+                for start in range(0, len(raw_ids), 500)
+            ]
+        counts: Counter = Counter()
+        for params, query in batches:
+            cur.execute(query, params)
+            for col_s, col_t, s_code, t_code, col_r, col_g, col_d in cur.fetchall():
+                calificacion = codes.decode(s_code) if s_code is not None else col_s
+                modalidad = codes.decode(t_code) if t_code is not None else col_t
+                counts[rollup_key(calificacion, modalidad, col_r, incident_month(col_g, col_d))] += 1
+        return counts
+
+    def _add_rollups(self, cur, document_id: str, counts: Counter) -> None:
+        """Upsert de los conteos (negativos para restar); las combinaciones que llegan a 0 se borran."""
+        rows = [(document_id,) + key + (total,) for key, total in counts.items() if total]
+        if not rows:
+            return
+        p = self.placeholder
+        dimensions = ", ".join(ROLLUP_DIMENSIONS)
+        cur.executemany(
+            f"INSERT INTO classified_rollups (document_id, {dimensions}, total) "
+            f"VALUES ({', '.join([p] * len(rows[0]))}) ON CONFLICT (document_id, {dimensions}) "
+            "DO UPDATE SET total = classified_rollups.total + excluded.total",
+            rows,
+        )
+        if any(total < 0 for *_, total in rows):
+            cur.execute(f"DELETE FROM classified_rollups WHERE document_id={p} AND total <= 0", (document_id,))
+
+    def _ensure_rollups(self, cur, document_id: str) -> None:
+        """
+        Documentos clasificados antes de classified_rollups: sus conteos se calculan una única vez
+        desde las filas guardadas, antes de que un guardado nuevo empiece a sumar sobre ellos.
+        """
+        p = self.placeholder
+        cur.execute(f"SELECT 1 FROM classified_rollups WHERE document_id={p} LIMIT 1", (document_id,))
+        if cur.fetchone() is not None:
+            return
+        cur.execute(f"SELECT 1 FROM classified_incidents WHERE document_id={p} LIMIT 1", (document_id,))
+        if cur.fetchone() is None:
+            return
+        self._add_rollups(cur, document_id, self._stored_rollup_counts(cur, document_id))
+
+    def _query_rollups(
+        self, cur, group_by: List[str], document_ids: Optional[List[str]], filters: Dict[str, str],
+        mes_desde: Optional[str], mes_hasta: Optional[str],
+    ) -> List[Tuple]:
+        p = self.placeholder
+        where, params = [], []
+        if document_ids:
+            where.append(f"document_id IN ({', '.join([p] * len(document_ids))})")
+            params += document_ids
+        for dimension, value in filters.items():
+            where.append(f"{dimension}={p}")
+            params.append(value)
+        if mes_desde:
+            where.append(f"mes >= {p}")
+            params.append(mes_desde)
+        if mes_hasta:
+            where.append(f"mes <= {p}")
+            params.append(mes_hasta)
+        columns = ", ".join(group_by)
+        sql = f"SELECT {columns + ', ' if group_by else ''}SUM(total) FROM classified_rollups"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if group_by:
+            sql += f" GROUP BY {columns}"
+        cur.execute(sql, params)
+        return [tuple(row[:-1]) + (int(row[-1]),) for row in cur.fetchall() if row[-1] is not None]
+
+    def rollup_counts(
+        self,
+        group_by: List[str],
+        document_ids: Optional[List[str]] = None,
+        filters: Optional[Dict[str, str]] = None,
+        mes_desde: Optional[str] = None,
+        mes_hasta: Optional[str] = None,
+    ) -> List[Tuple]:
+        """
+        Conteos de filas clasificadas agrupados por `group_by` (subconjunto de ROLLUP_DIMENSIONS),
+        de los documentos indicados o de todos. Se leen de classified_rollups: nunca se recorren
+        las tablas de incidentes. Cada tupla es (valores de group_by..., total), de mayor a menor.
+        """
+        with self.connection() as conn:
+            cur = conn.cursor()
+            try:
+                if document_ids is None:
+                    # Todos los documentos: los pendientes de backfill salen de document_stats (tabla chica)
+                    cur.execute(
+                        "SELECT s.document_id FROM document_stats s WHERE s.classified_rows > 0 AND NOT EXISTS "
+                        "(SELECT 1 FROM classified_rollups r WHERE r.document_id = s.document_id)"
+                    )
+                    pending = [row[0] for row in cur.fetchall()]
+                else:
+                    pending = document_ids
+                for document_id in pending:
+                    self._ensure_rollups(cur, document_id)
+                rows = self._query_rollups(cur, group_by, document_ids, filters or {}, mes_desde, mes_hasta)
+            finally:
+                cur.close()
+        return sorted(rows, key=lambda row: (-row[-1], row[:-1]))
+
+    # -- Búsqueda ---------------------------------------------------------------------------
+
+    @abstractmethod
+    def search(
+        self, query: str, document_ids: Optional[List[str]] = None, limit: int = 20, offset: int = 0
+    ) -> Tuple[List[Tuple], bool]:
+        """
+        Filas cuyo texto A..Q contiene todos los términos de `query` (entre comillas, frase exacta),
+        usando el índice de texto completo del motor: (filas, truncated). Cada tupla sigue
+        SEARCH_COLUMNS; las SEARCH_RANK_WINDOW coincidencias más recientes van primero por relevancia
+        (score mayor primero, ranked=True) y, si hay más (truncated), siguen las demás por id descendente.
+        """
+
+    # -- Export -----------------------------------------------------------------------------
+
+    @abstractmethod
+    def iter_export_rows(self, document_id: str, fetch_size: int = EXPORT_FETCH_SIZE) -> Iterator[Tuple]:
+        """
+        Recorre el documento en orden de row_index con un único LEFT JOIN entre raw y clasificados.
+        Cada fila es una tupla compacta con el orden de EXPORT_COLUMNS: row_index, id del raw,
+        valores A..Q y valores R..AB (None si la fila aún no está clasificada), con calificación
+        y modalidad ya decodificadas desde sus códigos.
+        """
@@ -0,0 +1,59 @@
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+
+# Tipos de entrada de category_codes
+CALIFICACION = "calificacion"
+MODALIDAD = "modalidad"
+
+# (code, kind, parent, value, base_legal); parent es la calificación de una modalidad ("" si no aplica)
+CodeRow = Tuple[int, str, str, str, Optional[str]]
+
+
+class CategoryCodes:
+    """
+    Diccionario en memoria entre los textos de calificación (col_s) / modalidad (col_t) y sus
+    códigos enteros de category_codes. Una modalidad se codifica junto con su calificación
+    porque el mismo nombre ("EN RIÑA", "ASALTO") aparece en varios delitos con distinta base legal.
+    """
+
+    def __init__(self, rows: Iterable[CodeRow]):
+        self._calificaciones: Dict[str, int] = {}
+        self._modalidades: Dict[Tuple[str, str], int] = {}
+        self._values: Dict[int, str] = {}
+        self._base_legal: Dict[int, Optional[str]] = {}
+        for code, kind, parent, value, base_legal in rows:
+            if kind == CALIFICACION:
+                self._calificaciones[value] = code
+            else:
+                self._modalidades[(parent, value)] = code
+            self._values[code] = value
+            self._base_legal[code] = base_legal
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def encode(self, calificacion: Optional[str], modalidad: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+        """Códigos de (col_s, col_t); None para los textos que no están en el diccionario."""
+        s_code = self._calificaciones.get(calificacion) if calificacion is not None else None
+        t_code = None
+        if s_code is not None and modalidad is not None:
+            t_code = self._modalidades.get((calificacion, modalidad))
+        return s_code, t_code
+
+    def decode(self, code: Optional[int]) -> Optional[str]:
+        return self._values.get(code) if code is not None else None
+
+    def base_legal(self, code: Optional[int]) -> Optional[str]:
+        return self._base_legal.get(code) if code is not None else None
+
+
+def dictionary_entries(dictionary: Dict) -> Iterator[Tuple[str, str, str, Optional[str]]]:
+    """(kind, parent, value, base_legal) de cada calificación y modalidad de diccionario_policial.json."""
+    for delito in dictionary.get("delitos", []):
+        calificacion = delito.get("calificacion")
+        if not calificacion:
+            continue
+        yield CALIFICACION, "", calificacion, delito.get("base_legal")
+        for modalidad in delito.get("modalidades", []):
+            if modalidad.get("nombre"):
+                yield MODALIDAD, calificacion, modalidad["nombre"], modalidad.get("base_legal") or delito.get("base_legal")
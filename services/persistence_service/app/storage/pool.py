@@ -0,0 +1,297 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+
+class PoolTimeoutError(Exception):
+    """No se obtuvo una conexión del pool dentro del tiempo de espera configurado."""
+
+
+class _PoolMetrics:
+    """Contadores de uso del pool: esperas de checkout y saturación."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.checkouts = 0
+        self.overflow = 0
+        self.waited_checkouts = 0
+        self.timeouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.opened = 0
+        self.recycled = 0
+        self.discarded = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+
+    def record_checkout(self, wait_seconds: float, waited: bool) -> None:
+        self.checkouts += 1
+        self.total_wait_seconds += wait_seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+        if waited:
+            self.waited_checkouts += 1
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "max_size": self.max_size,
+            "in_use": self.in_use,
+            "peak_in_use": self.peak_in_use,
+            "saturation": round(self.in_use / self.max_size, 3) if self.max_size else 0.0,
+            "checkouts": self.checkouts,
+            "waited_checkouts": self.waited_checkouts,
+            "timeouts": self.timeouts,
+            "overflow": self.overflow,
+            "avg_wait_ms": round(self.total_wait_seconds * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+            "opened": self.opened,
+            "recycled": self.recycled,
+            "discarded": self.discarded,
+        }
+
+
+class ConnectionPool:
+    """
+    Pool acotado de conexiones compartido entre hilos (Postgres).
+    Las conexiones inactivas se reutilizan en orden LIFO, se verifican con `ping` si estuvieron
+    ociosas más de `pre_ping_seconds` y se reciclan al superar `recycle_seconds` de vida.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        ping: Callable[[Any], None],
+        max_size: int = 10,
+        min_size: int = 0,
+        timeout: float = 30.0,
+        recycle_seconds: float = 1800.0,
+        pre_ping_seconds: float = 30.0,
+    ):
+        self._connect = connect
+        self._ping = ping
+        self._timeout = timeout
+        self._recycle_seconds = recycle_seconds
+        self._pre_ping_seconds = pre_ping_seconds
+        self._cond = threading.Condition()
+        # (conexión, creada_en, liberada_en)
+        self._idle: List[Tuple[Any, float, float]] = []
+        self._created_at: Dict[int, float] = {}
+        self._size = 0
+        self.metrics = _PoolMetrics(max_size)
+        for _ in range(min(min_size, max_size)):
+            conn = self._open()
+            self._idle.append((conn, self._created_at[id(conn)], time.monotonic()))
+
+    def _open(self, reserved: bool = False) -> Any:
+        # `reserved` indica que el lugar en el pool ya se contó en acquire()
+        if not reserved:
+            with self._cond:
+                self._size += 1
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created_at[id(conn)] = time.monotonic()
+            self.metrics.opened += 1
+        return conn
+
+    def _close(self, conn: Any) -> None:
+        with self._cond:
+            self._created_at.pop(id(conn), None)
+            self._size -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def acquire(self) -> Any:
+        start = time.monotonic()
+        deadline = start + self._timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, created_at, released_at = self._idle.pop()
+                    break
+                if self._size < self.metrics.max_size:
+                    # Se reserva el lugar antes de conectar para no superar max_size
+                    self._size += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.metrics.timeouts += 1
+                    raise PoolTimeoutError(
+                        f"Pool de conexiones saturado ({self.metrics.max_size}) tras {self._timeout}s de espera"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+
+        now = time.monotonic()
+        if conn is None:
+            conn = self._open(reserved=True)
+        elif now - created_at > self._recycle_seconds:
+            self._close(conn)
+            self.metrics.recycled += 1
+            conn = self._open()
+        elif now - released_at > self._pre_ping_seconds:
+            try:
+                self._ping(conn)
+            except Exception:
+                self._close(conn)
+                self.metrics.discarded += 1
+                conn = self._open()
+
+        with self._cond:
+            self.metrics.record_checkout(time.monotonic() - start, waited)
+        return conn
+
+    def release(self, conn: Any, discard: bool = False) -> None:
+        with self._cond:
+            self.metrics.in_use -= 1
+            if discard or getattr(conn, "closed", False):
+                self._close(conn)
+                self.metrics.discarded += 1
+            else:
+                self._idle.append((conn, self._created_at.get(id(conn), time.monotonic()), time.monotonic()))
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            data = self.metrics.as_dict()
+            data.update({"kind": "shared", "open": self._size, "idle": len(self._idle)})
+            return data
+
+    def close_all(self) -> None:
+        with self._cond:
+            while self._idle:
+                conn, _, _ = self._idle.pop()
+                self._close(conn)
+
+
+class ThreadLocalPool:
+    """
+    Una conexión persistente por hilo (SQLite).
+    Si la conexión del hilo ya está tomada (por ejemplo, un export en streaming todavía abierto),
+    se entrega una conexión adicional que se cierra al liberarla. Una conexión se puede liberar
+    desde otro hilo (un generador en streaming termina en otro hilo del threadpool): vuelve al
+    hilo que la tomó.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        ping: Callable[[Any], None],
+        recycle_seconds: float = 1800.0,
+        pre_ping_seconds: float = 30.0,
+    ):
+        self._connect = connect
+        self._ping = ping
+        self._recycle_seconds = recycle_seconds
+        self._pre_ping_seconds = pre_ping_seconds
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # ident del hilo -> estado de su conexión, para cerrar las de hilos terminados
+        self._states: Dict[int, Dict[str, Any]] = {}
+        # id(conexión) -> (ident, estado) de las conexiones por hilo tomadas, para liberarlas desde cualquier hilo
+        self._owners: Dict[int, Tuple[int, Dict[str, Any]]] = {}
+        self.metrics = _PoolMetrics(0)
+
+    def _open(self) -> Any:
+        conn = self._connect()
+        with self._lock:
+            self.metrics.opened += 1
+        return conn
+
+    def _prune(self) -> None:
+        alive = {t.ident for t in threading.enumerate()}
+        with self._lock:
+            dead = [ident for ident in self._states if ident not in alive]
+            states = [self._states.pop(ident) for ident in dead]
+        for state in states:
+            try:
+                if state["conn"] is not None:
+                    state["conn"].close()
+            except Exception:
+                pass
+
+    def acquire(self) -> Any:
+        start = time.monotonic()
+        state = getattr(self._local, "state", None)
+        if state is not None and state["in_use"]:
+            conn = self._open()
+            overflow = True
+        else:
+            overflow = False
+            now = time.monotonic()
+            if state is None or state["conn"] is None:
+                # Primera conexión del hilo, o la anterior se descartó (quizás desde otro hilo)
+                self._prune()
+                state = {"conn": self._open(), "created_at": now, "released_at": now, "in_use": False}
+                self._local.state = state
+                with self._lock:
+                    self._states[threading.get_ident()] = state
+            elif now - state["created_at"] > self._recycle_seconds:
+                state["conn"].close()
+                state.update({"conn": self._open(), "created_at": now})
+                self.metrics.recycled += 1
+            elif now - state["released_at"] > self._pre_ping_seconds:
+                try:
+                    self._ping(state["conn"])
+                except Exception:
+                    try:
+                        state["conn"].close()
+                    except Exception:
+                        pass
+                    state.update({"conn": self._open(), "created_at": now})
+                    self.metrics.discarded += 1
+            state["in_use"] = True
+            conn = state["conn"]
+        with self._lock:
+            self.metrics.record_checkout(time.monotonic() - start, False)
+            if overflow:
+                self.metrics.overflow += 1
+            else:
+                self._owners[id(conn)] = (threading.get_ident(), state)
+        return conn
+
+    def release(self, conn: Any, discard: bool = False) -> None:
+        with self._lock:
+            self.metrics.in_use -= 1
+            ident, state = self._owners.pop(id(conn), (None, None))
+            if state is not None and discard:
+                # El hilo dueño abre una nueva en su próximo acquire
+                if self._states.get(ident) is state:
+                    self._states.pop(ident)
+                state["conn"] = None
+                state["in_use"] = False
+                self.metrics.discarded += 1
+        if state is None or discard:
+            # Conexión adicional (overflow) o descartada
+            conn.close()
+            return
+        state["released_at"] = time.monotonic()
+        state["in_use"] = False
+
+    def stats(self) -> Dict[str, Any]:
+        self._prune()
+        with self._lock:
+            data = self.metrics.as_dict()
+            data.update({"kind": "per_thread", "open": len(self._states), "saturation": None})
+            data.pop("max_size")
+            return data
+
+    def close_all(self) -> None:
+        with self._lock:
+            states = [st for st in self._states.values() if not st["in_use"]]
+            for ident in [i for i, st in self._states.items() if not st["in_use"]]:
+                self._states.pop(ident)
+        for state in states:
+            if state["conn"] is not None:
+                state["conn"].close()
+        self._local = threading.local()
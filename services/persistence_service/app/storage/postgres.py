@@ -0,0 +1,469 @@
+import hashlib
+import os
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.extras
+import psycopg2.sql
+
+from .base import (
+    CHUNK_SELECT,
+    CLASSIFIED_INSERT_COLUMNS,
+    DATABASE_URL,
+    DOCUMENT_STATS_COLUMNS,
+    DB_POOL_MIN,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    EXPORT_FETCH_SIZE,
+    EXPORT_SELECT,
+    RAW_COLUMNS,
+    RAW_INSERT_COLUMNS,
+    SEARCH_RANK_WINDOW,
+    RawRow,
+    StorageBackend,
+    classified_params,
+    decode_export_row,
+    logger,
+    ping,
+    pooled_connection,
+    raw_params,
+)
+from .pool import ConnectionPool
+
+
+# Particionado en Postgres: "none", "document" (LIST por documento) o "hash" (HASH por document_id)
+POSTGRES_PARTITIONING = os.getenv("POSTGRES_PARTITIONING", "none").lower()
+POSTGRES_HASH_PARTITIONS = int(os.getenv("POSTGRES_HASH_PARTITIONS", "16"))
+
+
+# Texto A..Q indexado para /search: columna generada (se mantiene sola en import, delta y borrado)
+# con la configuración 'spanish' (stemming: "robaron" encuentra "robo") y un índice GIN
+def _search_text(alias: str = "") -> str:
+    return " || ' ' || ".join(f"coalesce({alias}{c}, '')" for c in RAW_COLUMNS)
+
+
+SEARCH_VECTOR = f"to_tsvector('spanish'::regconfig, {_search_text()})"
+SEARCH_VECTOR_COLUMN = f"search_vector tsvector GENERATED ALWAYS AS ({SEARCH_VECTOR}) STORED"
+
+# Contadores por documento (sin particionar: una fila por documento)
+CREATE_DOCUMENT_STATS = """
+CREATE TABLE IF NOT EXISTS document_stats (
+    document_id VARCHAR(64) PRIMARY KEY,
+    total_rows INTEGER NOT NULL DEFAULT 0,
+    classified_rows INTEGER NOT NULL DEFAULT 0,
+    last_row_index INTEGER,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    last_classified_at TIMESTAMP
+);
+"""
+
+# Huellas de contenido de los Excel importados
+CREATE_FINGERPRINTS = """
+CREATE TABLE IF NOT EXISTS document_fingerprints (
+    fingerprint VARCHAR(64) PRIMARY KEY,
+    document_id VARCHAR(64) NOT NULL,
+    file_sha256 VARCHAR(64) NOT NULL,
+    ruleset_version VARCHAR(64) NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS ix_fingerprints_document ON document_fingerprints(document_id);
+"""
+
+# Códigos de calificación y modalidad generados desde diccionario_policial.json.
+# Se da de alta solo lo que falta, así los reinicios no consumen la secuencia SMALLSERIAL.
+CREATE_CATEGORY_CODES = """
+CREATE TABLE IF NOT EXISTS category_codes (
+    code SMALLSERIAL PRIMARY KEY,
+    kind VARCHAR(16) NOT NULL,
+    parent TEXT NOT NULL DEFAULT '',
+    value TEXT NOT NULL,
+    base_legal TEXT,
+    ruleset_version VARCHAR(64) NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    CONSTRAINT uq_category_code UNIQUE (kind, parent, value)
+);
+"""
+
+
+# Conteos pre-agregados por documento, actualizados en la misma transacción que el guardado
+CREATE_ROLLUPS = """
+CREATE TABLE IF NOT EXISTS classified_rollups (
+    document_id VARCHAR(64) NOT NULL,
+    calificacion TEXT NOT NULL DEFAULT '',
+    modalidad TEXT NOT NULL DEFAULT '',
+    jurisdiccion TEXT NOT NULL DEFAULT '',
+    mes VARCHAR(7) NOT NULL DEFAULT '',
+    total INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (document_id, calificacion, modalidad, jurisdiccion, mes)
+);
+"""
+
+
+def _document_partition(table: str, document_id: str) -> str:
+    suffix = hashlib.sha1(document_id.encode("utf-8")).hexdigest()[:16]
+    return f"{table}_doc_{suffix}"
+
+
+class PostgresBackend(StorageBackend):
+    """Postgres vía psycopg2, con pool de conexiones acotado y particionado opcional."""
+
+    name = "postgres"
+    placeholder = "%s"
+
+    def __init__(self):
+        self._pool = ConnectionPool(
+            lambda: psycopg2.connect(DATABASE_URL),
+            ping,
+            max_size=DB_POOL_SIZE,
+            min_size=DB_POOL_MIN,
+            timeout=DB_POOL_TIMEOUT,
+            recycle_seconds=DB_POOL_RECYCLE,
+            pre_ping_seconds=DB_POOL_PRE_PING,
+        )
+
+    def connection(self, document_id: Optional[str] = None, create: bool = False):
+        return pooled_connection(self._pool)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._pool.stats()
+
+    def init_schema(self) -> None:
+        if POSTGRES_PARTITIONING in ("document", "hash"):
+            self._init_partitioned()
+        else:
+            self._init_plain()
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(CREATE_DOCUMENT_STATS)
+                cur.execute(CREATE_FINGERPRINTS)
+                cur.execute(CREATE_CATEGORY_CODES)
+                cur.execute(CREATE_ROLLUPS)
+                # Bases creadas antes del import incremental no tienen row_hash
+                cur.execute("ALTER TABLE raw_incidents ADD COLUMN IF NOT EXISTS row_hash VARCHAR(40)")
+                # Ni las anteriores a category_codes los códigos de calificación y modalidad
+                cur.execute(
+                    "ALTER TABLE classified_incidents ADD COLUMN IF NOT EXISTS col_s_code SMALLINT, "
+                    "ADD COLUMN IF NOT EXISTS col_t_code SMALLINT"
+                )
+                # Bases creadas antes de /search: la columna generada se calcula una vez para las filas existentes
+                cur.execute(f"ALTER TABLE raw_incidents ADD COLUMN IF NOT EXISTS {SEARCH_VECTOR_COLUMN}")
+                cur.execute("CREATE INDEX IF NOT EXISTS ix_raw_search ON raw_incidents USING GIN (search_vector)")
+                # Filtros y agregados por calificación / modalidad comparan enteros
+                cur.execute(
+                    "CREATE INDEX IF NOT EXISTS ix_classified_document_codes "
+                    "ON classified_incidents(document_id, col_s_code, col_t_code)"
+                )
+
+    def find_fingerprint(self, fingerprint: str) -> Optional[str]:
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT document_id FROM document_fingerprints WHERE fingerprint=%s", (fingerprint,))
+                row = cur.fetchone()
+                return row[0] if row else None
+
+    def record_fingerprint(self, fingerprint: str, document_id: str, file_sha256: str, ruleset_version: str) -> None:
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO document_fingerprints (fingerprint, document_id, file_sha256, ruleset_version) "
+                    "VALUES (%s, %s, %s, %s) ON CONFLICT (fingerprint) DO UPDATE SET "
+                    "document_id = EXCLUDED.document_id, created_at = NOW()",
+                    (fingerprint, document_id, file_sha256, ruleset_version),
+                )
+
+    def _init_plain(self) -> None:
+        create_raw = f"""
+        CREATE TABLE IF NOT EXISTS raw_incidents (
+            id SERIAL PRIMARY KEY,
+            document_id VARCHAR(64) NOT NULL,
+            row_index INTEGER NOT NULL,
+            source_path TEXT,
+            col_a TEXT, col_b TEXT, col_c TEXT, col_d TEXT, col_e TEXT, col_f TEXT, col_g TEXT, col_h TEXT,
+            col_i TEXT, col_j TEXT, col_k TEXT, col_l TEXT, col_m TEXT, col_n TEXT, col_o TEXT, col_p TEXT, col_q TEXT,
+            row_hash VARCHAR(40),
+            {SEARCH_VECTOR_COLUMN},
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            CONSTRAINT uq_raw_document_row UNIQUE (document_id, row_index)
+        );
+        CREATE INDEX IF NOT EXISTS ix_raw_document_row ON raw_incidents(document_id, row_index);
+        """
+        create_classified = """
+        CREATE TABLE IF NOT EXISTS classified_incidents (
+            id SERIAL PRIMARY KEY,
+            document_id VARCHAR(64) NOT NULL,
+            raw_incident_id INTEGER NOT NULL REFERENCES raw_incidents(id) ON DELETE CASCADE,
+            col_r TEXT, col_s TEXT, col_t TEXT, col_u TEXT, col_v TEXT, col_w TEXT, col_x TEXT, col_y TEXT, col_z TEXT,
+            col_aa TEXT, col_ab TEXT,
+            col_s_code SMALLINT, col_t_code SMALLINT,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            CONSTRAINT uq_classified_raw UNIQUE (raw_incident_id)
+        );
+        CREATE INDEX IF NOT EXISTS ix_classified_document_raw ON classified_incidents(document_id, raw_incident_id);
+        """
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(create_raw)
+                cur.execute(create_classified)
+
+    def _init_partitioned(self) -> None:
+        """
+        Esquema particionado por document_id (Postgres 12+).
+        - "document": una partición LIST por documento, creada al importarlo; borrar un documento es
+          un DETACH + DROP de sus particiones.
+        - "hash": POSTGRES_HASH_PARTITIONS particiones HASH fijas; las consultas por documento
+          solo tocan una partición.
+        La clave de partición debe estar en la PK y en los UNIQUE, por eso ambos incluyen document_id.
+        """
+        strategy = "LIST" if POSTGRES_PARTITIONING == "document" else "HASH"
+        create_raw = f"""
+        CREATE TABLE IF NOT EXISTS raw_incidents (
+            id SERIAL,
+            document_id VARCHAR(64) NOT NULL,
+            row_index INTEGER NOT NULL,
+            source_path TEXT,
+            col_a TEXT, col_b TEXT, col_c TEXT, col_d TEXT, col_e TEXT, col_f TEXT, col_g TEXT, col_h TEXT,
+            col_i TEXT, col_j TEXT, col_k TEXT, col_l TEXT, col_m TEXT, col_n TEXT, col_o TEXT, col_p TEXT, col_q TEXT,
+            row_hash VARCHAR(40),
+            {SEARCH_VECTOR_COLUMN},
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (document_id, id),
+            CONSTRAINT uq_raw_document_row UNIQUE (document_id, row_index)
+        ) PARTITION BY {strategy} (document_id);
+        """
+        create_classified = f"""
+        CREATE TABLE IF NOT EXISTS classified_incidents (
+            id SERIAL,
+            document_id VARCHAR(64) NOT NULL,
+            raw_incident_id INTEGER NOT NULL,
+            col_r TEXT, col_s TEXT, col_t TEXT, col_u TEXT, col_v TEXT, col_w TEXT, col_x TEXT, col_y TEXT, col_z TEXT,
+            col_aa TEXT, col_ab TEXT,
+            col_s_code SMALLINT, col_t_code SMALLINT,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (document_id, id),
+            CONSTRAINT uq_classified_raw UNIQUE (document_id, raw_incident_id),
+            FOREIGN KEY (document_id, raw_incident_id) REFERENCES raw_incidents(document_id, id) ON DELETE CASCADE
+        ) PARTITION BY {strategy} (document_id);
+        """
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT c.relname FROM pg_class c LEFT JOIN pg_partitioned_table p ON p.partrelid = c.oid "
+                    "WHERE c.relname IN ('raw_incidents', 'classified_incidents') AND p.partrelid IS NULL "
+                    "AND c.relkind = 'r'"
+                )
+                plain_tables = [row[0] for row in cur.fetchall()]
+                if plain_tables:
+                    logger.warning(
+                        "POSTGRES_PARTITIONING=%s ignorado: las tablas %s ya existen sin particionar",
+                        POSTGRES_PARTITIONING,
+                        ", ".join(plain_tables),
+                    )
+                    return
+                cur.execute(create_raw)
+                cur.execute(create_classified)
+                if POSTGRES_PARTITIONING == "document":
+                    # Red de seguridad para filas cuyo documento no tenga partición propia
+                    cur.execute("CREATE TABLE IF NOT EXISTS raw_incidents_default PARTITION OF raw_incidents DEFAULT")
+                    cur.execute(
+                        "CREATE TABLE IF NOT EXISTS classified_incidents_default PARTITION OF classified_incidents DEFAULT"
+                    )
+                else:
+                    for remainder in range(POSTGRES_HASH_PARTITIONS):
+                        for table in ("raw_incidents", "classified_incidents"):
+                            cur.execute(
+                                f"CREATE TABLE IF NOT EXISTS {table}_h{remainder} PARTITION OF {table} "
+                                f"FOR VALUES WITH (MODULUS {POSTGRES_HASH_PARTITIONS}, REMAINDER {remainder})"
+                            )
+
+    def prepare_document(self, document_id: str) -> None:
+        # Solo con POSTGRES_PARTITIONING=document: crea las particiones LIST del documento
+        if POSTGRES_PARTITIONING != "document":
+            return
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                for table in ("raw_incidents", "classified_incidents"):
+                    cur.execute(
+                        psycopg2.sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES IN ({})").format(
+                            psycopg2.sql.Identifier(_document_partition(table, document_id)),
+                            psycopg2.sql.Identifier(table),
+                            psycopg2.sql.Literal(document_id),
+                        )
+                    )
+
+    def drop_document(self, document_id: str) -> None:
+        # Con particiones por documento es O(1): DETACH + DROP; si no, los clasificados caen por CASCADE
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                if POSTGRES_PARTITIONING == "document":
+                    # Primero clasificados: su FK referencia a la partición raw
+                    for table in ("classified_incidents", "raw_incidents"):
+                        partition = _document_partition(table, document_id)
+                        cur.execute("SELECT to_regclass(%s)", (partition,))
+                        if cur.fetchone()[0] is None:
+                            continue
+                        cur.execute(
+                            psycopg2.sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(
+                                psycopg2.sql.Identifier(table), psycopg2.sql.Identifier(partition)
+                            )
+                        )
+                        cur.execute(psycopg2.sql.SQL("DROP TABLE {}").format(psycopg2.sql.Identifier(partition)))
+                cur.execute("DELETE FROM raw_incidents WHERE document_id=%s", (document_id,))
+                cur.execute("DELETE FROM document_stats WHERE document_id=%s", (document_id,))
+                cur.execute("DELETE FROM classified_rollups WHERE document_id=%s", (document_id,))
+        self.forget_fingerprints(document_id)
+
+    def forget_fingerprints(self, document_id: str) -> None:
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM document_fingerprints WHERE document_id=%s", (document_id,))
+
+    def _insert_raw(self, conn, document_id: str, rows: List[RawRow]) -> int:
+        params = raw_params(document_id, rows)
+        sql = f"INSERT INTO raw_incidents ({RAW_INSERT_COLUMNS}) VALUES %s ON CONFLICT DO NOTHING RETURNING id"
+        with conn.cursor() as cur:
+            inserted = psycopg2.extras.execute_values(cur, sql, params, page_size=len(params), fetch=True)
+            return len(inserted)
+
+    def _record_imported(self, conn, document_id: str, inserted: int, last_row_index: Optional[int]) -> None:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO document_stats (document_id, total_rows, last_row_index) VALUES (%s, %s, %s) "
+                "ON CONFLICT (document_id) DO UPDATE SET "
+                "total_rows = document_stats.total_rows + EXCLUDED.total_rows, "
+                "last_row_index = GREATEST(document_stats.last_row_index, EXCLUDED.last_row_index), "
+                "updated_at = NOW()",
+                (document_id, inserted, last_row_index),
+            )
+
+    def _record_classified(self, conn, document_id: str, saved: int) -> None:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE document_stats SET classified_rows = classified_rows + %s, updated_at = NOW(), "
+                "last_classified_at = NOW() WHERE document_id=%s",
+                (saved, document_id),
+            )
+
+    def get_document_stats(self, document_id: str) -> Optional[Dict[str, Any]]:
+        select = f"SELECT {', '.join(DOCUMENT_STATS_COLUMNS)} FROM document_stats WHERE document_id=%s"
+        with self.connection(document_id) as conn:
+            with conn.cursor() as cur:
+                cur.execute(select, (document_id,))
+                row = cur.fetchone()
+                if row is None:
+                    # Documento anterior a document_stats: se cuenta una sola vez y queda registrado
+                    cur.execute(
+                        "SELECT count(*), max(row_index) FROM raw_incidents WHERE document_id=%s", (document_id,)
+                    )
+                    total, last_row_index = cur.fetchone()
+                    if not total:
+                        return None
+                    cur.execute("SELECT count(*) FROM classified_incidents WHERE document_id=%s", (document_id,))
+                    classified = cur.fetchone()[0]
+                    cur.execute(
+                        "INSERT INTO document_stats (document_id, total_rows, classified_rows, last_row_index) "
+                        "VALUES (%s, %s, %s, %s) ON CONFLICT (document_id) DO NOTHING",
+                        (document_id, total, classified, last_row_index),
+                    )
+                    cur.execute(select, (document_id,))
+                    row = cur.fetchone()
+                return dict(zip(DOCUMENT_STATS_COLUMNS, row))
+
+    def _fetch_unclassified(
+        self, conn, document_id: str, limit: int, row_range: Optional[Tuple[int, int]] = None
+    ) -> List[Dict]:
+        in_range = "AND r.row_index BETWEEN %s AND %s " if row_range else ""
+        sql = (
+            f"SELECT {CHUNK_SELECT} FROM raw_incidents r WHERE r.document_id=%s {in_range}AND NOT EXISTS "
+            "(SELECT 1 FROM classified_incidents c WHERE c.document_id=r.document_id AND c.raw_incident_id=r.id) "
+            "ORDER BY r.row_index ASC LIMIT %s"
+        )
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute(sql, (document_id, *(row_range or ()), limit))
+            return [dict(row) for row in cur.fetchall()]
+
+    def _insert_classified(self, conn, document_id: str, items: List[Dict]) -> List[int]:
+        # execute_values arma un único INSERT multi-fila: un solo viaje a la base por lote
+        params = classified_params(document_id, items, self.category_codes())
+        sql = (
+            f"INSERT INTO classified_incidents ({CLASSIFIED_INSERT_COLUMNS}) VALUES %s "
+            "ON CONFLICT DO NOTHING RETURNING raw_incident_id"
+        )
+        with conn.cursor() as cur:
+            inserted = psycopg2.extras.execute_values(cur, sql, params, page_size=len(params), fetch=True)
+            return [row[0] for row in inserted]
+
+    def search(
+        self, query: str, document_ids: Optional[List[str]] = None, limit: int = 20, offset: int = 0
+    ) -> Tuple[List[Tuple], bool]:
+        # websearch_to_tsquery acepta texto libre ("frase", OR, -excluir) sin errores de sintaxis.
+        # El tsquery va en línea (no en un CTE) para que el planificador estime cuántas filas coinciden:
+        # con términos frecuentes recorre la PK hacia atrás y corta en la ventana; con raros usa el GIN.
+        # ts_rank_cd se calcula solo en la ventana y ts_headline solo en la página.
+        params: Dict[str, Any] = {"q": query, "window": SEARCH_RANK_WINDOW, "limit": limit, "offset": offset}
+        doc_filter = ""
+        if document_ids:
+            doc_filter = " AND r.document_id IN %(documents)s"
+            params["documents"] = tuple(document_ids)
+        tsquery = "websearch_to_tsquery('spanish', %(q)s)"
+        headline = (
+            f"ts_headline('spanish', {_search_text('h.')}, {tsquery}, "
+            "'StartSel=[, StopSel=], MaxFragments=1, MaxWords=20, MinWords=8')"
+        )
+        # Primera coincidencia fuera de la ventana: si existe, el ranking queda truncado en ella
+        beyond_sql = (
+            f"SELECT r.id FROM raw_incidents r WHERE r.search_vector @@ {tsquery}{doc_filter} "
+            "ORDER BY r.id DESC LIMIT 1 OFFSET %(window)s"
+        )
+        ranked_sql = (
+            f"SELECT p.document_id, p.row_index, p.id, p.score, {headline}, true "
+            "FROM (SELECT r.document_id, r.row_index, r.id, ts_rank_cd(r.search_vector, "
+            f"{tsquery}) AS score FROM (SELECT r.document_id, r.id FROM raw_incidents r "
+            f"WHERE r.search_vector @@ {tsquery}{doc_filter} ORDER BY r.id DESC LIMIT %(window)s) c "
+            "JOIN raw_incidents r ON r.document_id = c.document_id AND r.id = c.id "
+            "ORDER BY score DESC, r.document_id, r.row_index LIMIT %(limit)s OFFSET %(offset)s) p "
+            "JOIN raw_incidents h ON h.document_id = p.document_id AND h.id = p.id "
+            "ORDER BY p.score DESC, p.document_id, p.row_index"
+        )
+        # Pasada la ventana se pagina por id: las coincidencias más viejas no se rankean
+        older_sql = (
+            f"SELECT h.document_id, h.row_index, h.id, ts_rank_cd(h.search_vector, {tsquery}), {headline}, false "
+            f"FROM (SELECT r.document_id, r.id FROM raw_incidents r WHERE r.search_vector @@ {tsquery}{doc_filter} "
+            "AND r.id <= %(beyond)s ORDER BY r.id DESC LIMIT %(rest)s OFFSET %(rest_offset)s) p "
+            "JOIN raw_incidents h ON h.document_id = p.document_id AND h.id = p.id "
+            "ORDER BY h.id DESC"
+        )
+        hits: List[Tuple] = []
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(beyond_sql, params)
+                beyond = cur.fetchone()
+                truncated = beyond is not None
+                if not truncated or offset < SEARCH_RANK_WINDOW:
+                    cur.execute(ranked_sql, params)
+                    hits = cur.fetchall()
+                if truncated and len(hits) < limit:
+                    params.update(
+                        beyond=beyond[0], rest=limit - len(hits), rest_offset=max(0, offset - SEARCH_RANK_WINDOW)
+                    )
+                    cur.execute(older_sql, params)
+                    hits += cur.fetchall()
+        return [(row[0], row[1], row[2], float(row[3]), row[4], row[5]) for row in hits], truncated
+
+    def iter_export_rows(self, document_id: str, fetch_size: int = EXPORT_FETCH_SIZE) -> Iterator[Tuple]:
+        # Cursor con nombre (server-side): el documento se trae de a fetch_size filas
+        sql = (
+            f"SELECT {EXPORT_SELECT} FROM raw_incidents r "
+            "LEFT JOIN classified_incidents c ON c.document_id = r.document_id AND c.raw_incident_id = r.id "
+            "WHERE r.document_id=%s ORDER BY r.row_index ASC"
+        )
+        codes = self.category_codes()
+        with self.connection(document_id) as conn:
+            with conn.cursor(name=f"export_{uuid.uuid4().hex}") as cur:
+                cur.itersize = fetch_size
+                cur.execute(sql, (document_id,))
+                for row in cur:
+                    yield decode_export_row(row, codes)
@@ -0,0 +1,131 @@
+import heapq
+import itertools
+import os
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from .base import BatchResult
+from .shards import ShardManager
+from .sqlite import SQLiteBackend, connect_sqlite, create_sqlite_schema, fts_query
+
+
+# Un archivo SQLite por documento (más un catálogo) en lugar de un único persistence.db
+SQLITE_SHARD_DIR = os.getenv("SQLITE_SHARD_DIR", "./data/shards")
+SQLITE_SHARD_MAX_OPEN = int(os.getenv("SQLITE_SHARD_MAX_OPEN", "64"))
+
+
+class ShardedSQLiteBackend(SQLiteBackend):
+    """
+    SQLite con un archivo por documento: mismo SQL que SQLiteBackend, pero cada operación
+    se resuelve contra el shard del documento a través de ShardManager.
+    """
+
+    name = "sqlite_sharded"
+
+    def __init__(self):
+        self._shards = ShardManager(
+            SQLITE_SHARD_DIR, connect_sqlite, create_sqlite_schema, max_open=SQLITE_SHARD_MAX_OPEN
+        )
+        self._maintenance_thread = None
+
+    @contextmanager
+    def connection(self, document_id: Optional[str] = None, create: bool = False):
+        # `create` da de alta el archivo del documento
+        if document_id is None:
+            raise ValueError("En modo shards toda operación requiere document_id")
+        with self._shards.connection(document_id, create=create) as conn:
+            yield conn
+
+    def stats(self) -> Dict[str, Any]:
+        return {"kind": "shards", **self._shards.stats()}
+
+    def _catalog_connection(self):
+        return self._shards.catalog()
+
+    def init_schema(self) -> None:
+        # Cada documento crea su propio archivo (con su esquema) al importarse
+        self._shards.init_catalog()
+        self._init_catalog_tables()
+
+    def start_maintenance(self) -> None:
+        # Los shards son por documento y chicos: el planificador no depende de estadísticas
+        return
+
+    def prepare_document(self, document_id: str) -> None:
+        with self.connection(document_id, create=True):
+            return
+
+    def document_exists(self, document_id: str) -> bool:
+        # Evita crear archivos vacíos al consultar documentos desconocidos
+        return self._shards.exists(document_id)
+
+    def drop_document(self, document_id: str) -> None:
+        self._shards.drop(document_id)
+        self.forget_fingerprints(document_id)
+
+    def rollup_counts(
+        self,
+        group_by: List[str],
+        document_ids: Optional[List[str]] = None,
+        filters: Optional[Dict[str, str]] = None,
+        mes_desde: Optional[str] = None,
+        mes_hasta: Optional[str] = None,
+    ) -> List[Tuple]:
+        # Cada shard guarda los conteos de su documento: se consultan uno por uno y se suman
+        totals: Counter = Counter()
+        for document_id in self._shards.document_ids() if document_ids is None else document_ids:
+            if not self.document_exists(document_id):
+                continue
+            with self.connection(document_id) as conn:
+                cur = conn.cursor()
+                try:
+                    self._ensure_rollups(cur, document_id)
+                    for row in self._query_rollups(cur, group_by, [document_id], filters or {}, mes_desde, mes_hasta):
+                        totals[row[:-1]] += row[-1]
+                finally:
+                    cur.close()
+        return sorted((key + (total,) for key, total in totals.items()), key=lambda row: (-row[-1], row[:-1]))
+
+    def search(
+        self, query: str, document_ids: Optional[List[str]] = None, limit: int = 20, offset: int = 0
+    ) -> Tuple[List[Tuple], bool]:
+        """
+        Cada shard tiene su índice FTS5: se piden las primeras offset + limit de cada uno y se mezclan.
+        bm25 usa las estadísticas de cada índice (frecuencia de términos en su documento), así que los
+        score de documentos distintos no son comparables: el orden entre documentos es aproximado.
+        La ventana de SEARCH_RANK_WINDOW es por documento; las coincidencias fuera de ella van después
+        de todas las rankeadas, documento por documento.
+        """
+        match = fts_query(query)
+        if not match:
+            return [], False
+        shard_hits: List[List[Tuple]] = []
+        truncated = False
+        for document_id in self._shards.document_ids() if document_ids is None else document_ids:
+            if not self.document_exists(document_id):
+                continue
+            with self.connection(document_id) as conn:
+                hits, shard_truncated = self._search_on(conn, match, [document_id], offset + limit, 0)
+            shard_hits.append(hits)
+            truncated = truncated or shard_truncated
+
+        def order(position_hit: Tuple[int, Tuple]) -> Tuple:
+            # Cada shard ya viene en este orden, así que la mezcla respeta la paginación de cada uno
+            position, hit = position_hit
+            return (0, -hit[3], hit[0], hit[1]) if hit[5] else (1, hit[0], position)
+
+        merged = heapq.merge(*(enumerate(hits) for hits in shard_hits), key=order)
+        return [hit for _, hit in itertools.islice(merged, offset, offset + limit)], truncated
+
+    def insert_classified_group(self, batches: List[Tuple[str, List[Dict]]]) -> List[BatchResult]:
+        # Cada documento vive en su archivo: un COMMIT por documento
+        results: List[BatchResult] = [(None, None)] * len(batches)
+        by_document: Dict[str, List[int]] = {}
+        for num, (document_id, _) in enumerate(batches):
+            by_document.setdefault(document_id, []).append(num)
+        for document_id, positions in by_document.items():
+            group_results = self._insert_classified_group_on(document_id, [batches[num] for num in positions])
+            for num, result in zip(positions, group_results):
+                results[num] = result
+        return results
@@ -0,0 +1,188 @@
+import os
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+class ShardNotFoundError(Exception):
+    """El documento no tiene shard registrado en el catálogo."""
+
+
+class _ShardHandle:
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        # Una conexión SQLite no se comparte entre transacciones concurrentes.
+        # Lock (no RLock): un export en streaming puede liberarlo desde otro hilo.
+        self.lock = threading.Lock()
+        # Hilos que tienen el handle tomado o esperando su lock; el LRU no lo cierra mientras sea > 0
+        self.users = 0
+
+
+class ShardManager:
+    """
+    Un archivo SQLite por documento bajo `shard_dir`, más un catálogo chico (catalog.db)
+    que mapea document_id -> archivo. Las conexiones se abren bajo demanda y se mantienen
+    en un LRU de hasta `max_open` handles; escrituras a documentos distintos nunca
+    compiten por el mismo lock de escritura y retirar un documento es borrar su archivo.
+    """
+
+    def __init__(
+        self,
+        shard_dir: str,
+        connect: Callable[[str], sqlite3.Connection],
+        create_schema: Callable[[sqlite3.Connection], None],
+        max_open: int = 64,
+    ):
+        self._dir = Path(shard_dir)
+        self._connect = connect
+        self._create_schema = create_schema
+        self._max_open = max_open
+        self._handles: "OrderedDict[str, _ShardHandle]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._catalog: Optional[sqlite3.Connection] = None
+        self._catalog_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # -- Catálogo -------------------------------------------------------------------------
+
+    def init_catalog(self) -> None:
+        self._dir.mkdir(parents=True, exist_ok=True)
+        with self.catalog() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS shards (
+                    document_id TEXT PRIMARY KEY,
+                    file_name TEXT NOT NULL,
+                    created_at TEXT DEFAULT (datetime('now'))
+                )
+                """
+            )
+
+    @contextmanager
+    def catalog(self) -> Iterator[sqlite3.Connection]:
+        """Conexión al catálogo; también aloja las tablas globales (no ligadas a un documento)."""
+        with self._catalog_lock:
+            if self._catalog is None:
+                self._dir.mkdir(parents=True, exist_ok=True)
+                self._catalog = self._connect(str(self._dir / "catalog.db"))
+            try:
+                yield self._catalog
+                self._catalog.commit()
+            except BaseException:
+                self._catalog.rollback()
+                raise
+
+    def _file_name(self, document_id: str, create: bool) -> Optional[str]:
+        with self.catalog() as conn:
+            row = conn.execute("SELECT file_name FROM shards WHERE document_id=?", (document_id,)).fetchone()
+            if row is not None:
+                return row[0]
+            if not create:
+                return None
+            # El nombre no deriva del document_id para no depender de su formato
+            file_name = f"doc_{uuid.uuid4().hex}.db"
+            conn.execute("INSERT INTO shards (document_id, file_name) VALUES (?, ?)", (document_id, file_name))
+            return file_name
+
+    def exists(self, document_id: str) -> bool:
+        with self._lock:
+            if document_id in self._handles:
+                return True
+        return self._file_name(document_id, create=False) is not None
+
+    def document_ids(self) -> List[str]:
+        with self.catalog() as conn:
+            return [row[0] for row in conn.execute("SELECT document_id FROM shards ORDER BY created_at")]
+
+    # -- Handles ---------------------------------------------------------------------------
+
+    def _handle(self, document_id: str, create: bool) -> _ShardHandle:
+        with self._lock:
+            handle = self._handles.get(document_id)
+            if handle is not None:
+                self._handles.move_to_end(document_id)
+                handle.users += 1
+                self.hits += 1
+                return handle
+
+        file_name = self._file_name(document_id, create)
+        if file_name is None:
+            raise ShardNotFoundError(f"No existe shard para document_id={document_id}")
+        conn = self._connect(str(self._dir / file_name))
+        self._create_schema(conn)
+        conn.commit()
+        handle = _ShardHandle(conn)
+
+        with self._lock:
+            existing = self._handles.get(document_id)
+            if existing is not None:
+                # Otro hilo lo abrió primero: se descarta el duplicado
+                conn.close()
+                self._handles.move_to_end(document_id)
+                existing.users += 1
+                return existing
+            self.misses += 1
+            handle.users += 1
+            self._handles[document_id] = handle
+            self._evict_locked()
+        return handle
+
+    def _evict_locked(self) -> None:
+        for document_id in list(self._handles.keys()):
+            if len(self._handles) <= self._max_open:
+                break
+            handle = self._handles[document_id]
+            # Solo se cierran handles que nadie está usando
+            if handle.users == 0:
+                del self._handles[document_id]
+                handle.conn.close()
+                self.evictions += 1
+
+    @contextmanager
+    def connection(self, document_id: str, create: bool = False) -> Iterator[sqlite3.Connection]:
+        """Conexión al shard del documento con COMMIT/ROLLBACK al salir del bloque."""
+        handle = self._handle(document_id, create)
+        try:
+            with handle.lock:
+                try:
+                    yield handle.conn
+                    handle.conn.commit()
+                except BaseException:
+                    handle.conn.rollback()
+                    raise
+        finally:
+            with self._lock:
+                handle.users -= 1
+
+    def drop(self, document_id: str) -> None:
+        """Cierra el handle del documento, borra su archivo (y WAL/SHM) y lo quita del catálogo."""
+        with self._lock:
+            handle = self._handles.pop(document_id, None)
+        if handle is not None:
+            with handle.lock:
+                handle.conn.close()
+        file_name = self._file_name(document_id, create=False)
+        if file_name is None:
+            return
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            path = self._dir / f"{file_name}{suffix}"
+            if path.exists():
+                os.remove(path)
+        with self.catalog() as conn:
+            conn.execute("DELETE FROM shards WHERE document_id=?", (document_id,))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "open_handles": len(self._handles),
+                "max_open": self._max_open,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,494 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .base import (
+    CHUNK_SELECT,
+    CLASSIFIED_INSERT_COLUMNS,
+    CLASSIFIED_INSERT_FIELDS,
+    DATABASE_URL,
+    DOCUMENT_STATS_COLUMNS,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE,
+    EXPORT_FETCH_SIZE,
+    EXPORT_SELECT,
+    RAW_COLUMNS,
+    RAW_INSERT_COLUMNS,
+    RAW_INSERT_FIELDS,
+    SEARCH_RANK_WINDOW,
+    RawRow,
+    StorageBackend,
+    classified_params,
+    decode_export_row,
+    logger,
+    ping,
+    pooled_connection,
+    raw_params,
+)
+from .pool import ThreadLocalPool
+
+
+# Perfil de almacenamiento SQLite: "default" (rollback journal) o "performance" (WAL + PRAGMAs)
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "default").lower()
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+SQLITE_OPTIMIZE_INTERVAL = float(os.getenv("SQLITE_OPTIMIZE_INTERVAL", "3600"))
+
+
+def sqlite_path(url: str = DATABASE_URL) -> str:
+    # sqlite:///./persistence.db -> ./persistence.db
+    if url.startswith("sqlite///"):
+        return url[len("sqlite///") :]
+    if url.startswith("sqlite:///"):
+        return url[len("sqlite:///") :]
+    if url.startswith("sqlite://"):
+        return url[len("sqlite://") :]
+    return "./persistence.db"
+
+
+def sqlite_performance() -> bool:
+    return SQLITE_PROFILE == "performance"
+
+
+def connect_sqlite(path: Optional[str] = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(path or sqlite_path(), check_same_thread=False)
+    conn.execute("PRAGMA foreign_keys=ON;")
+    if sqlite_performance():
+        # WAL: los lectores no bloquean al escritor ni viceversa; NORMAL es durable en WAL salvo corte de energía
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS};")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE};")
+        conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB};")
+        conn.execute("PRAGMA temp_store=MEMORY;")
+    return conn
+
+
+def create_sqlite_schema(conn: sqlite3.Connection) -> None:
+    create_raw = """
+    CREATE TABLE IF NOT EXISTS raw_incidents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        document_id TEXT NOT NULL,
+        row_index INTEGER NOT NULL,
+        source_path TEXT,
+        col_a TEXT, col_b TEXT, col_c TEXT, col_d TEXT, col_e TEXT, col_f TEXT, col_g TEXT, col_h TEXT,
+        col_i TEXT, col_j TEXT, col_k TEXT, col_l TEXT, col_m TEXT, col_n TEXT, col_o TEXT, col_p TEXT, col_q TEXT,
+        row_hash TEXT,
+        created_at TEXT DEFAULT (datetime('now')),
+        CONSTRAINT uq_raw_document_row UNIQUE (document_id, row_index)
+    );
+    CREATE INDEX IF NOT EXISTS ix_raw_document_row ON raw_incidents(document_id, row_index);
+    """
+    create_classified = """
+    CREATE TABLE IF NOT EXISTS classified_incidents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        document_id TEXT NOT NULL,
+        raw_incident_id INTEGER NOT NULL,
+        col_r TEXT, col_s TEXT, col_t TEXT, col_u TEXT, col_v TEXT, col_w TEXT, col_x TEXT, col_y TEXT, col_z TEXT,
+        col_aa TEXT, col_ab TEXT,
+        col_s_code INTEGER, col_t_code INTEGER,
+        created_at TEXT DEFAULT (datetime('now')),
+        CONSTRAINT uq_classified_raw UNIQUE (raw_incident_id),
+        FOREIGN KEY (raw_incident_id) REFERENCES raw_incidents(id) ON DELETE CASCADE
+    );
+    CREATE INDEX IF NOT EXISTS ix_classified_document_raw ON classified_incidents(document_id, raw_incident_id);
+    """
+    # Contadores por documento, actualizados en la misma transacción que import y guardado
+    create_stats = """
+    CREATE TABLE IF NOT EXISTS document_stats (
+        document_id TEXT PRIMARY KEY,
+        total_rows INTEGER NOT NULL DEFAULT 0,
+        classified_rows INTEGER NOT NULL DEFAULT 0,
+        last_row_index INTEGER,
+        created_at TEXT DEFAULT (datetime('now')),
+        updated_at TEXT DEFAULT (datetime('now')),
+        last_classified_at TEXT
+    );
+    """
+    # Conteos pre-agregados por documento, actualizados en la misma transacción que el guardado
+    create_rollups = """
+    CREATE TABLE IF NOT EXISTS classified_rollups (
+        document_id TEXT NOT NULL,
+        calificacion TEXT NOT NULL DEFAULT '',
+        modalidad TEXT NOT NULL DEFAULT '',
+        jurisdiccion TEXT NOT NULL DEFAULT '',
+        mes TEXT NOT NULL DEFAULT '',
+        total INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (document_id, calificacion, modalidad, jurisdiccion, mes)
+    ) WITHOUT ROWID;
+    """
+    # Filtros y agregados por calificación / modalidad comparan enteros
+    create_code_indexes = """
+    CREATE INDEX IF NOT EXISTS ix_classified_document_codes ON classified_incidents(document_id, col_s_code, col_t_code);
+    """
+    # Índice cubriente para el export: el LEFT JOIN resuelve R..AB (y sus códigos) sin visitar la tabla.
+    # La sonda NOT EXISTS del lote ya queda cubierta por el UNIQUE de raw_incident_id.
+    create_performance_indexes = """
+    DROP INDEX IF EXISTS ix_classified_export;
+    CREATE INDEX IF NOT EXISTS ix_classified_export_codes ON classified_incidents(
+        raw_incident_id, col_r, col_s, col_t, col_u, col_v, col_w, col_x, col_y, col_z, col_aa, col_ab,
+        col_s_code, col_t_code
+    );
+    """
+    cur = conn.cursor()
+    cur.executescript(create_raw)
+    # Bases creadas antes del import incremental no tienen row_hash
+    if "row_hash" not in {row[1] for row in cur.execute("PRAGMA table_info(raw_incidents)")}:
+        cur.execute("ALTER TABLE raw_incidents ADD COLUMN row_hash TEXT")
+    cur.executescript(create_classified)
+    # Bases creadas antes de category_codes guardan calificación y modalidad solo como texto
+    classified_columns = {row[1] for row in cur.execute("PRAGMA table_info(classified_incidents)")}
+    for column in ("col_s_code", "col_t_code"):
+        if column not in classified_columns:
+            cur.execute(f"ALTER TABLE classified_incidents ADD COLUMN {column} INTEGER")
+    cur.executescript(create_code_indexes)
+    cur.executescript(create_stats)
+    cur.executescript(create_rollups)
+    create_search_index(cur)
+    if sqlite_performance():
+        cur.executescript(create_performance_indexes)
+
+
+_FTS_COLUMNS = ", ".join(RAW_COLUMNS)
+_FTS_NEW = ", ".join(f"new.{c}" for c in RAW_COLUMNS)
+_FTS_OLD = ", ".join(f"old.{c}" for c in RAW_COLUMNS)
+
+# Índice FTS5 sobre A..Q con raw_incidents como contenido externo (el texto no se duplica).
+# Los triggers lo mantienen en la misma transacción del import, del import incremental y del borrado.
+# remove_diacritics: "jose" encuentra "José".
+CREATE_SEARCH_INDEX = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS raw_incidents_fts USING fts5(
+    {_FTS_COLUMNS}, content='raw_incidents', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS raw_incidents_fts_insert AFTER INSERT ON raw_incidents BEGIN
+    INSERT INTO raw_incidents_fts (rowid, {_FTS_COLUMNS}) VALUES (new.id, {_FTS_NEW});
+END;
+CREATE TRIGGER IF NOT EXISTS raw_incidents_fts_delete AFTER DELETE ON raw_incidents BEGIN
+    INSERT INTO raw_incidents_fts (raw_incidents_fts, rowid, {_FTS_COLUMNS}) VALUES ('delete', old.id, {_FTS_OLD});
+END;
+CREATE TRIGGER IF NOT EXISTS raw_incidents_fts_update AFTER UPDATE OF {_FTS_COLUMNS} ON raw_incidents BEGIN
+    INSERT INTO raw_incidents_fts (raw_incidents_fts, rowid, {_FTS_COLUMNS}) VALUES ('delete', old.id, {_FTS_OLD});
+    INSERT INTO raw_incidents_fts (rowid, {_FTS_COLUMNS}) VALUES (new.id, {_FTS_NEW});
+END;
+"""
+
+
+def create_search_index(cur: sqlite3.Cursor) -> None:
+    exists = cur.execute("SELECT 1 FROM sqlite_master WHERE name='raw_incidents_fts'").fetchone()
+    cur.executescript(CREATE_SEARCH_INDEX)
+    if not exists:
+        # Bases anteriores al índice: se indexan una única vez las filas ya importadas
+        cur.execute("INSERT INTO raw_incidents_fts (raw_incidents_fts) VALUES ('rebuild')")
+
+
+def fts_query(text: str) -> str:
+    """
+    Consulta FTS5 segura a partir del texto del usuario: cada palabra (o "frase entre comillas")
+    se busca como frase literal y todas deben aparecer. Patentes como AB-123-CD quedan como frase.
+    """
+    terms = re.findall(r'"([^"]+)"|(\S+)', text)
+    phrases = [(quoted or word).replace('"', '""') for quoted, word in terms]
+    return " AND ".join(f'"{phrase}"' for phrase in phrases if phrase.strip())
+
+
+# Huellas de contenido de los Excel importados (tabla global: en modo shards vive en el catálogo)
+CREATE_FINGERPRINTS = """
+CREATE TABLE IF NOT EXISTS document_fingerprints (
+    fingerprint TEXT PRIMARY KEY,
+    document_id TEXT NOT NULL,
+    file_sha256 TEXT NOT NULL,
+    ruleset_version TEXT NOT NULL,
+    created_at TEXT DEFAULT (datetime('now'))
+);
+CREATE INDEX IF NOT EXISTS ix_fingerprints_document ON document_fingerprints(document_id);
+"""
+
+# Códigos de calificación y modalidad generados desde diccionario_policial.json (tabla global).
+# AUTOINCREMENT: un código dado de baja nunca se reutiliza.
+CREATE_CATEGORY_CODES = """
+CREATE TABLE IF NOT EXISTS category_codes (
+    code INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    parent TEXT NOT NULL DEFAULT '',
+    value TEXT NOT NULL,
+    base_legal TEXT,
+    ruleset_version TEXT NOT NULL,
+    created_at TEXT DEFAULT (datetime('now')),
+    CONSTRAINT uq_category_code UNIQUE (kind, parent, value)
+);
+"""
+
+
+class SQLiteBackend(StorageBackend):
+    """Un único archivo SQLite con una conexión persistente por hilo."""
+
+    name = "sqlite"
+
+    def __init__(self):
+        self._pool = ThreadLocalPool(
+            connect_sqlite,
+            ping,
+            recycle_seconds=DB_POOL_RECYCLE,
+            pre_ping_seconds=DB_POOL_PRE_PING,
+        )
+        self._maintenance_thread: Optional[threading.Thread] = None
+
+    def connection(self, document_id: Optional[str] = None, create: bool = False):
+        return pooled_connection(self._pool)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._pool.stats()
+
+    def init_schema(self) -> None:
+        with self.connection() as conn:
+            create_sqlite_schema(conn)
+        self._init_catalog_tables()
+        if sqlite_performance():
+            self.optimize()
+
+    def _init_catalog_tables(self) -> None:
+        with self._catalog_connection() as conn:
+            conn.executescript(CREATE_FINGERPRINTS)
+            conn.executescript(CREATE_CATEGORY_CODES)
+
+    def find_fingerprint(self, fingerprint: str) -> Optional[str]:
+        with self._catalog_connection() as conn:
+            row = conn.execute(
+                "SELECT document_id FROM document_fingerprints WHERE fingerprint=?", (fingerprint,)
+            ).fetchone()
+            return row[0] if row else None
+
+    def record_fingerprint(self, fingerprint: str, document_id: str, file_sha256: str, ruleset_version: str) -> None:
+        with self._catalog_connection() as conn:
+            conn.execute(
+                "INSERT INTO document_fingerprints (fingerprint, document_id, file_sha256, ruleset_version) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT(fingerprint) DO UPDATE SET "
+                "document_id = excluded.document_id, created_at = datetime('now')",
+                (fingerprint, document_id, file_sha256, ruleset_version),
+            )
+
+    def optimize(self) -> None:
+        """
+        Actualiza estadísticas del planificador: ANALYZE la primera vez, luego PRAGMA optimize
+        (que solo re-analiza las tablas que cambiaron lo suficiente).
+        """
+        with self.connection() as conn:
+            has_stats = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='sqlite_stat1'"
+            ).fetchone()
+            if not has_stats:
+                conn.execute("ANALYZE;")
+            else:
+                conn.execute("PRAGMA optimize;")
+
+    def start_maintenance(self) -> None:
+        """Programa optimize cada SQLITE_OPTIMIZE_INTERVAL segundos (solo perfil performance)."""
+        if not sqlite_performance() or self._maintenance_thread is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(SQLITE_OPTIMIZE_INTERVAL)
+                try:
+                    self.optimize()
+                except Exception:
+                    logger.exception("Error en mantenimiento periódico de SQLite")
+
+        self._maintenance_thread = threading.Thread(target=run, name="sqlite-optimize", daemon=True)
+        self._maintenance_thread.start()
+
+    def drop_document(self, document_id: str) -> None:
+        # Los clasificados caen por ON DELETE CASCADE
+        with self.connection() as conn:
+            conn.execute("DELETE FROM raw_incidents WHERE document_id=?", (document_id,))
+            conn.execute("DELETE FROM document_stats WHERE document_id=?", (document_id,))
+            conn.execute("DELETE FROM classified_rollups WHERE document_id=?", (document_id,))
+        self.forget_fingerprints(document_id)
+
+    def forget_fingerprints(self, document_id: str) -> None:
+        with self._catalog_connection() as conn:
+            conn.execute("DELETE FROM document_fingerprints WHERE document_id=?", (document_id,))
+
+    def _insert_raw(self, conn, document_id: str, rows: List[RawRow]) -> int:
+        placeholders = ",".join(["?"] * len(RAW_INSERT_FIELDS))
+        sql = f"INSERT OR IGNORE INTO raw_incidents ({RAW_INSERT_COLUMNS}) VALUES ({placeholders})"
+        # rowcount (no total_changes): no cuenta las filas que el trigger agrega al índice FTS5
+        cur = conn.cursor()
+        try:
+            cur.executemany(sql, raw_params(document_id, rows))
+            return cur.rowcount
+        finally:
+            cur.close()
+
+    def _record_imported(self, conn, document_id: str, inserted: int, last_row_index: Optional[int]) -> None:
+        conn.execute(
+            "INSERT INTO document_stats (document_id, total_rows, last_row_index) VALUES (?, ?, ?) "
+            "ON CONFLICT(document_id) DO UPDATE SET total_rows = total_rows + excluded.total_rows, "
+            "last_row_index = max(coalesce(last_row_index, excluded.last_row_index), excluded.last_row_index), "
+            "updated_at = datetime('now')",
+            (document_id, inserted, last_row_index),
+        )
+
+    def _record_classified(self, conn, document_id: str, saved: int) -> None:
+        conn.execute(
+            "UPDATE document_stats SET classified_rows = classified_rows + ?, updated_at = datetime('now'), "
+            "last_classified_at = datetime('now') WHERE document_id=?",
+            (saved, document_id),
+        )
+
+    def get_document_stats(self, document_id: str) -> Optional[Dict[str, Any]]:
+        if not self.document_exists(document_id):
+            return None
+        select = f"SELECT {', '.join(DOCUMENT_STATS_COLUMNS)} FROM document_stats WHERE document_id=?"
+        with self.connection(document_id) as conn:
+            row = conn.execute(select, (document_id,)).fetchone()
+            if row is None:
+                # Documento anterior a document_stats: se cuenta una sola vez y queda registrado
+                total, last_row_index = conn.execute(
+                    "SELECT count(*), max(row_index) FROM raw_incidents WHERE document_id=?", (document_id,)
+                ).fetchone()
+                if not total:
+                    return None
+                classified = conn.execute(
+                    "SELECT count(*) FROM classified_incidents WHERE document_id=?", (document_id,)
+                ).fetchone()[0]
+                conn.execute(
+                    "INSERT OR IGNORE INTO document_stats (document_id, total_rows, classified_rows, last_row_index) "
+                    "VALUES (?, ?, ?, ?)",
+                    (document_id, total, classified, last_row_index),
+                )
+                row = conn.execute(select, (document_id,)).fetchone()
+            return dict(zip(DOCUMENT_STATS_COLUMNS, row))
+
+    def _fetch_unclassified(
+        self, conn, document_id: str, limit: int, row_range: Optional[Tuple[int, int]] = None
+    ) -> List[Dict]:
+        in_range = "AND r.row_index BETWEEN ? AND ? " if row_range else ""
+        sql = (
+            f"SELECT {CHUNK_SELECT} FROM raw_incidents r WHERE r.document_id=? {in_range}AND NOT EXISTS (SELECT 1 FROM classified_incidents c WHERE c.raw_incident_id=r.id) "
+            "ORDER BY r.row_index ASC LIMIT ?"
+        )
+        cur = conn.cursor()
+        try:
+            cur.row_factory = sqlite3.Row
+            cur.execute(sql, (document_id, *(row_range or ()), limit))
+            return [dict(row) for row in cur.fetchall()]
+        finally:
+            cur.close()
+
+    def _begin(self, conn) -> None:
+        if not conn.in_transaction:
+            # Sin BEGIN explícito el primer SAVEPOINT abriría (y su RELEASE cerraría) la transacción
+            conn.execute("BEGIN")
+
+    def _insert_classified(self, conn, document_id: str, items: List[Dict]) -> List[int]:
+        # SQLite corre en proceso: cada execute reutiliza la sentencia preparada en caché y su rowcount
+        # dice qué filas entraron (executemany solo informa el total)
+        placeholders = ",".join(["?"] * len(CLASSIFIED_INSERT_FIELDS))
+        sql = f"INSERT OR IGNORE INTO classified_incidents ({CLASSIFIED_INSERT_COLUMNS}) VALUES ({placeholders})"
+        inserted = []
+        cur = conn.cursor()
+        try:
+            for params in classified_params(document_id, items, self.category_codes()):
+                cur.execute(sql, params)
+                if cur.rowcount > 0:
+                    inserted.append(params[1])
+        finally:
+            cur.close()
+        return inserted
+
+    def search(
+        self, query: str, document_ids: Optional[List[str]] = None, limit: int = 20, offset: int = 0
+    ) -> Tuple[List[Tuple], bool]:
+        match = fts_query(query)
+        if not match:
+            return [], False
+        with self.connection() as conn:
+            return self._search_on(conn, match, document_ids, limit, offset)
+
+    def _search_on(
+        self, conn, match: str, document_ids: Optional[List[str]], limit: int, offset: int
+    ) -> Tuple[List[Tuple], bool]:
+        """
+        Ranking bm25 sobre la ventana de SEARCH_RANK_WINDOW coincidencias más recientes, acotada
+        como rango de rowid (FTS5 lo resuelve sin recorrer el resto); las más viejas siguen después
+        de la ventana por rowid descendente. El fragmento se arma después y solo para la página.
+        """
+        # Sin filtro de documentos el rango es toda la tabla (rowid de SQLite es un entero de 64 bits)
+        low, high = 0, 2**63 - 1
+        doc_join, doc_filter, doc_params = "", "", []
+        if document_ids:
+            marks = ", ".join(["?"] * len(document_ids))
+            low, high = conn.execute(
+                f"SELECT min(id), max(id) FROM raw_incidents WHERE document_id IN ({marks})", document_ids
+            ).fetchone()
+            if low is None:
+                return [], False
+            doc_join = " JOIN raw_incidents r ON r.id = raw_incidents_fts.rowid"
+            doc_filter, doc_params = f" AND r.document_id IN ({marks})", list(document_ids)
+        id_range = " AND raw_incidents_fts.rowid BETWEEN ? AND ?"
+        # Primera coincidencia fuera de la ventana: si existe, el ranking queda truncado en ella
+        beyond = conn.execute(
+            f"SELECT raw_incidents_fts.rowid FROM raw_incidents_fts{doc_join} "
+            f"WHERE raw_incidents_fts MATCH ?{id_range}{doc_filter} ORDER BY raw_incidents_fts.rowid DESC LIMIT 1 OFFSET ?",
+            [match, low, high] + doc_params + [SEARCH_RANK_WINDOW],
+        ).fetchone()
+        truncated = beyond is not None
+        page: List[Tuple] = []
+        # bm25: menor = más relevante; se expone negado para que score mayor sea mejor
+        if not truncated or offset < SEARCH_RANK_WINDOW:
+            page = conn.execute(
+                "SELECT raw_incidents_fts.rowid, -bm25(raw_incidents_fts) AS score, 1 FROM raw_incidents_fts "
+                f"JOIN raw_incidents r ON r.id = raw_incidents_fts.rowid WHERE raw_incidents_fts MATCH ?{id_range}{doc_filter} "
+                "ORDER BY score DESC, r.document_id, r.row_index LIMIT ? OFFSET ?",
+                [match, beyond[0] + 1 if truncated else low, high] + doc_params + [limit, offset],
+            ).fetchall()
+        if truncated and len(page) < limit:
+            # Pasada la ventana se pagina por rowid: las coincidencias más viejas no se rankean
+            page += conn.execute(
+                "SELECT raw_incidents_fts.rowid, -bm25(raw_incidents_fts), 0 FROM raw_incidents_fts "
+                f"JOIN raw_incidents r ON r.id = raw_incidents_fts.rowid WHERE raw_incidents_fts MATCH ?{id_range}{doc_filter} "
+                "ORDER BY raw_incidents_fts.rowid DESC LIMIT ? OFFSET ?",
+                [match, low, beyond[0]] + doc_params + [limit - len(page), max(0, offset - SEARCH_RANK_WINDOW)],
+            ).fetchall()
+        if not page:
+            return [], truncated
+        details = {
+            raw_id: (document_id, row_index, snippet)
+            for raw_id, document_id, row_index, snippet in conn.execute(
+                "SELECT r.id, r.document_id, r.row_index, snippet(raw_incidents_fts, -1, '[', ']', '…', 16) "
+                "FROM raw_incidents_fts JOIN raw_incidents r ON r.id = raw_incidents_fts.rowid "
+                f"WHERE raw_incidents_fts MATCH ? AND raw_incidents_fts.rowid IN ({', '.join(['?'] * len(page))})",
+                [match] + [raw_id for raw_id, _, _ in page],
+            )
+        }
+        hits = [
+            (details[raw_id][0], details[raw_id][1], raw_id, score, details[raw_id][2], bool(ranked))
+            for raw_id, score, ranked in page
+            if raw_id in details
+        ]
+        return hits, truncated
+
+    def iter_export_rows(self, document_id: str, fetch_size: int = EXPORT_FETCH_SIZE) -> Iterator[Tuple]:
+        # fetchmany incremental: ningún consumidor materializa el documento en memoria
+        sql = (
+            f"SELECT {EXPORT_SELECT} FROM raw_incidents r "
+            "LEFT JOIN classified_incidents c ON c.raw_incident_id = r.id "
+            "WHERE r.document_id=? ORDER BY r.row_index ASC"
+        )
+        if not self.document_exists(document_id):
+            return
+        codes = self.category_codes()
+        with self.connection(document_id) as conn:
+            cur = conn.cursor()
+            cur.execute(sql, (document_id,))
+            while True:
+                rows = cur.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield decode_export_row(row, codes)
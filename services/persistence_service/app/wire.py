@@ -0,0 +1,154 @@
+"""
+Formato binario de /data/chunk y /data/save_classified_chunk: msgpack columnar (una lista
+de valores por columna en lugar de repetir las claves en cada fila), con compresión gzip
+o zstd opcional. JSON sigue siendo el formato por defecto; el cliente elige con Accept /
+Content-Type y Accept-Encoding / Content-Encoding.
+"""
+import gzip
+import os
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import msgpack
+
+try:  # zstd es opcional: sin el paquete solo se ofrece gzip
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+# Por debajo de este tamaño no se comprime (el costo de CPU no compensa)
+WIRE_COMPRESS_MIN_BYTES = int(os.getenv("WIRE_COMPRESS_MIN_BYTES", "1024"))
+WIRE_GZIP_LEVEL = int(os.getenv("WIRE_GZIP_LEVEL", "1"))
+WIRE_ZSTD_LEVEL = int(os.getenv("WIRE_ZSTD_LEVEL", "3"))
+# Tope del cuerpo descomprimido de un request: un gzip/zstd de pocos KB puede expandirse a GB
+WIRE_MAX_DECOMPRESSED_BYTES = int(os.getenv("WIRE_MAX_DECOMPRESSED_BYTES", str(64 * 1024 * 1024)))
+# Ventana máxima que se acepta en un frame zstd (memoria del descompresor)
+WIRE_ZSTD_MAX_WINDOW = int(os.getenv("WIRE_ZSTD_MAX_WINDOW", str(8 * 1024 * 1024)))
+
+
+class BodyTooLarge(ValueError):
+    """El cuerpo descomprimido supera WIRE_MAX_DECOMPRESSED_BYTES (413)."""
+
+
+def _tokens(header: Optional[str]) -> List[str]:
+    # Valores de un header de negociación, sin parámetros y sin los marcados con q=0
+    tokens = []
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if name and params.replace(" ", "") not in ("q=0", "q=0.0"):
+            tokens.append(name.strip().lower())
+    return tokens
+
+
+def is_msgpack(content_type: Optional[str]) -> bool:
+    return (content_type or "").split(";")[0].strip().lower() == MSGPACK_MEDIA_TYPE
+
+
+def accepts_msgpack(accept: Optional[str]) -> bool:
+    return MSGPACK_MEDIA_TYPE in _tokens(accept)
+
+
+def pick_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """zstd si el cliente lo acepta y está instalado, si no gzip; None para enviar sin comprimir."""
+    tokens = _tokens(accept_encoding)
+    if zstandard is not None and "zstd" in tokens:
+        return "zstd"
+    if "gzip" in tokens:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """(cuerpo, Content-Encoding); los cuerpos chicos se envían sin comprimir."""
+    if encoding is None or len(body) < WIRE_COMPRESS_MIN_BYTES:
+        return body, None
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=WIRE_ZSTD_LEVEL).compress(body), "zstd"
+    return gzip.compress(body, compresslevel=WIRE_GZIP_LEVEL), "gzip"
+
+
+def _gunzip(body: bytes, limit: int) -> bytes:
+    # Miembro por miembro (como gzip.decompress), sin producir más de limit + 1 bytes
+    out = bytearray()
+    data = body
+    while data:
+        decompressor = zlib.decompressobj(wbits=31)
+        out += decompressor.decompress(data, limit + 1 - len(out))
+        if len(out) > limit or decompressor.unconsumed_tail:
+            raise BodyTooLarge(f"el cuerpo descomprimido supera {limit} bytes")
+        if not decompressor.eof:
+            raise ValueError("gzip truncado")
+        data = decompressor.unused_data
+    return bytes(out)
+
+
+def _unzstd(body: bytes, limit: int) -> bytes:
+    out = bytearray()
+    decompressor = zstandard.ZstdDecompressor(max_window_size=WIRE_ZSTD_MAX_WINDOW)
+    with decompressor.stream_reader(body) as reader:
+        while True:
+            block = reader.read(min(1024 * 1024, limit + 1 - len(out)))
+            if not block:
+                return bytes(out)
+            out += block
+            if len(out) > limit:
+                raise BodyTooLarge(f"el cuerpo descomprimido supera {limit} bytes")
+
+
+def decompress(body: bytes, encoding: Optional[str], limit: int = WIRE_MAX_DECOMPRESSED_BYTES) -> bytes:
+    """Cuerpo del request sin Content-Encoding; BodyTooLarge si descomprimido supera `limit` bytes."""
+    encoding = (encoding or "identity").strip().lower()
+    try:
+        if encoding == "identity":
+            return body
+        if encoding == "gzip":
+            return _gunzip(body, limit)
+        if encoding == "zstd" and zstandard is not None:
+            return _unzstd(body, limit)
+    except BodyTooLarge:
+        raise
+    except Exception as exc:
+        raise ValueError(f"cuerpo {encoding} inválido: {exc}")
+    raise ValueError(f"Content-Encoding no soportado: {encoding}")
+
+
+def pack_chunk(document_id: str, columns: Sequence[str], rows: List[Dict], **extra) -> bytes:
+    """Lote de filas sin clasificar en forma columnar: {document_id, count, columns: {col: [valores]}, **extra}."""
+    return msgpack.packb(
+        {"document_id": document_id, "count": len(rows), "columns": {c: [r.get(c) for r in rows] for c in columns}, **extra},
+        use_bin_type=True,
+    )
+
+
+def unpack_items(body: bytes, fields: Sequence[str]) -> Tuple[str, List[Dict]]:
+    """
+    Cuerpo columnar de /data/save_classified_chunk: {document_id, items: {raw_incident_id: [...], col_s: [...], ...}}.
+    Devuelve (document_id, items) con un dict por fila. Se valida la forma completa (mismo largo, ids
+    enteros y textos o nulos) sin construir un modelo por fila; las columnas desconocidas se descartan.
+    """
+    try:
+        payload = msgpack.unpackb(body, raw=False)
+    except Exception as exc:
+        raise ValueError(f"msgpack inválido: {exc}")
+    if not isinstance(payload, dict):
+        raise ValueError("se esperaba un objeto con document_id e items")
+    document_id, columns = payload.get("document_id"), payload.get("items")
+    if not isinstance(document_id, str) or not document_id:
+        raise ValueError("document_id requerido")
+    if not isinstance(columns, dict) or "raw_incident_id" not in columns:
+        raise ValueError("items debe ser un objeto columnar con raw_incident_id")
+    # Las columnas desconocidas se ignoran, igual que las claves de más en JSON
+    columns = {name: values for name, values in columns.items() if name in fields}
+    ids = columns["raw_incident_id"]
+    if not isinstance(ids, list) or any(type(v) is not int for v in ids):
+        raise ValueError("raw_incident_id debe ser una lista de enteros")
+    for name, values in columns.items():
+        if not isinstance(values, list) or len(values) != len(ids):
+            raise ValueError(f"la columna {name} no tiene {len(ids)} valores")
+        if name != "raw_incident_id" and any(v is not None and not isinstance(v, str) for v in values):
+            raise ValueError(f"la columna {name} solo admite textos o nulos")
+    names = list(columns)
+    return document_id, [dict(zip(names, row)) for row in zip(*columns.values())]
@@ -0,0 +1,88 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from .database import insert_classified_group
+
+
+logger = logging.getLogger("persistence_service")
+
+
+class GroupCommitWriter:
+    """
+    Escritor único que agrupa los lotes clasificados de varios workers.
+    Los pedidos se encolan y un hilo dedicado los confirma juntos en una sola transacción
+    cada `window_ms` milisegundos o al juntar `max_rows` filas, lo que ocurra primero.
+    Cada llamador recibe su respuesta recién después del COMMIT (filas durables).
+    """
+
+    def __init__(self, window_ms: float = 5.0, max_rows: int = 5000, max_queue: int = 1000):
+        self._window = window_ms / 1000.0
+        self._max_rows = max_rows
+        self._queue: "queue.Queue[Optional[Tuple[str, List[Dict], Future]]]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self.commits = 0
+        self.batches = 0
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="group-commit-writer", daemon=True)
+            self._thread.start()
+            logger.info(
+                "Group commit activo (ventana=%sms, max_filas=%s)", self._window * 1000, self._max_rows
+            )
+
+    def stop(self) -> None:
+        """Confirma lo pendiente y detiene el hilo escritor."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, document_id: str, items: List[Dict], timeout: Optional[float] = None) -> int:
+        """Encola un lote y espera su COMMIT. Devuelve las filas guardadas o relanza el error del lote."""
+        if not items:
+            return 0
+        future: Future = Future()
+        self._queue.put((document_id, items, future), timeout=timeout)
+        return future.result(timeout=timeout)
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+            group = [first]
+            rows = len(first[1])
+            deadline = time.monotonic() + self._window
+            while rows < self._max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if pending is None:
+                    stopping = True
+                    break
+                group.append(pending)
+                rows += len(pending[1])
+            self._commit(group)
+
+    def _commit(self, group: List[Tuple[str, List[Dict], Future]]) -> None:
+        try:
+            results = insert_classified_group([(document_id, items) for document_id, items, _ in group])
+        except Exception as exc:
+            results = [(None, exc) for _ in group]
+        self.commits += 1
+        self.batches += len(group)
+        for (_, _, future), (saved, error) in zip(group, results):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(saved)
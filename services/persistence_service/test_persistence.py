@@ -2,6 +2,7 @@ import os
 import sqlite3
 import threading
 import time
+import uuid
 from pathlib import Path
 
 os.environ.setdefault("DATABASE_URL", "sqlite:///./test_persistence.db")
@@ -11,7 +12,30 @@ import uvicorn
 from openpyxl import load_workbook
 
 import psycopg2
+from app.database import (
+    EXPORT_COLUMNS,
+    apply_document_delta,
+    fetch_unclassified_chunk,
+    fetch_unclassified_chunks,
+    get_connection,
+    get_document_stats,
+    init_db,
+    insert_classified_group,
+    insert_classified_items,
+    insert_raw_incident,
+    insert_raw_incidents,
+    iter_export_rows,
+    rollup_counts,
+    save_classified_and_fetch_next,
+    search_incidents,
+    unclassified_row_ranges,
+)
+from app import inline_classifier
 from app.main import app
+from app.models import SaveClassifiedChunkRequest, SaveClassifiedItem, save_classified_adapter
+from app.storage import get_backend
+from app.storage.pool import ThreadLocalPool
+from app.wire import compress, decompress, pack_chunk, unpack_items
 
 
 def _is_postgres(url: str) -> bool:
@@ -161,6 +185,369 @@ def test_full_flow():
             pass
 
 
+def test_iter_export_rows_left_join_ordenado():
+    init_db()
+    document_id = str(uuid.uuid4())
+    for row_index in (5, 2, 3):
+        insert_raw_incident(document_id, row_index, None, [f"a{row_index}"] + [None] * 16)
+
+    rows = list(iter_export_rows(document_id))
+    assert [r[0] for r in rows] == [2, 3, 5]
+
+    # Clasificar solo la fila 3; el resto debe exportarse con R..AB vacías
+    raw_id_3 = rows[1][1]
+    insert_classified_items(document_id, [{"raw_incident_id": raw_id_3, "col_s": "ROBO"}])
+
+    rows = list(iter_export_rows(document_id, fetch_size=1))
+    assert len(rows) == 3
+    assert len(rows[0]) == 2 + 17 + 11
+    assert rows[1][2] == "a3"
+    assert rows[1][2 + 17 + 1] == "ROBO"
+    assert all(v is None for v in rows[0][2 + 17:])
+    assert all(v is None for v in rows[2][2 + 17:])
+
+
+def test_insert_classified_items_lote_atomico():
+    init_db()
+    document_id = str(uuid.uuid4())
+    for row_index in range(2, 6):
+        insert_raw_incident(document_id, row_index, None, [None] * 17)
+    raw_ids = [r[1] for r in iter_export_rows(document_id)]
+
+    # Duplicados dentro del lote no se cuentan dos veces
+    saved = insert_classified_items(document_id, [{"raw_incident_id": raw_ids[0]}, {"raw_incident_id": raw_ids[0]}])
+    assert saved == 1
+
+    # Un item inválido revierte el lote completo
+    try:
+        insert_classified_items(document_id, [{"raw_incident_id": raw_ids[1]}, {"raw_incident_id": -1}])
+        assert False, "Se esperaba error por clave foránea inválida"
+    except Exception as exc:
+        assert "ROLLBACK" in str(exc)
+    assert insert_classified_items(document_id, [{"raw_incident_id": i} for i in raw_ids]) == 3
+
+
+def test_document_stats_contadores_en_la_transaccion():
+    init_db()
+    document_id = str(uuid.uuid4())
+    assert get_document_stats(document_id) is None
+
+    imported = insert_raw_incidents(document_id, ((row_index, None, [None] * 17) for row_index in (2, 3, 7)))
+    assert imported == 3
+    raw_ids = [r[1] for r in iter_export_rows(document_id)]
+
+    insert_classified_items(document_id, [{"raw_incident_id": raw_ids[0]}, {"raw_incident_id": raw_ids[1]}])
+    # Reenviar un lote ya guardado o uno que falla no mueve los contadores
+    insert_classified_items(document_id, [{"raw_incident_id": raw_ids[0]}])
+    try:
+        insert_classified_items(document_id, [{"raw_incident_id": raw_ids[2]}, {"raw_incident_id": -1}])
+    except Exception:
+        pass
+
+    stats = get_document_stats(document_id)
+    assert stats["total_rows"] == 3
+    assert stats["classified_rows"] == 2
+    assert stats["last_row_index"] == 7
+
+
+def test_apply_document_delta_solo_diferencias():
+    init_db()
+    document_id = str(uuid.uuid4())
+    insert_raw_incidents(document_id, [(i, None, [f"v{i}"] + [None] * 16) for i in range(2, 6)])
+    raw_ids = {r[0]: r[1] for r in iter_export_rows(document_id)}
+    insert_classified_items(document_id, [{"raw_incident_id": raw_ids[i], "col_s": "ROBO"} for i in (2, 3)])
+
+    # Fila 3 corregida, fila 5 quitada, filas 6 y 7 nuevas; 2 y 4 iguales
+    version_2 = [(2, None, ["v2"] + [None] * 16), (3, None, ["corregida"] + [None] * 16), (4, None, ["v4"] + [None] * 16)]
+    version_2 += [(i, None, [f"v{i}"] + [None] * 16) for i in (6, 7)]
+    delta = apply_document_delta(document_id, version_2)
+    assert (delta["inserted"], delta["updated"], delta["unchanged"], delta["removed"]) == (2, 1, 2, 1)
+
+    rows = {r[0]: r for r in iter_export_rows(document_id)}
+    assert sorted(rows) == [2, 3, 4, 6, 7]
+    assert rows[2][1] == raw_ids[2] and rows[2][2 + 17 + 1] == "ROBO"  # conserva su clasificación
+    assert rows[3][2] == "corregida" and rows[3][2 + 17 + 1] is None  # vuelve a quedar pendiente
+    stats = get_document_stats(document_id)
+    assert (stats["total_rows"], stats["classified_rows"], stats["last_row_index"]) == (5, 1, 7)
+    assert apply_document_delta(str(uuid.uuid4()), version_2) is None
+
+
+def test_category_codes_se_guardan_como_enteros():
+    init_db()
+    backend = get_backend()
+    calificacion = f"PRUEBA {uuid.uuid4().hex[:8]}"
+    entries = [("calificacion", "", calificacion, "Art. 1"), ("modalidad", calificacion, "EN RIÑA", "Art. 2")]
+    assert backend.sync_category_codes(entries, "v1") == 2
+    assert backend.sync_category_codes(entries, "v2") == 0  # los códigos no se reasignan
+    s_code, t_code = backend.category_codes().encode(calificacion, "EN RIÑA")
+    assert s_code is not None and t_code is not None
+    assert backend.category_codes().base_legal(t_code) == "Art. 2"
+
+    document_id = str(uuid.uuid4())
+    insert_raw_incidents(document_id, [(i, None, [f"v{i}"] + [None] * 16) for i in (2, 3)])
+    raw_ids = [r[1] for r in iter_export_rows(document_id)]
+    insert_classified_items(document_id, [
+        {"raw_incident_id": raw_ids[0], "col_s": calificacion, "col_t": "EN RIÑA"},
+        {"raw_incident_id": raw_ids[1], "col_s": "TEXTO LIBRE", "col_t": "EN RIÑA"},
+    ])
+
+    p = backend.placeholder
+    with get_connection(document_id) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT col_s, col_t, col_s_code, col_t_code FROM classified_incidents WHERE document_id={p} "
+            "ORDER BY raw_incident_id",
+            (document_id,),
+        )
+        stored = [tuple(row) for row in cur.fetchall()]
+        cur.close()
+    assert stored == [(None, None, s_code, t_code), ("TEXTO LIBRE", "EN RIÑA", None, None)]
+
+    col_s, col_t = EXPORT_COLUMNS.index("col_s"), EXPORT_COLUMNS.index("col_t")
+    assert [(r[col_s], r[col_t]) for r in iter_export_rows(document_id)] == [
+        (calificacion, "EN RIÑA"),
+        ("TEXTO LIBRE", "EN RIÑA"),
+    ]
+
+
+def test_rollups_se_actualizan_al_guardar():
+    init_db()
+    document_id = str(uuid.uuid4())
+    fechas = ["2025-01-03 00:00:00", "2025-01-20 00:00:00", "15/02/2025"]
+    filas = [(i, None, [f"v{i}"] + [None] * 5 + [fecha] + [None] * 10) for i, fecha in enumerate(fechas, 2)]
+    insert_raw_incidents(document_id, filas)
+    raw_ids = [r[1] for r in iter_export_rows(document_id)]
+    insert_classified_items(document_id, [
+        {"raw_incident_id": raw_ids[0], "col_s": "ROBO", "col_r": "JCP"},
+        {"raw_incident_id": raw_ids[1], "col_s": "ROBO", "col_r": "JCP"},
+        {"raw_incident_id": raw_ids[2], "col_s": "HURTO", "col_r": "JCP"},
+    ])
+    # Reenviar un lote ya guardado no suma de nuevo
+    insert_classified_items(document_id, [{"raw_incident_id": raw_ids[0], "col_s": "ROBO", "col_r": "JCP"}])
+
+    assert rollup_counts(["calificacion", "mes"], [document_id]) == [
+        ("ROBO", "2025-01", 2),
+        ("HURTO", "2025-02", 1),
+    ]
+    assert rollup_counts(["jurisdiccion"], [document_id], {"calificacion": "ROBO"}) == [("JCP", 2)]
+
+    # Una fila corregida pierde su clasificación y su aporte a los conteos
+    apply_document_delta(document_id, [(2, None, ["corregida"] + filas[0][2][1:])] + filas[1:])
+    assert rollup_counts(["calificacion"], [document_id]) == [("HURTO", 1), ("ROBO", 1)]
+
+
+def test_search_incidents_indexa_al_importar():
+    init_db()
+    document_id, otro_id = str(uuid.uuid4()), str(uuid.uuid4())
+    alias = f"alias{uuid.uuid4().hex[:8]}"
+    insert_raw_incidents(document_id, [
+        (2, None, [None] * 16 + [f"vecino apodado {alias} huye en moto"]),
+        (3, None, [None] * 16 + [f"{alias} {alias} visto en la plaza"]),
+        (4, None, [None] * 16 + ["sin novedad"]),
+    ])
+    insert_raw_incidents(otro_id, [(2, None, [None] * 16 + [f"denuncia contra {alias}"])])
+
+    hits, truncated = search_incidents(alias)
+    assert len(hits) == 3 and not truncated
+    assert all(hit[0] in (document_id, otro_id) and alias in hit[4] and hit[5] for hit in hits)
+    assert [hit[1] for hit in search_incidents(f"{alias} moto", [document_id])[0]] == [2]
+    pagina = search_incidents(alias, [document_id], limit=1, offset=1)[0]
+    assert len(pagina) == 1 and pagina[0][1] in (2, 3)
+
+    # El import incremental reindexa las filas que cambian
+    apply_document_delta(document_id, [(2, None, [None] * 16 + ["relato corregido"]), (4, None, [None] * 16 + ["sin novedad"])])
+    assert search_incidents(alias, [document_id]) == ([], False)
+
+
+def test_search_pagina_pasada_la_ventana_de_ranking(monkeypatch):
+    from app.storage import postgres, sqlite
+
+    init_db()
+    document_id = str(uuid.uuid4())
+    alias = f"alias{uuid.uuid4().hex[:8]}"
+    insert_raw_incidents(document_id, [(i, None, [None] * 16 + [f"{alias} fila {i}"]) for i in range(2, 7)])
+    monkeypatch.setattr(sqlite, "SEARCH_RANK_WINDOW", 2)
+    monkeypatch.setattr(postgres, "SEARCH_RANK_WINDOW", 2)
+
+    # Se rankean las 2 más recientes; las demás siguen por antigüedad y ninguna se pierde
+    hits, truncated = search_incidents(alias, [document_id], limit=10)
+    assert truncated
+    assert [(hit[1], hit[5]) for hit in hits[2:]] == [(4, False), (3, False), (2, False)]
+    assert sorted(hit[1] for hit in hits[:2]) == [5, 6] and all(hit[5] for hit in hits[:2])
+    paginas = [search_incidents(alias, [document_id], limit=2, offset=offset)[0] for offset in (0, 2, 4)]
+    assert [hit for pagina in paginas for hit in pagina] == hits
+
+
+def test_save_classified_and_fetch_next():
+    init_db()
+    document_id = str(uuid.uuid4())
+    insert_raw_incidents(document_id, [(i, None, [f"fila {i}"] * 17) for i in range(2, 7)])
+    primer_lote = save_classified_and_fetch_next(document_id, [], 2)[1]
+    assert [r["row_index"] for r in primer_lote] == [2, 3]
+
+    # El guardado y la lectura del siguiente lote van en la misma transacción: no repite filas guardadas
+    saved, siguiente = save_classified_and_fetch_next(document_id, [{"raw_incident_id": r["id"], "col_s": "HURTO"} for r in primer_lote], 2)
+    assert saved == 2 and [r["row_index"] for r in siguiente] == [4, 5]
+    # Reintentar el mismo lote no duplica y con limit=0 solo guarda
+    assert save_classified_and_fetch_next(document_id, [{"raw_incident_id": primer_lote[0]["id"], "col_s": "HURTO"}], 0) == (0, [])
+    assert get_document_stats(document_id)["classified_rows"] == 2
+
+
+def test_cola_de_lotes_rangos_sin_clasificar():
+    init_db()
+    document_id = str(uuid.uuid4())
+    insert_raw_incidents(document_id, [(i, None, [f"fila {i}"] * 17) for i in (2, 3, 5, 6, 9)])
+    fila_3 = fetch_unclassified_chunk(document_id, 2)[1]
+    insert_classified_items(document_id, [{"raw_incident_id": fila_3["id"], "col_s": "HURTO"}])
+
+    # Los descriptores cubren solo las filas sin clasificar, con hasta `size` filas cada uno
+    assert unclassified_row_ranges(document_id, 2) == [(2, 5, 2), (6, 9, 2)]
+    assert [r["row_index"] for r in fetch_unclassified_chunk(document_id, 100, (2, 5))] == [2, 5]
+    assert unclassified_row_ranges(str(uuid.uuid4()), 2) == []
+
+
+def test_clasificacion_en_proceso_de_documentos_chicos(monkeypatch):
+    init_db()
+    document_id = str(uuid.uuid4())
+    insert_raw_incidents(document_id, [(i, None, [None] * 16 + [f"relato {i}: disparo con arma de fuego"]) for i in (2, 3)])
+    # Como un worker, se lee toda la fila: el texto en otra columna también cuenta
+    insert_raw_incidents(document_id, [(4, None, [None] * 2 + ["relato 4: disparo con arma de fuego"] + [None] * 14)])
+
+    # Por encima del umbral el documento queda para los workers
+    monkeypatch.setattr(inline_classifier, "INLINE_CLASSIFY_MAX_ROWS", 2)
+    assert inline_classifier.classify_inline(document_id) is None
+    monkeypatch.setattr(inline_classifier, "INLINE_CLASSIFY_MAX_ROWS", 3)
+    assert inline_classifier.classify_inline(document_id) == 3
+    assert get_document_stats(document_id)["classified_rows"] == 3
+    col_s = EXPORT_COLUMNS.index("col_s")
+    assert all(row[col_s] == "TENENCIA DE ARMAS" for row in iter_export_rows(document_id))
+    # Sin filas pendientes no vuelve a clasificar
+    assert inline_classifier.classify_inline(document_id) is None
+
+
+def test_lotes_combinados_de_varios_documentos():
+    init_db()
+    documentos = [str(uuid.uuid4()) for _ in range(3)]
+    for document_id, filas in zip(documentos, (3, 2, 4)):
+        insert_raw_incidents(document_id, [(i, None, [f"fila {i}"] * 17) for i in range(2, 2 + filas)])
+
+    # Se llena el límite en orden; el tercero no entra y no aparece
+    lotes = fetch_unclassified_chunks(documentos, 4)
+    assert [(doc, len(rows)) for doc, rows in lotes] == [(documentos[0], 3), (documentos[1], 1)]
+
+    # Guardado por documento; el primero queda sin pendientes (lista vacía)
+    resultados = insert_classified_group([(doc, [{"raw_incident_id": r["id"], "col_s": "HURTO"} for r in rows]) for doc, rows in lotes])
+    assert resultados == [(3, None), (1, None)]
+    assert [(doc, len(rows)) for doc, rows in fetch_unclassified_chunks(documentos, 10)] == [
+        (documentos[0], 0), (documentos[1], 1), (documentos[2], 4)
+    ]
+
+
+def test_pool_por_hilo_libera_desde_otro_hilo():
+    pool = ThreadLocalPool(lambda: sqlite3.connect(":memory:", check_same_thread=False), lambda c: c.execute("SELECT 1"), 3600, 0)
+    conn = pool.acquire()
+
+    # Un export en streaming termina en otro hilo: la conexión vuelve al hilo que la tomó, abierta
+    hilo = threading.Thread(target=pool.release, args=(conn,))
+    hilo.start()
+    hilo.join()
+    assert pool.acquire() is conn
+    conn.execute("SELECT 1")
+    assert pool.stats()["overflow"] == 0
+
+    # Descartada desde otro hilo: el dueño abre una nueva en el próximo acquire
+    hilo = threading.Thread(target=pool.release, args=(conn, True))
+    hilo.start()
+    hilo.join()
+    nueva = pool.acquire()
+    assert nueva is not conn and pool.stats()["overflow"] == 0
+    pool.release(nueva)
+    pool.close_all()
+
+
+def test_wire_msgpack_columnar():
+    import msgpack
+
+    filas = [{"id": 1, "row_index": 2, "col_p": "ROBO", "col_q": "relato"}, {"id": 2, "row_index": 3, "col_p": None, "col_q": "otro"}]
+    body, encoding = compress(pack_chunk("doc", ["id", "row_index", "col_q"], filas), "gzip")
+    lote = msgpack.unpackb(decompress(body, encoding))
+    assert lote["count"] == 2 and lote["columns"] == {"id": [1, 2], "row_index": [2, 3], "col_q": ["relato", "otro"]}
+
+    fields = list(SaveClassifiedItem.model_fields)
+    guardar = msgpack.packb({"document_id": "doc", "items": {"raw_incident_id": [1, 2], "col_s": ["ROBO", None]}})
+    assert unpack_items(guardar, fields) == ("doc", [{"raw_incident_id": 1, "col_s": "ROBO"}, {"raw_incident_id": 2, "col_s": None}])
+    for invalido in (
+        {"document_id": "doc", "items": {"raw_incident_id": [1, 2], "col_s": ["ROBO"]}},
+        {"document_id": "doc", "items": {"raw_incident_id": ["1"]}},
+    ):
+        try:
+            unpack_items(msgpack.packb(invalido), fields)
+        except ValueError:
+            continue
+        raise AssertionError(f"se aceptó un lote inválido: {invalido}")
+
+
+def test_columnas_desconocidas_se_ignoran_en_json_y_msgpack():
+    import json
+
+    import msgpack
+
+    # El mismo lote con una columna de más se acepta igual en los dos formatos y la columna se descarta
+    esperado = ("doc", [{"raw_incident_id": 1, "col_s": "ROBO"}])
+    lote_json = save_classified_adapter.validate_json(
+        json.dumps({"document_id": "doc", "items": [{"raw_incident_id": 1, "col_s": "ROBO", "col_q": "x"}]})
+    )
+    assert (lote_json["document_id"], lote_json["items"]) == esperado
+    lote_msgpack = msgpack.packb({"document_id": "doc", "items": {"raw_incident_id": [1], "col_s": ["ROBO"], "col_q": ["x"]}})
+    assert unpack_items(lote_msgpack, list(SaveClassifiedItem.model_fields)) == esperado
+
+
+def test_cuerpo_comprimido_con_tope_de_descompresion():
+    import gzip
+
+    from fastapi.testclient import TestClient
+
+    from app.wire import BodyTooLarge
+
+    cuerpo = b"x" * 4096
+    assert decompress(gzip.compress(cuerpo) * 2, "gzip", limit=8192) == cuerpo * 2
+    for bomba in (gzip.compress(b"\0" * 8193), gzip.compress(cuerpo) * 3):
+        try:
+            decompress(bomba, "gzip", limit=8192)
+        except BodyTooLarge:
+            continue
+        raise AssertionError("se descomprimió por encima del tope")
+
+    # Unos KB de gzip que descomprimidos superan el tope del servicio: 413 sin materializarlos
+    bomba = gzip.compress(b"\0" * (64 * 1024 * 1024 + 1), compresslevel=9)
+    r = TestClient(app).post(
+        "/data/save_classified_chunk",
+        content=bomba,
+        headers={"Content-Type": "application/x-msgpack", "Content-Encoding": "gzip"},
+    )
+    assert len(bomba) < 100_000 and r.status_code == 413
+
+
+def test_lean_schema_valida_igual_que_el_modelo():
+    from pydantic import ValidationError
+
+    valido = {"document_id": "doc", "items": [{"raw_incident_id": "7", "col_s": "ROBO", "extra": 1}, {"raw_incident_id": 8}]}
+    esperado = [item.model_dump(exclude_unset=True) for item in SaveClassifiedChunkRequest.model_validate(valido).items]
+    assert save_classified_adapter.validate_python(valido)["items"] == esperado == [{"raw_incident_id": 7, "col_s": "ROBO"}, {"raw_incident_id": 8}]
+    for invalido in (
+        {"items": []},
+        {"document_id": "doc", "items": [{"col_s": "ROBO"}]},
+        {"document_id": "doc", "items": [{"raw_incident_id": 1, "col_s": 5}]},
+    ):
+        errores = []
+        for validar in (SaveClassifiedChunkRequest.model_validate, save_classified_adapter.validate_python):
+            try:
+                validar(invalido)
+            except ValidationError as exc:
+                errores.append([(e["type"], e["loc"]) for e in exc.errors()])
+        assert len(errores) == 2 and errores[0] == errores[1], invalido
+
+
 if __name__ == "__main__":
     test_full_flow()
     print("OK - test_full_flow completado")